@@ -5,8 +5,22 @@ from django.urls import reverse, path
 from django.utils.safestring import mark_safe
 from django.utils import timezone
 from django.contrib import messages
-from django.http import HttpResponseRedirect
-from .models import Product, ProductImage, ProductSize, Order, OrderItem
+from django.http import HttpResponseRedirect, JsonResponse
+from django.template.response import TemplateResponse
+import io
+import json
+from datetime import timedelta
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.db.models import Count, DecimalField, Exists, F, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from .models import (
+    DailyProductSalesRollup, DailySalesRollup, InventoryRollup, Order, OrderItem, Product, ProductImage,
+    ProductSize, RollupCheckpoint,
+)
+from .inventory import EXPORT_HEADER, InventoryImportError, export_rows, import_inventory
+from .streaming import streaming_csv_response
+from .order_export import FORMATS as EXPORT_FORMATS, filter_orders, streaming_export_response
 
 
 class ProductImageInlineForm(forms.ModelForm):
@@ -51,6 +65,11 @@ class ProductImageInline(admin.TabularInline):
         return formset
 
 
+class InventoryImportForm(forms.Form):
+    csv_file = forms.FileField(label='CSV file', help_text='Columns: product (id), size, price, stock')
+    dry_run = forms.BooleanField(required=False, help_text='Validate the file without saving anything')
+
+
 @admin.register(ProductImage)
 class ProductImageAdmin(admin.ModelAdmin):
     """Hidden admin for delete functionality"""
@@ -67,10 +86,32 @@ class ProductSizeInline(admin.TabularInline):
     fields = ['size', 'price', 'stock']
 
 
+class BrandListFilter(admin.SimpleListFilter):
+    """Brand filter backed by a cached brand list instead of a DISTINCT scan per page load."""
+    title = 'brand'
+    parameter_name = 'brand'
+    cache_key = 'admin_product_brands'
+    cache_timeout = 300
+
+    def lookups(self, request, model_admin):
+        brands = cache.get(self.cache_key)
+        if brands is None:
+            brands = list(
+                Product.objects.exclude(brand='').order_by('brand').values_list('brand', flat=True).distinct()
+            )
+            cache.set(self.cache_key, brands, self.cache_timeout)
+        return [(brand, brand) for brand in brands]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(brand=self.value())
+        return queryset
+
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ['name', 'brand', 'category', 'base_price', 'is_on_sale', 'is_trending', 'in_stock', 'is_published', 'created_at', 'publish_button']
-    list_filter = ['brand', 'category', 'is_on_sale', 'is_trending', 'is_published', 'created_at']
+    list_display = ['name', 'brand', 'category', 'base_price', 'min_price', 'max_price', 'total_stock', 'image_count', 'is_on_sale', 'is_trending', 'in_stock', 'is_published', 'publish_at', 'created_at', 'publish_button']
+    list_filter = [BrandListFilter, 'category', 'is_on_sale', 'is_trending', 'is_published', 'created_at']
     search_fields = ['name', 'brand', 'description']
     inlines = [ProductImageInline, ProductSizeInline]
     
@@ -81,11 +122,77 @@ class ProductAdmin(admin.ModelAdmin):
         ('Flags', {
             'fields': ('is_on_sale', 'is_trending')
         }),
+        ('Scheduled release', {
+            'fields': ('publish_at',),
+            'description': 'Leave empty to publish manually. Scheduled products stay hidden from the shop until this time.',
+        }),
         ('Description', {
             'fields': ('description',)
         }),
     )
     
+    def get_queryset(self, request):
+        # Annotate the per-row stock/price/image figures so the changelist
+        # runs a single query instead of several per product
+        qs = super().get_queryset(request)
+        sizes = ProductSize.objects.filter(product=OuterRef('pk'))
+        in_stock_sizes = sizes.filter(stock__gt=0)
+        price_field = DecimalField(max_digits=10, decimal_places=2)
+        return qs.annotate(
+            _in_stock=Exists(in_stock_sizes),
+            _total_stock=Coalesce(
+                Subquery(sizes.order_by().values('product').annotate(total=Sum('stock')).values('total')),
+                0, output_field=IntegerField(),
+            ),
+            # Same semantics as Product.min_price()/max_price(): in-stock sizes, else base price
+            _min_price=Coalesce(
+                Subquery(in_stock_sizes.order_by('price').values('price')[:1]),
+                F('base_price'), output_field=price_field,
+            ),
+            _max_price=Coalesce(
+                Subquery(in_stock_sizes.order_by('-price').values('price')[:1]),
+                F('base_price'), output_field=price_field,
+            ),
+            _image_count=Coalesce(
+                Subquery(
+                    ProductImage.objects.filter(product=OuterRef('pk')).order_by()
+                    .values('product').annotate(n=Count('pk')).values('n')
+                ),
+                0, output_field=IntegerField(),
+            ),
+        )
+
+    def in_stock(self, obj):
+        return obj._in_stock
+    in_stock.boolean = True
+    in_stock.admin_order_field = '_in_stock'
+    in_stock.short_description = 'In stock'
+
+    def total_stock(self, obj):
+        return obj._total_stock
+    total_stock.admin_order_field = '_total_stock'
+    total_stock.short_description = 'Stock'
+
+    def min_price(self, obj):
+        return obj._min_price
+    min_price.admin_order_field = '_min_price'
+    min_price.short_description = 'Min price'
+
+    def max_price(self, obj):
+        return obj._max_price
+    max_price.admin_order_field = '_max_price'
+    max_price.short_description = 'Max price'
+
+    def image_count(self, obj):
+        return obj._image_count
+    image_count.admin_order_field = '_image_count'
+    image_count.short_description = 'Images'
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if 'brand' in form.changed_data:
+            cache.delete(BrandListFilter.cache_key)
+
     def save_formset(self, request, form, formset, change):
         instances = formset.save(commit=False)
         
@@ -113,80 +220,111 @@ class ProductAdmin(admin.ModelAdmin):
     actions = ['publish_selected']
 
     def publish_selected(self, request, queryset):
-        """Admin action to publish all selected products (always posts, even if already published)."""
+        """Admin action to publish all selected products (always posts, even if already published).
+
+        Posts are queued on the rate-limited Graph API worker (brt/outbound.py);
+        new drops go ahead of re-posts of products that were already published.
+        """
+        from django.db import transaction
+        from .outbound import NEW_DROP, REPOST, scheduler
+
         count = 0
         for product in queryset:
-            # Always mark as published and update timestamp
+            priority = REPOST if product.is_published else NEW_DROP
+            # Always mark as published and update timestamp; the post is
+            # queued in the same transaction, so it can't be lost
             product.is_published = True
             product.published_at = timezone.now()
-            product.save(update_fields=['is_published', 'published_at'])
-            # Call posting helpers (if available)
-            try:
-                from .signals import post_multiple_to_facebook, post_instagram_carousel, _build_full_image_url, _upload_image_to_cloudinary
-                import os
-                from django.conf import settings
-                
-                # Collect and process image URLs (upload local images to Cloudinary)
-                image_urls = []
-                for img in product.images.all().order_by('order'):
-                    if not getattr(img, 'image', None):
-                        continue
-                    
-                    img_url = _build_full_image_url(img.image)
-                    if not img_url:
-                        continue
-                    
-                    # If URL is relative or self-hosted, upload to Cloudinary
-                    site_url = os.environ.get('SITE_URL') or os.environ.get('RENDER_EXTERNAL_HOSTNAME') or getattr(settings, 'RENDER_EXTERNAL_HOSTNAME', None)
-                    normalized_site = None
-                    if site_url:
-                        if not site_url.startswith('http'):
-                            site_url = 'https://' + site_url
-                        normalized_site = site_url.rstrip('/')
-                    
-                    should_upload = False
-                    if img_url.startswith('/'):
-                        should_upload = True
-                    elif normalized_site and img_url.startswith(normalized_site):
-                        should_upload = True
-                    
-                    if should_upload:
-                        cloudinary_url = _upload_image_to_cloudinary(img.image)
-                        if cloudinary_url:
-                            img_url = cloudinary_url
-                    
-                    image_urls.append(img_url)
-                
-                # Build sizes/stock/price string
-                size_lines = []
-                for size_obj in product.sizes.all():
-                    size_str = f"{size_obj.size} ({size_obj.stock}) - ₱{size_obj.price}"
-                    size_lines.append(size_str)
-                sizes_info = "\n".join(size_lines)
-                message = (
-                    f"🔥 Fresh Drop Alert! 🔥\n"
-                    f"Step up your game with the new {product.brand} {product.name}!\n\n"
-                    f"Sizes & Stock:\n{sizes_info}\n\n"
-                    f"Tap the link to see more photos and details: https://www.sidestep.studio/product/{product.id}/\n"
-                    f"DM us to reserve your pair or ask questions! #sidestep #sneakerhead #newdrop"
-                )
-                if image_urls:
-                    post_multiple_to_facebook(message, image_urls)
-                    post_instagram_carousel(message, image_urls)
-            except Exception:
-                # don't block the admin action on posting errors
-                pass
+            with transaction.atomic():
+                product.save(update_fields=['is_published', 'published_at'])
+                scheduler.submit('brt.signals.post_product_drop', product.pk, 'admin_action',
+                                 priority=priority, name=f'publish product {product.pk}')
             count += 1
-        self.message_user(request, f"Published {count} products.")
+        self.message_user(request, f"Published {count} products; social posts are queued.")
     publish_selected.short_description = 'Publish selected products (post to FB/IG)'
 
     def get_urls(self):
         urls = super().get_urls()
         custom = [
             path('<int:product_id>/publish/', self.admin_site.admin_view(self.publish_product_view), name='brt_product_publish'),
+            path('inventory/import/', self.admin_site.admin_view(self.inventory_import_view), name='brt_product_inventory_import'),
+            path('inventory/export/', self.admin_site.admin_view(self.inventory_export_view), name='brt_product_inventory_export'),
+            path('<int:product_id>/images/sign/', self.admin_site.admin_view(self.image_upload_sign_view), name='brt_product_image_sign'),
+            path('<int:product_id>/images/register/', self.admin_site.admin_view(self.image_upload_register_view), name='brt_product_image_register'),
         ]
         return custom + urls
 
+    def _upload_request(self, request, product_id):
+        if request.method != 'POST':
+            return None, JsonResponse({'error': 'POST required'}, status=405)
+        product = Product.objects.filter(pk=product_id).first()
+        if product is None or not self.has_change_permission(request, product):
+            raise PermissionDenied
+        try:
+            return (product, json.loads(request.body)), None
+        except ValueError:
+            return None, JsonResponse({'error': 'Invalid JSON'}, status=400)
+
+    def image_upload_sign_view(self, request, product_id):
+        """Signed form for uploading one image straight to storage (brt/uploads.py)."""
+        from .uploads import UploadError, sign
+
+        parsed, error = self._upload_request(request, product_id)
+        if error:
+            return error
+        product, data = parsed
+        try:
+            return JsonResponse(sign(product, str(data.get('filename', '')), data.get('content_type'), int(data.get('size') or 0)))
+        except (UploadError, ValueError) as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+    def image_upload_register_view(self, request, product_id):
+        """Record an image the browser uploaded directly; the file never passes through here."""
+        from .uploads import UploadError, register
+
+        parsed, error = self._upload_request(request, product_id)
+        if error:
+            return error
+        product, data = parsed
+        try:
+            image = register(product, str(data.get('token', '')), data.get('reply'))
+        except UploadError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        return JsonResponse({'id': image.pk, 'url': image.image.url, 'width': image.width, 'height': image.height}, status=201)
+
+    def inventory_import_view(self, request):
+        """Upload a CSV of (product, size, price, stock) rows and upsert them."""
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        result = None
+        form = InventoryImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            # Large uploads are spooled to disk by Django; wrap the file so
+            # rows are decoded and read lazily instead of all at once
+            upload = io.TextIOWrapper(form.cleaned_data['csv_file'], encoding='utf-8-sig', newline='')
+            try:
+                result = import_inventory(upload, dry_run=form.cleaned_data['dry_run'])
+            except (InventoryImportError, UnicodeDecodeError) as e:
+                self.message_user(request, f'Import failed: {e}', level=messages.ERROR)
+            else:
+                level = messages.WARNING if result.error_count else messages.SUCCESS
+                prefix = 'Dry run: ' if form.cleaned_data['dry_run'] else ''
+                self.message_user(request, f'{prefix}{result}', level=level)
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Import inventory',
+            'form': form,
+            'result': result,
+        }
+        return TemplateResponse(request, 'admin/brt/product/inventory_import.html', context)
+
+    def inventory_export_view(self, request):
+        """Stream every ProductSize row as CSV."""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        return streaming_csv_response(export_rows(), 'inventory.csv', header=EXPORT_HEADER)
+
     def publish_button(self, obj):
         if getattr(obj, 'is_published', False):
             return mark_safe('<span style="color:green">Published</span>')
@@ -200,70 +338,29 @@ class ProductAdmin(admin.ModelAdmin):
         if not product:
             self.message_user(request, 'Product not found', level=messages.ERROR)
             return HttpResponseRedirect(request.META.get('HTTP_REFERER', '/admin/'))
-        # Mark published
+        from django.db import transaction
+        from .outbound import NEW_DROP, scheduler
+
+        # Mark published and queue the FB/IG post together
         product.is_published = True
         product.published_at = timezone.now()
-        product.save(update_fields=['is_published', 'published_at'])
-        # Post to FB/IG
-        try:
-            from .signals import post_multiple_to_facebook, post_instagram_carousel, _build_full_image_url, _upload_image_to_cloudinary
-            import os
-            from django.conf import settings
-            
-            # Collect and process image URLs (upload local images to Cloudinary)
-            image_urls = []
-            for img in product.images.all().order_by('order'):
-                if not getattr(img, 'image', None):
-                    continue
-                
-                img_url = _build_full_image_url(img.image)
-                if not img_url:
-                    continue
-                
-                # If URL is relative or self-hosted, upload to Cloudinary
-                site_url = os.environ.get('SITE_URL') or os.environ.get('RENDER_EXTERNAL_HOSTNAME') or getattr(settings, 'RENDER_EXTERNAL_HOSTNAME', None)
-                normalized_site = None
-                if site_url:
-                    if not site_url.startswith('http'):
-                        site_url = 'https://' + site_url
-                    normalized_site = site_url.rstrip('/')
-                
-                should_upload = False
-                if img_url.startswith('/'):
-                    should_upload = True
-                elif normalized_site and img_url.startswith(normalized_site):
-                    should_upload = True
-                
-                if should_upload:
-                    cloudinary_url = _upload_image_to_cloudinary(img.image)
-                    if cloudinary_url:
-                        img_url = cloudinary_url
-                
-                image_urls.append(img_url)
-            
-            # Build sizes/stock/price string
-            size_lines = []
-            for size_obj in product.sizes.all():
-                size_str = f"{size_obj.size} ({size_obj.stock}) - ₱{size_obj.price}"
-                size_lines.append(size_str)
-            sizes_info = "\n".join(size_lines)
-            message = (
-                f"🔥 Fresh Drop Alert! 🔥\n"
-                f"Step up your game with the new {product.brand} {product.name}!\n\n"
-                f"Sizes & Stock:\n{sizes_info}\n\n"
-                f"Tap the link to see more photos and details: https://www.sidestep.studio/product/{product.id}/\n"
-                f"DM us to reserve your pair or ask questions! #sidestep #sneakerhead #newdrop"
-            )
-            if image_urls:
-                post_multiple_to_facebook(message, image_urls)
-                post_instagram_carousel(message, image_urls)
-            self.message_user(request, 'Product published and posted to social media')
-        except Exception as e:
-            self.message_user(request, f'Published but failed to post: {e}', level=messages.WARNING)
+        with transaction.atomic():
+            product.save(update_fields=['is_published', 'published_at'])
+            scheduler.submit('brt.signals.post_product_drop', product.pk, 'admin_publish',
+                             priority=NEW_DROP, name=f'publish product {product.pk}')
+        self.message_user(request, 'Product published; social posts are queued')
         # Redirect back to product change list
         return HttpResponseRedirect(request.META.get('HTTP_REFERER', '/admin/'))
 
 
+class OrderExportForm(forms.Form):
+    status = forms.MultipleChoiceField(choices=Order.STATUS_CHOICES, required=False,
+                                       widget=forms.CheckboxSelectMultiple, help_text='Leave empty for all statuses')
+    start = forms.DateField(required=False, help_text='Created on or after (YYYY-MM-DD)')
+    end = forms.DateField(required=False, help_text='Created on or before (YYYY-MM-DD)')
+    format = forms.ChoiceField(choices=[(f, f.upper()) for f in EXPORT_FORMATS])
+
+
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
@@ -293,3 +390,101 @@ class OrderAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
+
+    actions = ['export_selected_csv', 'export_selected_jsonl']
+
+    def export_selected_csv(self, request, queryset):
+        return streaming_export_response(queryset, 'csv')
+    export_selected_csv.short_description = 'Export selected orders (CSV)'
+
+    def export_selected_jsonl(self, request, queryset):
+        return streaming_export_response(queryset, 'jsonl')
+    export_selected_jsonl.short_description = 'Export selected orders (JSON lines)'
+
+    def get_urls(self):
+        urls = super().get_urls()
+        custom = [
+            path('export/', self.admin_site.admin_view(self.export_view), name='brt_order_export'),
+        ]
+        return custom + urls
+
+    def export_view(self, request):
+        """Pick status/date filters, then stream every matching order."""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        form = OrderExportForm(request.GET or None)
+        if form.is_valid():
+            queryset = filter_orders(
+                statuses=form.cleaned_data['status'],
+                start=form.cleaned_data['start'],
+                end=form.cleaned_data['end'],
+            )
+            return streaming_export_response(queryset, form.cleaned_data['format'])
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Export orders',
+            'form': form,
+        }
+        return TemplateResponse(request, 'admin/brt/order/export.html', context)
+
+
+class ReadOnlyRollupAdmin(admin.ModelAdmin):
+    """Rollups are written only by the refresh_rollups command."""
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(DailySalesRollup)
+class DailySalesRollupAdmin(ReadOnlyRollupAdmin):
+    """Sales dashboard. Reads only from the rollup tables, never from Order/OrderItem."""
+    list_display = ['day', 'orders', 'units', 'revenue']
+    date_hierarchy = 'day'
+    change_list_template = 'admin/brt/dailysalesrollup/change_list.html'
+    dashboard_days = 30
+
+    def changelist_view(self, request, extra_context=None):
+        since = timezone.localdate() - timedelta(days=self.dashboard_days - 1)
+        recent = DailySalesRollup.objects.filter(day__gte=since)
+        totals = recent.aggregate(orders=Sum('orders'), units=Sum('units'), revenue=Sum('revenue'))
+        top_products = (
+            DailyProductSalesRollup.objects.filter(day__gte=since)
+            .values('product_name').annotate(units=Sum('units'), revenue=Sum('revenue'))
+            .order_by('-units')[:10]
+        )
+        checkpoint = RollupCheckpoint.objects.filter(name='sales').first()
+        extra_context = {
+            **(extra_context or {}),
+            'dashboard_days': self.dashboard_days,
+            'totals': totals,
+            'top_products': top_products,
+            'refreshed_at': checkpoint.refreshed_at if checkpoint else None,
+        }
+        return super().changelist_view(request, extra_context=extra_context)
+
+
+@admin.register(DailyProductSalesRollup)
+class DailyProductSalesRollupAdmin(ReadOnlyRollupAdmin):
+    list_display = ['day', 'product_name', 'size', 'units', 'revenue']
+    list_filter = ['size']
+    search_fields = ['product_name']
+    date_hierarchy = 'day'
+
+
+@admin.register(InventoryRollup)
+class InventoryRollupAdmin(ReadOnlyRollupAdmin):
+    list_display = ['product', 'size', 'units_sold', 'stock', 'sell_through_display', 'refreshed_at']
+    list_select_related = ['product']
+    search_fields = ['product__name']
+    ordering = ['-units_sold']
+
+    def sell_through_display(self, obj):
+        return f"{obj.sell_through()}%"
+    sell_through_display.short_description = 'Sell-through'
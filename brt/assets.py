@@ -0,0 +1,311 @@
+"""Per-page CSS/JS bundles with inlined critical CSS.
+
+``python manage.py build_assets`` reads each page's stylesheets and scripts
+(PAGES), and writes to ``static/dist/``:
+
+- ``<page>.critical.css``: the rules needed to paint the part of the template
+  above its ``{# fold #}`` marker, inlined into <head> by ``{% page_styles %}``
+- ``<page>.min.css`` / ``<page>.min.js``: the whole minified bundle, loaded
+  without blocking render
+- ``assets.json``: which files exist for each page, plus any ``@import``
+  URLs hoisted out of the CSS (web fonts), so the template tags can find them
+
+``static/dist/`` is a build artifact, so collectstatic fingerprints it like
+any other static file. When it hasn't been built, the template tags fall
+back to the original stylesheets and scripts.
+
+Critical CSS is found with a selector heuristic, not a browser. A rule is
+kept when every class, id and element in one of its selectors appears above
+the fold. Interaction states (``:hover``, ``:focus``, ...) and ``@keyframes``
+are left to the full bundle.
+"""
+import json
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.template.loader import get_template
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = f'{DIST_DIR}/assets.json'
+FOLD_MARKER = '{# fold #}'
+# Above-the-fold content used when a template has no fold marker
+DEFAULT_FOLD_CHARS = 4000
+
+PAGES = {
+    'landing': {'template': 'landingpage.html', 'css': ['css/landingpage.css'], 'js': []},
+    'shop': {'template': 'shop.html', 'css': ['css/shop.css'], 'js': ['js/shop.js']},
+    'product': {'template': 'product.html', 'css': ['css/product.css'], 'js': ['js/product.js']},
+}
+
+INTERACTIVE_PSEUDO = re.compile(r':(hover|focus|focus-within|focus-visible|active|checked|visited)\b')
+COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+TEMPLATE_SYNTAX_RE = re.compile(r'{%.*?%}|{{.*?}}|{#.*?#}', re.S)
+IMPORT_RE = re.compile(r'@import\s+(?:url\()?\s*[\'"]?([^\'")\s;]+)[\'"]?\s*\)?[^;]*;')
+
+
+# --- CSS parsing --------------------------------------------------------------
+
+def parse_css(text):
+    """Split a stylesheet into a list of ``(prelude, body)`` blocks.
+
+    ``body`` is a string of declarations for style rules and a nested list of
+    blocks for grouping at-rules (@media, @supports). Statements without a
+    body (@charset) are returned with ``body=None``.
+    """
+    text = COMMENT_RE.sub('', text)
+    blocks, _ = _parse_blocks(text, 0)
+    return blocks
+
+
+def _parse_blocks(text, pos):
+    blocks = []
+    start = pos
+    while pos < len(text):
+        char = text[pos]
+        if char in '"\'':
+            pos = text.index(char, pos + 1) + 1
+            continue
+        if char == ';' and text[start:pos].strip().startswith('@'):
+            blocks.append((text[start:pos].strip(), None))
+            start = pos = pos + 1
+            continue
+        if char == '{':
+            prelude = text[start:pos].strip()
+            if prelude.startswith(('@media', '@supports', '@document', '@layer')):
+                body, pos = _parse_blocks(text, pos + 1)
+            else:
+                end = _matching_brace(text, pos)
+                body = text[pos + 1:end]
+                pos = end
+            blocks.append((prelude, body))
+            start = pos = pos + 1
+            continue
+        if char == '}':
+            return blocks, pos
+        pos += 1
+    return blocks, pos
+
+
+def _matching_brace(text, pos):
+    depth = 0
+    for i in range(pos, len(text)):
+        if text[i] == '{':
+            depth += 1
+        elif text[i] == '}':
+            depth -= 1
+            if depth == 0:
+                return i
+    raise ValueError('Unbalanced braces in stylesheet')
+
+
+# --- Minification ---------------------------------------------------------------
+
+def _minify_selector(selector):
+    selector = re.sub(r'\s+', ' ', selector.strip())
+    return re.sub(r'\s*([,>+~])\s*', r'\1', selector)
+
+
+def _minify_declarations(body):
+    if '{' in body:  # @keyframes / @font-face style nested bodies
+        return ''.join(f'{_minify_selector(p)}{{{_minify_declarations(b)}}}' for p, b in parse_css(body))
+    declarations = []
+    for declaration in body.split(';'):
+        if ':' not in declaration:
+            continue
+        name, value = declaration.split(':', 1)
+        value = re.sub(r'\s+', ' ', value.strip())
+        value = re.sub(r'\s*,\s*', ',', value)
+        declarations.append(f'{name.strip()}:{value}')
+    return ';'.join(declarations)
+
+
+def serialize(blocks):
+    out = []
+    for prelude, body in blocks:
+        if body is None:
+            out.append(f'{prelude};')
+        elif isinstance(body, list):
+            inner = serialize(body)
+            if inner:
+                out.append(' '.join(prelude.split()) + '{' + inner + '}')
+        else:
+            out.append(f'{_minify_selector(prelude)}{{{_minify_declarations(body)}}}')
+    return ''.join(out)
+
+
+def minify_js(source):
+    """Conservative JS minification: drop comment-only lines, blank lines and indentation.
+
+    Anything smarter needs a real parser (regex literals, template strings),
+    so nothing inside a line is touched.
+    """
+    lines = (line.strip() for line in source.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+
+# --- Critical CSS ---------------------------------------------------------------
+
+def above_the_fold_tokens(template_source):
+    """Return ``(classes, ids, tags)`` used above the fold of a template."""
+    head, marker, _ = template_source.partition(FOLD_MARKER)
+    if not marker:
+        body_start = head.find('<body')
+        head = head[:max(body_start, 0) + DEFAULT_FOLD_CHARS]
+    # Template tags become whitespace so `slide {% if %}active{% endif %}` yields both classes
+    markup = TEMPLATE_SYNTAX_RE.sub(' ', head)
+    classes = set()
+    for value in re.findall(r'class\s*=\s*["\']([^"\']*)["\']', markup):
+        classes.update(value.split())
+    ids = set(re.findall(r'id\s*=\s*["\']([^"\']+)["\']', markup))
+    tags = {tag.lower() for tag in re.findall(r'<([a-zA-Z][a-zA-Z0-9]*)', markup)}
+    tags.update({'html', 'body'})
+    return classes, ids, tags
+
+
+def selector_is_critical(selector, classes, ids, tags):
+    if INTERACTIVE_PSEUDO.search(selector):
+        return False
+    # Ignore what's inside :not(...)/:nth-child(...) and attribute selectors
+    simple = re.sub(r'\([^)]*\)|\[[^\]]*\]', '', selector)
+    simple = re.sub(r'::?[\w-]+', '', simple)
+    if any(name not in classes for name in re.findall(r'\.(-?[_a-zA-Z][\w-]*)', simple)):
+        return False
+    if any(name not in ids for name in re.findall(r'#(-?[_a-zA-Z][\w-]*)', simple)):
+        return False
+    for compound in re.split(r'[\s>+~]+', simple):
+        element = re.match(r'[a-zA-Z][\w-]*', compound)
+        if element and element.group().lower() not in tags:
+            return False
+    return True
+
+
+def critical_blocks(blocks, classes, ids, tags):
+    critical = []
+    for prelude, body in blocks:
+        if body is None:
+            continue  # @import/@charset are hoisted or dropped
+        if isinstance(body, list):
+            inner = critical_blocks(body, classes, ids, tags)
+            if inner:
+                critical.append((prelude, inner))
+        elif prelude.startswith('@font-face'):
+            critical.append((prelude, body))
+        elif prelude.startswith('@'):
+            continue  # @keyframes and friends load with the full bundle
+        else:
+            selectors = [s for s in prelude.split(',') if selector_is_critical(s.strip(), classes, ids, tags)]
+            if selectors:
+                critical.append((', '.join(s.strip() for s in selectors), body))
+    return critical
+
+
+# --- Build ----------------------------------------------------------------------
+
+URL_RE = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+
+def absolute_urls(css, source):
+    """Rewrite relative ``url()`` references in ``source`` to absolute static URLs.
+
+    Needed because bundles live in dist/ and critical CSS is inlined into the
+    page. collectstatic still fingerprints absolute STATIC_URL references.
+    """
+    base = posixpath.dirname(source)
+
+    def replace(match):
+        url = match.group(2)
+        if re.match(r'^([a-z]+:|/|#)', url):
+            return match.group(0)
+        return f'url("{settings.STATIC_URL}{posixpath.normpath(posixpath.join(base, url))}")'
+    return URL_RE.sub(replace, css)
+
+
+def _read_static(name):
+    path = finders.find(name)
+    if not path:
+        raise FileNotFoundError(f'Static file not found: {name}')
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def dist_root():
+    return os.path.join(settings.BASE_DIR, 'static', DIST_DIR)
+
+
+def build_page(name, config):
+    """Build one page's bundles. Returns its manifest entry and output sizes."""
+    css = '\n'.join(absolute_urls(_read_static(source), source) for source in config['css'])
+    imports = IMPORT_RE.findall(css)
+    blocks = [b for b in parse_css(IMPORT_RE.sub('', css)) if not b[0].startswith('@charset')]
+
+    template_source = get_template(config['template']).template.source
+    critical = serialize(critical_blocks(blocks, *above_the_fold_tokens(template_source)))
+    outputs = {'critical': critical, 'css': serialize(blocks)}
+    if config['js']:
+        outputs['js'] = ';\n'.join(minify_js(_read_static(source)) for source in config['js'])
+
+    entry, sizes = {'imports': imports}, {}
+    suffixes = {'critical': 'critical.css', 'css': 'min.css', 'js': 'min.js'}
+    for kind, content in outputs.items():
+        relative = f'{DIST_DIR}/{name}.{suffixes[kind]}'
+        with open(os.path.join(dist_root(), f'{name}.{suffixes[kind]}'), 'w', encoding='utf-8') as f:
+            f.write(content)
+        entry[kind] = relative
+        sizes[kind] = len(content.encode())
+    return entry, sizes
+
+
+def build(pages=None):
+    """Build every page in PAGES (or just ``pages``). Returns ``{page: sizes}``."""
+    os.makedirs(dist_root(), exist_ok=True)
+    manifest_path = os.path.join(dist_root(), 'assets.json')
+    manifest = {}
+    if pages and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    report = {}
+    for name, config in PAGES.items():
+        if pages and name not in pages:
+            continue
+        manifest[name], report[name] = build_page(name, config)
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return report
+
+
+_manifest_cache = {}
+
+
+def load_manifest():
+    """Return the built manifest, or {} if ``build_assets`` hasn't been run.
+
+    Cached per process and re-read when the file changes.
+    """
+    path = finders.find(MANIFEST_NAME)
+    if not path:
+        return {}
+    mtime = os.path.getmtime(path)
+    cached = _manifest_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path) as f:
+        manifest = json.load(f)
+    _manifest_cache[path] = (mtime, manifest)
+    return manifest
+
+
+def read_built(name):
+    """Contents of a built file, cached like the manifest; None if it is missing."""
+    path = finders.find(name)
+    if not path:
+        return None
+    mtime = os.path.getmtime(path)
+    cached = _manifest_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    content = _read_static(name)
+    _manifest_cache[path] = (mtime, content)
+    return content
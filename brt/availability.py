@@ -0,0 +1,91 @@
+"""Live per-size stock and price for the product page.
+
+The product page HTML is cached for PRODUCT_PAGE_MAX_AGE seconds.
+``product.js`` then asks ``/product/<id>/availability/`` for the current
+stock and prices and updates the size buttons.
+
+Each product has a stock version in the shared cache. The version is bumped
+after any commit that changes the product or one of its ``ProductSize``
+rows: a save or delete (via signals), or an inventory import. The endpoint is cheap because:
+
+- The version is the response's ETag. A matching ``If-None-Match`` is
+  answered with 304 without touching the database.
+- The JSON for each version is kept in the cache, so the database is read
+  once per version, not once per request.
+- Responses are ``public`` with a short max-age, so browsers and any CDN
+  in front absorb repeat requests during a drop.
+
+Without a shared cache (no REDIS_URL), each process has its own memory
+cache. A bump then reaches only the process that made the change, and never
+reaches any process when it was made by a management command. So versions
+and payloads there expire after AVAILABILITY_MAX_AGE seconds. Stock is then
+at most that stale, at the cost of one query per product per interval.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Product
+
+AVAILABILITY_TIMEOUT = 60 * 60
+
+
+def _version_key(product_id):
+    return f'stock_version:{product_id}'
+
+
+def _shared_cache():
+    """Whether the default cache is shared by every process (not per-process memory)."""
+    backend = settings.CACHES['default']['BACKEND']
+    return not backend.endswith(('.LocMemCache', '.DummyCache'))
+
+
+def _timeouts():
+    """``(version timeout, payload timeout)`` for the configured cache."""
+    if _shared_cache():
+        return None, AVAILABILITY_TIMEOUT
+    max_age = getattr(settings, 'AVAILABILITY_MAX_AGE', 5)
+    return max_age, max_age
+
+
+def _fresh_version():
+    # Start from the clock, so a version lost from the cache is never reused
+    return time.time_ns() // 1000
+
+
+def current_version(product_id):
+    return cache.get_or_set(_version_key(product_id), _fresh_version, _timeouts()[0])
+
+
+def bump(*product_ids):
+    """Mark the stock of ``product_ids`` as changed. Call after the change is committed."""
+    for product_id in set(product_ids):
+        try:
+            cache.incr(_version_key(product_id))
+        except ValueError:
+            cache.set(_version_key(product_id), _fresh_version(), _timeouts()[0])
+
+
+def etag(product_id, version):
+    return f'"{product_id}-{version}"'
+
+
+def availability(product_id, version):
+    """The product's sizes as a JSON-ready dict, or None if it isn't on sale."""
+    key = f'availability:{product_id}:{version}'
+    payload = cache.get(key)
+    if payload is not None:
+        return payload
+    product = Product.objects.visible().prefetch_related('sizes').filter(pk=product_id).first()
+    if product is None:
+        return None
+    payload = {
+        'product': product.pk,
+        'version': version,
+        'in_stock': product.in_stock(),
+        'price_range': product.price_range(),
+        'sizes': [{'size': s.size, 'price': str(s.price), 'stock': s.stock} for s in product.sizes.all()],
+    }
+    cache.set(key, payload, _timeouts()[1])
+    return payload
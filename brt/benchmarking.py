@@ -0,0 +1,88 @@
+"""Shared pieces for the benchmark commands (bench_servers, run_benchmarks)."""
+import socket
+import statistics
+import subprocess
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(samples, elapsed):
+    """Summarise ``(seconds, ok)`` samples taken over ``elapsed`` seconds (latencies in ms)."""
+    latencies = [duration * 1000 for duration, ok in samples if ok]
+    if not latencies:
+        return {'requests': len(samples), 'errors': len(samples), 'rps': 0.0, 'p50': None, 'p95': None, 'p99': None}
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, ok in samples if not ok),
+        'rps': len(samples) / elapsed if elapsed else 0.0,
+        'p50': statistics.median(latencies),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=2).read()
+            return True
+        except Exception:
+            time.sleep(0.2)
+    return False
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Time the request itself; a redirect (e.g. after checkout) counts as success
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+_opener = urllib.request.build_opener(_NoRedirect)
+
+
+def fetch(request):
+    """Time one request. ``request`` is a URL or a ``urllib.request.Request``."""
+    start = time.perf_counter()
+    try:
+        with _opener.open(request, timeout=30) as resp:
+            resp.read()
+            ok = resp.status < 400
+    except urllib.error.HTTPError as e:
+        ok = e.code < 400
+    except Exception:
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def run_load(requests, concurrency):
+    """Send ``requests`` with ``concurrency`` threads. Returns ``(samples, elapsed)``."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(fetch, requests))
+    return samples, time.perf_counter() - start
+
+
+def git_revision(cwd):
+    try:
+        sha = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=cwd, capture_output=True, text=True, timeout=10)
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=cwd,
+                               capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if sha.returncode != 0:
+        return None
+    return sha.stdout.strip() + ('-dirty' if dirty.stdout.strip() else '')
@@ -0,0 +1,294 @@
+"""In-process catalogue index for the shop page.
+
+With CATALOGUE_INDEX_ENABLED, ``views.shop`` answers filters, sorting and
+facet counts from this index. The database is only asked for the matching
+products, by primary key, to render them.
+
+Each process keeps one index with a snapshot of the visible products:
+
+- Per-product values live in parallel lists, addressed by position.
+- One bitset (a Python int, bit ``n`` = position ``n``) is kept per brand,
+  per category, per in-stock size, and for the sale and trending flags.
+  Filters are ANDs and ORs of bitsets.
+- Position lists are kept presorted for each sort key of the shop page.
+
+The shop's SQL semantics are kept exactly:
+
+- ``size`` means "has that size in stock".
+- A price bound means "some size is priced inside it", and each bound is
+  checked on its own.
+- ``new`` means created in the last 30 days, or in the New Arrivals
+  category.
+
+Freshness uses a version stamp in the shared cache. On commit,
+``changed()`` bumps it and records which products changed under the new
+version. Before each search the index compares its version with the
+shared one:
+
+- If it is behind, it reloads just the changed products. Their old
+  positions are cleared, and new positions are added and inserted into
+  the sort orders.
+- It rebuilds from scratch when the change log is incomplete (evicted from
+  the cache) or too long, or when too many positions are dead.
+"""
+import bisect
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Product, ProductSize
+
+VERSION_KEY = 'catalogue:version'
+CHANGE_TIMEOUT = 60 * 60
+# Beyond this many changed products a full rebuild is cheaper than patching
+MAX_INCREMENTAL = 200
+NEW_ARRIVAL_DAYS = 30
+SORTS = ('newest', 'price_low', 'price_high', 'name')
+FACETS = ('brand', 'category', 'size')
+
+
+def _change_key(version):
+    return f'catalogue:change:{version}'
+
+
+def changed(*product_ids):
+    """Record that ``product_ids`` changed. Call after the change is committed."""
+    if not product_ids:
+        return
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        # No stamp (first change, or evicted): start a new series, which
+        # makes every process rebuild
+        invalidate()
+        return
+    cache.set(_change_key(version), sorted(set(product_ids)), CHANGE_TIMEOUT)
+
+
+def invalidate():
+    """Make every process rebuild its index (after bulk changes that send no signals)."""
+    cache.set(VERSION_KEY, time.time_ns() // 1000, None)
+
+
+def _shared_version():
+    return cache.get_or_set(VERSION_KEY, lambda: time.time_ns() // 1000, None)
+
+
+@dataclass
+class SearchResult:
+    ids: list
+    facets: dict
+    brands: list
+    price_range: dict
+
+
+class CatalogueIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self._reset()
+
+    def _reset(self):
+        self.pks, self.names, self.folded_names, self.created, self.base_prices = [], [], [], [], []
+        # Lowest and highest size price, whatever the stock (None: no sizes)
+        self.min_size_prices, self.max_size_prices = [], []
+        self.position = {}
+        self.alive = 0
+        self.bits = {'brand': defaultdict(int), 'category': defaultdict(int), 'size': defaultdict(int)}
+        self.on_sale = self.trending = 0
+        self.orders = {sort: [] for sort in SORTS}
+        self.brands, self.price_range = [], {'min_price': None, 'max_price': None}
+
+    def _sort_key(self, sort):
+        if sort == 'newest':
+            return lambda pos: (-self.created[pos], self.pks[pos])
+        if sort == 'price_low':
+            return lambda pos: (self.base_prices[pos], self.pks[pos])
+        if sort == 'price_high':
+            return lambda pos: (-self.base_prices[pos], self.pks[pos])
+        return lambda pos: (self.names[pos], self.pks[pos])
+
+    # --- Loading ---------------------------------------------------------------
+
+    def _load(self, product_ids=None):
+        """Rows for the visible products (all, or just ``product_ids``)."""
+        products = Product.objects.visible()
+        sizes = ProductSize.objects.filter(product__in=products)
+        if product_ids is not None:
+            products = products.filter(pk__in=product_ids)
+            sizes = sizes.filter(product_id__in=product_ids)
+        by_product = defaultdict(list)
+        for product_id, size, price, stock in sizes.values_list('product_id', 'size', 'price', 'stock').order_by():
+            by_product[product_id].append((size, price, stock))
+        rows = products.values_list(
+            'pk', 'name', 'brand', 'category', 'is_on_sale', 'is_trending', 'created_at', 'base_price',
+        ).order_by()
+        return [(row, by_product.get(row[0], [])) for row in rows]
+
+    def _add(self, row, sizes):
+        pk, name, brand, category, is_on_sale, is_trending, created_at, base_price = row
+        pos = len(self.pks)
+        bit = 1 << pos
+        self.pks.append(pk)
+        self.names.append(name)
+        self.folded_names.append(name.lower())
+        self.created.append(created_at.timestamp())
+        self.base_prices.append(base_price)
+        prices = [price for _, price, _ in sizes]
+        self.min_size_prices.append(min(prices) if prices else None)
+        self.max_size_prices.append(max(prices) if prices else None)
+        self.position[pk] = pos
+        self.alive |= bit
+        self.bits['brand'][brand] |= bit
+        self.bits['category'][category] |= bit
+        for size, _, stock in sizes:
+            if stock > 0:
+                self.bits['size'][size] |= bit
+        if is_on_sale:
+            self.on_sale |= bit
+        if is_trending:
+            self.trending |= bit
+        return pos
+
+    def _remove(self, pk):
+        pos = self.position.pop(pk, None)
+        if pos is None:
+            return
+        keep = ~(1 << pos)
+        self.alive &= keep
+        self.on_sale &= keep
+        self.trending &= keep
+        for bitsets in self.bits.values():
+            for value in bitsets:
+                bitsets[value] &= keep
+        # The position stays in the sort orders; the alive mask hides it
+
+    def rebuild(self, version):
+        self._reset()
+        for row, sizes in self._load():
+            self._add(row, sizes)
+        for sort in SORTS:
+            self.orders[sort] = sorted(range(len(self.pks)), key=self._sort_key(sort))
+        self.version = version
+
+    def _apply_changes(self, version):
+        """Patch in the products changed since ``self.version``; False if a rebuild is needed."""
+        if self.version is None or version < self.version or version - self.version > MAX_INCREMENTAL:
+            return False
+        keys = [_change_key(v) for v in range(self.version + 1, version + 1)]
+        logged = cache.get_many(keys)
+        if len(logged) != len(keys):
+            return False
+        product_ids = {pk for ids in logged.values() for pk in ids}
+        dead = len(self.pks) - len(self.position) + len(product_ids)
+        if len(product_ids) > MAX_INCREMENTAL or dead > max(len(self.position), 64):
+            return False
+        for pk in product_ids:
+            self._remove(pk)
+        for row, sizes in self._load(product_ids):
+            pos = self._add(row, sizes)
+            for sort in SORTS:
+                bisect.insort(self.orders[sort], pos, key=self._sort_key(sort))
+        self.version = version
+        return True
+
+    def refresh(self):
+        version = _shared_version()
+        if version == self.version:
+            return
+        if not self._apply_changes(version):
+            self.rebuild(version)
+        self._summarise()
+
+    def _summarise(self):
+        """The shop's brand list and price hint, from the live positions."""
+        self.brands = sorted(brand for brand, bits in self.bits['brand'].items() if brand and bits & self.alive)
+        prices = [price for pos in self.position.values()
+                  for price in (self.min_size_prices[pos], self.max_size_prices[pos]) if price is not None]
+        self.price_range = {'min_price': min(prices, default=None), 'max_price': max(prices, default=None)}
+
+    # --- Queries ---------------------------------------------------------------
+
+    def _price_bits(self, min_price, max_price):
+        bits = 0
+        for pos in range(len(self.pks)):
+            low, high = self.min_size_prices[pos], self.max_size_prices[pos]
+            if low is None:
+                continue
+            if (min_price is None or high >= min_price) and (max_price is None or low <= max_price):
+                bits |= 1 << pos
+        return bits
+
+    def _category_bits(self, category):
+        if category == 'sale':
+            return self.on_sale
+        if category == 'trending':
+            return self.trending
+        bits = self.bits['category'].get(category, 0)
+        if category == 'new':
+            cutoff = (timezone.now() - timedelta(days=NEW_ARRIVAL_DAYS)).timestamp()
+            for pos in self.orders['newest']:
+                if self.created[pos] < cutoff:
+                    break
+                bits |= 1 << pos
+        return bits
+
+    def _search_bits(self, query):
+        query = query.lower()
+        bits = 0
+        for pos, name in enumerate(self.folded_names):
+            if query in name:
+                bits |= 1 << pos
+        return bits
+
+    def search(self, category=None, brands=(), sizes=(), min_price=None, max_price=None, q=None, sort='newest'):
+        """Matching product ids in display order, with facet counts; None if a filter can't be parsed."""
+        try:
+            min_price = Decimal(min_price) if min_price else None
+            max_price = Decimal(max_price) if max_price else None
+        except InvalidOperation:
+            return None  # let the database path report it
+        with self._lock:
+            self.refresh()
+            filters = {}
+            if category:
+                filters['category'] = self._category_bits(category)
+            if brands:
+                filters['brand'] = self._union('brand', brands)
+            if sizes:
+                filters['size'] = self._union('size', sizes)
+            if min_price is not None or max_price is not None:
+                filters['price'] = self._price_bits(min_price, max_price)
+            if q:
+                filters['search'] = self._search_bits(q)
+
+            matches = self.alive
+            for bits in filters.values():
+                matches &= bits
+            order = self.orders.get(sort, self.orders['newest'])
+            ids = [self.pks[pos] for pos in order if matches >> pos & 1]
+
+            facets = {}
+            for name in FACETS:
+                # Counts for one facet ignore that facet's own selection
+                base = self.alive
+                for other, bits in filters.items():
+                    if other != name:
+                        base &= bits
+                facets[name] = {value: n for value, bits in self.bits[name].items() if (n := (base & bits).bit_count())}
+        return SearchResult(ids, facets, self.brands, self.price_range)
+
+    def _union(self, name, values):
+        bits = 0
+        for value in values:
+            bits |= self.bits[name].get(value, 0)
+        return bits
+
+
+catalogue = CatalogueIndex()
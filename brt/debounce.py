@@ -0,0 +1,93 @@
+"""Coalesce bursts of events into one deferred call.
+
+``debounce(key, callback, delay)`` runs ``callback`` once ``key`` has seen
+no new event for ``delay`` seconds. Saving a product with five inline
+images therefore produces a single announcement, made after the last
+image was committed.
+
+State lives in the shared cache, so events reaching different workers
+coalesce too:
+
+- ``debounce:due:<key>`` holds the deadline. Every event pushes it back.
+- ``debounce:claim:<key>`` is taken with ``cache.add`` (atomic) by the
+  worker that fires, so only one worker runs the callback.
+
+Each worker that saw an event keeps one waiting thread per key. The thread
+sleeps until the deadline and re-reads it, because it may have moved. Then
+the thread claims the key and fires. Callbacks should load their data when
+they run, not when the event happened: an event whose deadline update
+races with the firing is still covered, because its rows were committed
+before the deadline was written.
+"""
+import logging
+import threading
+import time
+import uuid
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Long enough for a slow callback (several Graph API round trips); a crashed
+# worker's claim expires after this
+CLAIM_TIMEOUT = 15 * 60
+
+_pending = {}
+_lock = threading.Lock()
+
+
+def _due_key(key):
+    return f'debounce:due:{key}'
+
+
+def _claim_key(key):
+    return f'debounce:claim:{key}'
+
+
+def debounce(key, callback, delay):
+    """Run ``callback()`` in a background thread once ``key`` is quiet for ``delay`` seconds."""
+    cache.set(_due_key(key), time.time() + delay, delay + CLAIM_TIMEOUT)
+    with _lock:
+        if key in _pending:
+            return
+        thread = threading.Thread(target=_wait_and_fire, args=(key, callback, delay),
+                                  name=f'debounce-{key}', daemon=True)
+        _pending[key] = thread
+    thread.start()
+
+
+def pending(key):
+    """The waiting thread for ``key`` in this process, or None."""
+    return _pending.get(key)
+
+
+def _wait_and_fire(key, callback, delay):
+    due_key, claim_key = _due_key(key), _claim_key(key)
+    while True:
+        with _lock:
+            # Checked under the lock so an event arriving as this thread
+            # exits starts a new one instead of being dropped
+            due = cache.get(due_key)
+            if due is None:
+                _pending.pop(key, None)
+                return
+        remaining = due - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
+            continue
+
+        token = uuid.uuid4().hex
+        if not cache.add(claim_key, token, CLAIM_TIMEOUT):
+            # Another worker is firing; look again once it should be done
+            time.sleep(max(delay, 0.05))
+            continue
+        try:
+            if cache.get(due_key) != due:
+                continue  # an event arrived after the deadline was read
+            cache.delete(due_key)
+            callback()
+        except Exception:
+            logger.exception('debounced callback failed', extra={'key': key})
+        finally:
+            if cache.get(claim_key) == token:
+                cache.delete(claim_key)
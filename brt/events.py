@@ -0,0 +1,151 @@
+"""Order status change events.
+
+Status transitions are written to the shared cache by the ``post_save`` hook
+in ``brt.signals`` and read back by the server-sent event views in
+``brt.views``. Open streams only ever poll the cache, never the database.
+
+Cache layout:
+    order_events_seq          -> last issued sequence number
+    order_event_<seq>         -> event dict (global feed, used by the admin)
+    order_status_<order_id>   -> latest event dict for a single order
+"""
+import asyncio
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+SEQ_KEY = 'order_events_seq'
+EVENT_TTL = 60 * 60  # keep the replay window at one hour
+MAX_BACKLOG = 200  # never replay more than this many events to a reconnecting client
+HEARTBEAT_INTERVAL = 15
+
+
+def _event_key(seq):
+    return f'order_event_{seq}'
+
+
+def _order_key(order_id):
+    return f'order_status_{order_id}'
+
+
+def _next_seq():
+    cache.add(SEQ_KEY, 0, timeout=None)
+    try:
+        return cache.incr(SEQ_KEY)
+    except ValueError:
+        # Key was evicted between add() and incr(); start a new sequence
+        cache.set(SEQ_KEY, 1, timeout=None)
+        return 1
+
+
+def build_event(order, previous_status=None):
+    return {
+        'pk': order.pk,
+        'order_id': order.order_id,
+        'status': order.status,
+        'status_display': order.get_status_display(),
+        'previous_status': previous_status,
+        'updated_at': (order.updated_at or timezone.now()).isoformat(),
+    }
+
+
+def publish_status_change(order, previous_status=None):
+    """Record a status transition for ``order`` in the shared cache."""
+    event = build_event(order, previous_status)
+    event['seq'] = _next_seq()
+    cache.set_many({
+        _event_key(event['seq']): event,
+        _order_key(order.order_id): event,
+    }, EVENT_TTL)
+    return event
+
+
+def format_sse(event, name='status'):
+    """Serialize an event dict as a server-sent event frame."""
+    lines = []
+    if event.get('seq'):
+        lines.append(f"id: {event['seq']}")
+    lines.append(f'event: {name}')
+    lines.append(f'data: {json.dumps(event)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def format_retry():
+    """Tell EventSource how long to wait before reconnecting."""
+    return f'retry: {int(_poll_interval() * 1000)}\n\n'
+
+
+def _poll_interval():
+    return float(getattr(settings, 'ORDER_EVENTS_POLL_INTERVAL', 1.0))
+
+
+def _stream_timeout():
+    return float(getattr(settings, 'ORDER_EVENTS_STREAM_TIMEOUT', 300))
+
+
+async def alatest(order_id):
+    """Return the latest cached event for ``order_id``, or None."""
+    return await cache.aget(_order_key(order_id))
+
+
+async def aevents_since(last_seq):
+    """Return (current_seq, events) for every event after ``last_seq``."""
+    current = await cache.aget(SEQ_KEY) or 0
+    if current <= last_seq:
+        return current, []
+    start = max(last_seq + 1, current - MAX_BACKLOG + 1)
+    keys = [_event_key(seq) for seq in range(start, current + 1)]
+    found = await cache.aget_many(keys)
+    return current, [found[key] for key in keys if key in found]
+
+
+async def order_stream(order_id, initial_event=None):
+    """Yield SSE frames for a single order until the stream times out.
+
+    Clients reconnect automatically (EventSource) once the stream closes, so
+    the timeout only bounds how long a single connection is held open.
+    """
+    yield format_retry()
+    last_seq = None
+    if initial_event:
+        last_seq = initial_event.get('seq')
+        yield format_sse(initial_event)
+
+    deadline = time.monotonic() + _stream_timeout()
+    last_write = time.monotonic()
+    while time.monotonic() < deadline:
+        await asyncio.sleep(_poll_interval())
+        event = await cache.aget(_order_key(order_id))
+        if event and event.get('seq') != last_seq:
+            last_seq = event.get('seq')
+            last_write = time.monotonic()
+            yield format_sse(event)
+        elif time.monotonic() - last_write >= HEARTBEAT_INTERVAL:
+            last_write = time.monotonic()
+            yield ': heartbeat\n\n'
+
+
+async def feed_stream(last_seq=0):
+    """Yield SSE frames for every order status change after ``last_seq``."""
+    yield format_retry()
+    if not last_seq:
+        last_seq = await cache.aget(SEQ_KEY) or 0
+
+    deadline = time.monotonic() + _stream_timeout()
+    last_write = time.monotonic()
+    while time.monotonic() < deadline:
+        current, events = await aevents_since(last_seq)
+        if current < last_seq:
+            # Sequence was reset (cache flushed); follow the new one
+            last_seq = current
+        for event in events:
+            last_seq = event['seq']
+            last_write = time.monotonic()
+            yield format_sse(event)
+        if time.monotonic() - last_write >= HEARTBEAT_INTERVAL:
+            last_write = time.monotonic()
+            yield ': heartbeat\n\n'
+        await asyncio.sleep(_poll_interval())
@@ -0,0 +1,166 @@
+"""Bulk ProductSize inventory import/export.
+
+The CSV format is one row per size with a header line:
+
+    product,size,price,stock
+
+``product`` is the Product id; ``price`` may be blank or 0 to use the
+product's base price (same rule as ``ProductSize.save``). Files without a
+``price`` column only update stock and leave existing prices alone. Extra
+columns such as ``product_name`` in exported files are ignored on import, so
+an export can be edited and uploaded back as-is.
+
+Rows are read lazily and applied in fixed-size chunks with a single upsert
+per chunk, so memory use does not depend on the size of the file.
+"""
+import csv
+from decimal import Decimal, InvalidOperation
+from functools import partial
+from itertools import islice
+
+from django.db import transaction
+
+from .availability import bump
+from .catalogue import changed as catalogue_changed
+from .models import Product, ProductSize
+from .streaming import iterate
+
+HEADER = ['product', 'size', 'price', 'stock']
+EXPORT_HEADER = HEADER + ['product_name']
+REQUIRED_COLUMNS = {'product', 'size', 'stock'}
+VALID_SIZES = {value for value, _ in ProductSize.SIZE_CHOICES}
+DEFAULT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+
+class InventoryImportError(Exception):
+    pass
+
+
+class ImportResult:
+    """Counters for an import run. Only the first errors are kept."""
+
+    def __init__(self):
+        self.rows = 0
+        self.applied = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def __str__(self):
+        return f'{self.rows} rows read, {self.applied} applied, {self.error_count} rejected'
+
+
+def read_rows(lines):
+    """Return (columns, rows) for an iterable of CSV text lines.
+
+    ``rows`` lazily yields (line_number, row dict) with lower-cased keys.
+    """
+    reader = csv.DictReader(lines)
+    columns = {name.strip().lower() for name in reader.fieldnames or []}
+    missing = REQUIRED_COLUMNS - columns
+    if missing:
+        raise InventoryImportError(f"Missing column(s): {', '.join(sorted(missing))}")
+
+    def rows():
+        for row in reader:
+            yield reader.line_num, {(k or '').strip().lower(): (v or '').strip() for k, v in row.items()}
+    return columns, rows()
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _validate_chunk(chunk, result):
+    """Turn a chunk of raw rows into unsaved ProductSize objects."""
+    product_ids = set()
+    for _, row in chunk:
+        if row.get('product', '').isdigit():
+            product_ids.add(int(row['product']))
+    base_prices = dict(Product.objects.filter(pk__in=product_ids).values_list('pk', 'base_price'))
+
+    # Keyed by (product, size) so a repeated row in one chunk keeps the last
+    # value instead of hitting the same row twice in a single upsert
+    objs = {}
+    for line, row in chunk:
+        result.rows += 1
+        product = row.get('product', '')
+        if not product.isdigit() or int(product) not in base_prices:
+            result.add_error(line, f'Unknown product {product!r}')
+            continue
+        product_id = int(product)
+
+        size = row.get('size', '')
+        if size not in VALID_SIZES:
+            result.add_error(line, f'Invalid size {size!r}')
+            continue
+
+        try:
+            stock = int(row.get('stock', ''))
+        except ValueError:
+            result.add_error(line, f"Invalid stock {row.get('stock')!r}")
+            continue
+        if stock < 0:
+            result.add_error(line, 'Stock cannot be negative')
+            continue
+
+        try:
+            price = Decimal(row.get('price') or 0)
+        except InvalidOperation:
+            result.add_error(line, f"Invalid price {row.get('price')!r}")
+            continue
+        if price < 0:
+            result.add_error(line, 'Price cannot be negative')
+            continue
+        if price == 0:
+            price = base_prices[product_id]
+
+        objs[(product_id, size)] = ProductSize(product_id=product_id, size=size, price=price, stock=stock)
+    return list(objs.values())
+
+
+def import_inventory(lines, chunk_size=DEFAULT_CHUNK_SIZE, dry_run=False):
+    """Validate and upsert inventory rows from ``lines``.
+
+    Each chunk is applied in its own transaction, so a crash midway leaves
+    earlier chunks applied. Re-running the same file is harmless.
+    """
+    result = ImportResult()
+    columns, rows = read_rows(lines)
+    update_fields = ['price', 'stock'] if 'price' in columns else ['stock']
+    for chunk in _chunks(rows, chunk_size):
+        objs = _validate_chunk(chunk, result)
+        if objs and not dry_run:
+            with transaction.atomic():
+                ProductSize.objects.bulk_create(
+                    objs,
+                    update_conflicts=True,
+                    unique_fields=['product', 'size'],
+                    update_fields=update_fields,
+                )
+                # bulk_create sends no signals; refresh the product pages' availability
+                # and the shop's catalogue index
+                product_ids = {obj.product_id for obj in objs}
+                transaction.on_commit(partial(bump, *product_ids))
+                transaction.on_commit(partial(catalogue_changed, *product_ids))
+        result.applied += len(objs)
+    return result
+
+
+def export_rows(chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield inventory rows in EXPORT_HEADER order without loading them all."""
+    queryset = ProductSize.objects.select_related('product').only(
+        'product_id', 'size', 'price', 'stock', 'product__name',
+    ).order_by('product_id', 'size')
+    for size in iterate(queryset, chunk_size):
+        yield size.product_id, size.size, size.price, size.stock, size.product.name
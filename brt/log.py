@@ -0,0 +1,180 @@
+"""Structured, non-blocking logging for the social posting pipeline.
+
+Records are written as JSON lines, one object per line:
+
+    {"ts": "...", "level": "INFO", "logger": "brt.signals", "msg": "external call",
+     "correlation_id": "9f2c41d07a3b", "product_id": 12, "service": "graph_api",
+     "operation": "media_publish", "status": 200, "duration_ms": 412.7}
+
+The ``brt`` logger's handler is a QueueHandler. The calling thread (a
+request or a posting thread) only resolves the message and puts the record
+on a queue. A QueueListener thread does the formatting and the write to
+stdout.
+
+``correlation()`` tags every record logged inside it. Use one per publish
+so that all of a product's Graph API calls can be grouped.
+``external_call()`` times a call to an outside service: it logs the call
+and feeds ``external_call_duration_seconds`` in the metrics registry.
+``log_payload()`` attaches full API response bodies only to a sample of
+calls (LOG_PAYLOAD_SAMPLE_RATE) and to every error.
+
+Settings:
+    LOG_LEVEL                level of the ``brt`` logger (default INFO)
+    LOG_PAYLOAD_SAMPLE_RATE  fraction of successful calls logged with their body (default 0.1)
+    LOG_PAYLOAD_MAX_CHARS    bodies are truncated to this length (default 2000)
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+from .metrics import REGISTRY
+
+EXTERNAL_CALL_DURATION = REGISTRY.histogram(
+    'external_call_duration_seconds', 'Calls to outside services from the posting pipeline',
+    ['service', 'operation', 'outcome'])
+
+_context = contextvars.ContextVar('log_context', default={})
+
+# Attributes every LogRecord has; anything else was passed through ``extra``
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+@contextmanager
+def correlation(correlation_id=None, **fields):
+    """Add a correlation id (and ``fields``) to every record logged in this block.
+
+    Context variables are not inherited by new threads: open the block
+    inside the thread that does the work.
+    """
+    context = {**_context.get(), 'correlation_id': correlation_id or uuid.uuid4().hex[:12], **fields}
+    token = _context.set(context)
+    try:
+        yield context['correlation_id']
+    finally:
+        _context.reset(token)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        entry.update(getattr(record, 'context', None) or _context.get())
+        entry.update((key, value) for key, value in vars(record).items()
+                     if key not in _RECORD_ATTRS and key != 'context')
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """Hand records to a background listener that formats and writes them.
+
+    The formatter set on this handler (``formatter`` in LOGGING) is used by
+    the listener's stream handler.
+
+    The listener thread is started by the first record each process logs.
+    With gunicorn's ``preload_app`` logging is configured in the master,
+    and forked workers inherit this handler but not the master's thread.
+    """
+
+    def __init__(self, stream=None):
+        super().__init__(queue.SimpleQueue())
+        self.target = logging.StreamHandler(stream or sys.stdout)
+        self.listener = None
+        self._pid = None
+        # Flush what is still queued when the process exits
+        atexit.register(self.close)
+
+    def _start_listener(self):
+        # A fresh queue: the one copied from the parent may hold its unwritten records
+        self.queue = queue.SimpleQueue()
+        self.listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+        self._pid = os.getpid()
+
+    def enqueue(self, record):
+        # Called with the handler lock held, which logging re-creates after a fork
+        if self._pid != os.getpid():
+            self._start_listener()
+        super().enqueue(record)
+
+    def setFormatter(self, fmt):
+        self.target.setFormatter(fmt)
+
+    def close(self):
+        if self._pid == os.getpid() and self.listener._thread is not None:
+            self.listener.stop()
+        super().close()
+
+    def prepare(self, record):
+        # Only the cheap, thread-sensitive parts happen here: resolving the
+        # message (arguments may change after this call returns), rendering
+        # a traceback and capturing the correlation context
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.context = _context.get()
+        return record
+
+
+def _truncate(payload):
+    limit = getattr(settings, 'LOG_PAYLOAD_MAX_CHARS', 2000)
+    text = payload if isinstance(payload, str) else json.dumps(payload, default=str, ensure_ascii=False)
+    return text if len(text) <= limit else text[:limit] + f'... ({len(text)} chars)'
+
+
+def log_payload(logger, msg, payload, error=False, **fields):
+    """Log ``msg`` with ``fields``; include ``payload`` for errors and a sample of the rest."""
+    if error or random.random() < getattr(settings, 'LOG_PAYLOAD_SAMPLE_RATE', 0.1):
+        fields['payload'] = _truncate(payload)
+    logger.log(logging.WARNING if error else logging.INFO, msg, extra=fields)
+
+
+@contextmanager
+def external_call(logger, service, operation, **fields):
+    """Time a call to an outside service and log it with its outcome.
+
+    The block receives a dict: put ``status`` (or anything else worth
+    logging) in it. An exception escaping the block is recorded and re-raised.
+    """
+    call = dict(fields)
+    outcome = 'ok'
+    start = time.perf_counter()
+    try:
+        yield call
+    except Exception as e:
+        outcome = 'error'
+        call['error'] = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        if outcome == 'ok' and isinstance(call.get('status'), int) and call['status'] >= 400:
+            outcome = 'http_error'
+        EXTERNAL_CALL_DURATION.observe(duration, service=service, operation=operation, outcome=outcome)
+        logger.log(
+            logging.INFO if outcome == 'ok' else logging.WARNING, 'external call',
+            extra={**call, 'service': service, 'operation': operation, 'outcome': outcome,
+                   'duration_ms': round(duration * 1000, 1)},
+        )
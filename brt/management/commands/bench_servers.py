@@ -0,0 +1,70 @@
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from brt.benchmarking import free_port, run_load, summarize, wait_until_up
+
+# Worker modes from gunicorn.conf.py to compare
+MODES = ['sync', 'uvicorn']
+
+
+class Command(BaseCommand):
+    help = (
+        'Start the app under gunicorn sync workers and under uvicorn (ASGI) workers, '
+        'drive the same concurrent load at each, and compare throughput and latency.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', action='append', help='URL path(s) to request (default: /shop/)')
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--workers', type=int, default=2, help='Worker processes for each server')
+        parser.add_argument('--mode', action='append', choices=MODES, help='Only run these modes')
+
+    def handle(self, *args, **options):
+        paths = options['path'] or ['/shop/']
+        results = []
+        for mode in options['mode'] or MODES:
+            results.append(self.run_mode(mode, paths, options))
+
+        self.stdout.write('')
+        self.stdout.write(f"{'mode':<10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        for row in results:
+            self.stdout.write(
+                f"{row['mode']:<10}{row['rps']:>10.1f}{row['p50']:>10.1f}{row['p95']:>10.1f}"
+                f"{row['p99']:>10.1f}{row['errors']:>8}"
+            )
+
+    def run_mode(self, mode, paths, options):
+        port = free_port()
+        env = {
+            **os.environ,
+            'PORT': str(port),
+            'GUNICORN_WORKER_CLASS': mode,
+            'WEB_CONCURRENCY': str(options['workers']),
+            'GUNICORN_LOG_LEVEL': 'warning',
+        }
+        config = os.path.join(settings.BASE_DIR, 'gunicorn.conf.py')
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--config', config],
+            cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            base = f'http://127.0.0.1:{port}'
+            if not wait_until_up(base + paths[0]):
+                raise CommandError(f'{mode} server did not start on port {port}')
+            self.stdout.write(f'{mode}: {options["requests"]} requests, concurrency {options["concurrency"]}')
+
+            urls = [base + paths[i % len(paths)] for i in range(options['requests'])]
+            samples, elapsed = run_load(urls, options['concurrency'])
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+        result = summarize(samples, elapsed)
+        if result['p50'] is None:
+            raise CommandError(f'Every request to the {mode} server failed')
+        return {'mode': mode, **result}
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from brt.assets import PAGES, build
+
+
+class Command(BaseCommand):
+    help = (
+        'Build per-page CSS/JS bundles into static/dist/: critical CSS to inline, '
+        'plus minified stylesheets and scripts. Run before collectstatic.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('pages', nargs='*', help=f'Pages to build (default: all of {", ".join(PAGES)})')
+
+    def handle(self, *args, **options):
+        unknown = set(options['pages']) - set(PAGES)
+        if unknown:
+            raise CommandError(f'Unknown page(s): {", ".join(sorted(unknown))}')
+        try:
+            report = build(options['pages'])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        for page, sizes in report.items():
+            self.stdout.write(f'{page}: ' + ', '.join(f'{kind} {size:,} B' for kind, size in sizes.items()))
@@ -0,0 +1,24 @@
+import csv
+
+from django.core.management.base import BaseCommand
+
+from brt.inventory import EXPORT_HEADER, export_rows
+
+
+class Command(BaseCommand):
+    help = 'Write all ProductSize rows as CSV (product,size,price,stock,product_name).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', help='File to write (default: stdout)')
+
+    def handle(self, *args, **options):
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as f:
+                self.write_csv(f)
+        else:
+            self.write_csv(self.stdout)
+
+    def write_csv(self, out):
+        writer = csv.writer(out)
+        writer.writerow(EXPORT_HEADER)
+        writer.writerows(export_rows())
@@ -0,0 +1,36 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from brt.models import Order
+from brt.order_export import DEFAULT_CHUNK_SIZE, FORMATS, export_lines, filter_orders
+
+
+def _parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f'Invalid date {value!r}, expected YYYY-MM-DD')
+
+
+class Command(BaseCommand):
+    help = 'Stream orders with their items as CSV or JSON lines.'
+
+    def add_arguments(self, parser):
+        statuses = [value for value, _ in Order.STATUS_CHOICES]
+        parser.add_argument('--status', action='append', choices=statuses, help='Repeat for several statuses')
+        parser.add_argument('--since', type=_parse_date, help='First created_at date (inclusive)')
+        parser.add_argument('--until', type=_parse_date, help='Last created_at date (inclusive)')
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--output', '-o', help='File to write (default: stdout)')
+
+    def handle(self, *args, **options):
+        queryset = filter_orders(statuses=options['status'], start=options['since'], end=options['until'])
+        lines = export_lines(queryset, options['format'], options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as f:
+                f.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,32 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from brt.inventory import DEFAULT_CHUNK_SIZE, InventoryImportError, import_inventory
+
+
+class Command(BaseCommand):
+    help = 'Upsert ProductSize price/stock from a CSV file (product,size,price,stock). Use "-" for stdin.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='Validate only, write nothing')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            if path == '-':
+                result = import_inventory(sys.stdin, options['chunk_size'], options['dry_run'])
+            else:
+                with open(path, newline='', encoding='utf-8-sig') as f:
+                    result = import_inventory(f, options['chunk_size'], options['dry_run'])
+        except (OSError, InventoryImportError) as e:
+            raise CommandError(str(e))
+
+        for line, message in result.errors:
+            self.stderr.write(f'line {line}: {message}')
+        if result.error_count > len(result.errors):
+            self.stderr.write(f'... and {result.error_count - len(result.errors)} more errors')
+        prefix = '[dry run] ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(f'{prefix}{result}'))
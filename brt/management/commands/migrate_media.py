@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from brt.media_migration import MediaMigrationError, migrate
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy (or move) product images to local storage or Cloudinary, verifying checksums, '
+        'and record their width, height and size. Resumable from its checkpoint file.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--to', choices=['cloudinary', 'local'], required=True, help='Storage to migrate into')
+        parser.add_argument('--move', action='store_true', help='Delete the originals once the new names are saved')
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent transfers')
+        parser.add_argument('--checkpoint', default='media_migration.json',
+                            help='Progress file; an interrupted run resumes from it')
+        parser.add_argument('--checkpoint-every', type=int, default=25, help='Save progress after this many transfers')
+        parser.add_argument('--local-root', help='Local media directory (default: MEDIA_ROOT)')
+
+    def handle(self, *args, **options):
+        def progress(done, failed, total):
+            self.stdout.write(f'{done + failed}/{total} transferred, {failed} failed')
+
+        try:
+            updated, failed = migrate(
+                options['to'], move=options['move'], workers=options['workers'],
+                checkpoint_path=options['checkpoint'], checkpoint_every=options['checkpoint_every'],
+                local_root=options['local_root'], progress=progress,
+            )
+        except MediaMigrationError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} image(s)'))
+        if failed:
+            self.stdout.write(self.style.WARNING(
+                f'{failed} image(s) failed; see the log and {options["checkpoint"]}, then run again to retry them'))
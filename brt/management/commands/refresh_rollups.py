@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from brt.rollups import refresh_rollups
+
+
+class Command(BaseCommand):
+    help = 'Update the sales/inventory rollup tables from orders changed since the last run.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild every rollup from scratch')
+
+    def handle(self, *args, **options):
+        days = refresh_rollups(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {days} day(s) of sales rollups'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from brt.outbound import scheduler
+from brt.releases import DEFAULT_LEAD, DEFAULT_MAX_SLEEP, release_due, run
+
+
+class Command(BaseCommand):
+    help = 'Publish scheduled products when their publish_at time arrives and queue their social posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Release whatever is due now, wait for its posts and exit')
+        parser.add_argument('--lead', type=int, default=DEFAULT_LEAD,
+                            help='Seconds before a release to pre-check its images')
+        parser.add_argument('--max-sleep', type=int, default=DEFAULT_MAX_SLEEP,
+                            help='Longest sleep between checks for newly scheduled products')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            ids = release_due()
+            # Also sends any posts left queued by a restarted worker
+            scheduler.run_pending()
+            scheduler.join()
+            self.stdout.write(self.style.SUCCESS(f'Released {len(ids)} product(s)'))
+            return
+        run(lead=options['lead'], max_sleep=options['max_sleep'], stdout=self.stdout)
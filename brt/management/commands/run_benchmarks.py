@@ -0,0 +1,199 @@
+import json
+import os
+import random
+import time
+import urllib.parse
+import urllib.request
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from brt.benchmarking import fetch, git_revision, run_load, summarize
+from brt.models import Order, Product
+
+BENCHMARK_EMAIL = 'benchmark@example.invalid'
+CHECKOUT_DATA = {
+    'customer_name': 'Benchmark', 'customer_email': BENCHMARK_EMAIL, 'customer_phone': '09170000000',
+    'customer_address': 'Dipolog City', 'payment_method': 'COD', 'total_amount': '5000',
+}
+
+
+def build_scenarios(rng, include_checkout=True):
+    """Return ``{name: [(method, path, data), ...]}`` drawn from the current database."""
+    product_ids = list(Product.objects.values_list('pk', flat=True)[:500])
+    order_ids = list(Order.objects.values_list('order_id', flat=True)[:500])
+    brands = list(Product.objects.exclude(brand='').values_list('brand', flat=True).distinct()[:20])
+    if not product_ids:
+        raise CommandError('No products found; run `manage.py seed_catalogue` first')
+
+    def shop(**params):
+        return [('GET', '/shop/?' + urllib.parse.urlencode(params, doseq=True), None)]
+
+    scenarios = {
+        'shop': shop(),
+        'shop_sort_price': shop(sort='price_low'),
+        'shop_brand_filter': shop(brand=brands[:2], sort='name') if brands else shop(sort='name'),
+        'shop_size_filter': shop(size=['US 9', 'US 10'], sort='price_high'),
+        'shop_price_range': shop(min_price=3000, max_price=8000),
+        'shop_search': shop(q='Runner'),
+        'product_detail': [('GET', f'/product/{pk}/', None) for pk in rng.sample(product_ids, min(20, len(product_ids)))],
+    }
+    if order_ids:
+        scenarios['track_order'] = [
+            ('GET', '/track-order/?' + urllib.parse.urlencode({'id': oid}), None)
+            for oid in rng.sample(order_ids, min(20, len(order_ids)))
+        ]
+    if include_checkout:
+        scenarios['checkout'] = [('POST', '/checkout/', CHECKOUT_DATA)]
+    return scenarios
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the storefront: shop with filter/sort combinations, product_detail, track_order '
+        'and checkout. By default requests go through the Django test client, which also counts '
+        'queries per request; with --url they are sent concurrently to a running server. Results '
+        'are written as JSON (with the git revision) and can be compared with --compare.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50, help='Requests per scenario (test client)')
+        parser.add_argument('--url', help='Base URL of a running server to load instead, e.g. http://127.0.0.1:8000')
+        parser.add_argument('--requests', type=int, default=500, help='Requests per scenario with --url')
+        parser.add_argument('--concurrency', type=int, default=20, help='Concurrent requests with --url')
+        parser.add_argument('--scenario', action='append', help='Only run these scenarios')
+        parser.add_argument('--no-checkout', action='store_true', help="Skip checkout (it creates orders)")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='JSON results file (default: benchmarks/<revision>-<time>.json)')
+        parser.add_argument('--compare', help='Earlier results file to compare against')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        scenarios = build_scenarios(rng, include_checkout=not options['no_checkout'])
+        if options['scenario']:
+            unknown = set(options['scenario']) - set(scenarios)
+            if unknown:
+                raise CommandError(f'Unknown scenario(s): {", ".join(sorted(unknown))}')
+            scenarios = {name: reqs for name, reqs in scenarios.items() if name in options['scenario']}
+
+        if options['url']:
+            results = self.run_http(scenarios, options)
+            if 'checkout' in scenarios:
+                # They went to the server's database, which may not be this one
+                self.stderr.write(self.style.WARNING(
+                    f"Checkout created orders on {options['url']}; delete them there "
+                    f"(customer_email={BENCHMARK_EMAIL})"))
+        else:
+            orders_before = set(Order.objects.filter(customer_email=BENCHMARK_EMAIL).values_list('pk', flat=True))
+            try:
+                results = self.run_client(scenarios, options['iterations'])
+            finally:
+                # Remove the orders checkout created
+                Order.objects.filter(customer_email=BENCHMARK_EMAIL).exclude(pk__in=orders_before).delete()
+
+        report = {
+            'revision': git_revision(settings.BASE_DIR),
+            'timestamp': timezone.now().isoformat(),
+            'mode': 'http' if options['url'] else 'client',
+            'database': connection.vendor,
+            'catalogue': {'products': Product.objects.count(), 'orders': Order.objects.count()},
+            'options': {k: options[k] for k in ('iterations', 'requests', 'concurrency', 'seed')},
+            'scenarios': results,
+        }
+        self.print_table(results)
+        path = options['output'] or os.path.join(
+            settings.BASE_DIR, 'benchmarks',
+            f"{(report['revision'] or 'unknown')[:12]}-{timezone.now():%Y%m%d-%H%M%S}.json",
+        )
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(f'Results written to {path}')
+        if options['compare']:
+            self.print_comparison(options['compare'], results)
+
+    def run_client(self, scenarios, iterations):
+        client = Client(raise_request_exception=False)
+        results = {}
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for name, requests in scenarios.items():
+                samples, queries = [], []
+                for method, path, data in requests[:2]:  # warm up caches and connections
+                    self.client_request(client, method, path, data)
+                start = time.perf_counter()
+                for i in range(iterations):
+                    method, path, data = requests[i % len(requests)]
+                    with CaptureQueriesContext(connection) as ctx:
+                        duration, ok = self.client_request(client, method, path, data)
+                    samples.append((duration, ok))
+                    queries.append(len(ctx.captured_queries))
+                results[name] = {
+                    **summarize(samples, time.perf_counter() - start),
+                    'queries_avg': sum(queries) / len(queries) if queries else 0,
+                    'queries_max': max(queries, default=0),
+                }
+        return results
+
+    def client_request(self, client, method, path, data):
+        start = time.perf_counter()
+        response = client.post(path, data) if method == 'POST' else client.get(path)
+        if hasattr(response, 'streaming_content'):
+            b''.join(response.streaming_content)
+        return time.perf_counter() - start, response.status_code < 400
+
+    def run_http(self, scenarios, options):
+        base = options['url'].rstrip('/')
+        # CsrfViewMiddleware only checks that the cookie and form secrets match
+        csrf_token = get_random_string(32)
+        results = {}
+        for name, requests in scenarios.items():
+            prepared = []
+            for i in range(options['requests']):
+                method, path, data = requests[i % len(requests)]
+                if method == 'POST':
+                    body = urllib.parse.urlencode({**data, 'csrfmiddlewaretoken': csrf_token}).encode()
+                    prepared.append(urllib.request.Request(
+                        base + path, data=body, method='POST',
+                        headers={'Cookie': f'csrftoken={csrf_token}', 'Referer': base + path},
+                    ))
+                else:
+                    prepared.append(base + path)
+            fetch(prepared[0])  # warm up
+            samples, elapsed = run_load(prepared, options['concurrency'])
+            results[name] = summarize(samples, elapsed)
+        return results
+
+    def print_table(self, results):
+        self.stdout.write('')
+        self.stdout.write(f"{'scenario':<20}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'errors':>8}")
+        for name, row in results.items():
+            if row['p50'] is None:
+                self.stdout.write(f'{name:<20}{"all requests failed":>53}')
+                continue
+            queries = f"{row['queries_avg']:.1f}" if 'queries_avg' in row else '-'
+            self.stdout.write(
+                f"{name:<20}{row['rps']:>9.1f}{row['p50']:>9.1f}{row['p95']:>9.1f}{row['p99']:>9.1f}"
+                f"{queries:>9}{row['errors']:>8}"
+            )
+
+    def print_comparison(self, path, results):
+        try:
+            with open(path) as f:
+                previous = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Cannot read {path}: {e}')
+        self.stdout.write('')
+        self.stdout.write(f"Compared with {previous.get('revision') or path}:")
+        for name, row in results.items():
+            old = previous.get('scenarios', {}).get(name)
+            if not old or old.get('p50') is None or row['p50'] is None:
+                continue
+            changes = [f"{key} {(row[key] - old[key]) / old[key] * 100:+.0f}%" for key in ('p50', 'p95', 'rps') if old[key]]
+            if 'queries_avg' in row and 'queries_avg' in old:
+                changes.append(f"queries {old['queries_avg']:.1f} -> {row['queries_avg']:.1f}")
+            self.stdout.write(f'  {name:<20}' + ', '.join(changes))
@@ -0,0 +1,125 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from brt.catalogue import invalidate
+from brt.models import Order, OrderItem, Product, ProductImage, ProductSize
+
+SEED_DESCRIPTION = 'Seeded catalogue product for load testing.'
+SEED_EMAIL_DOMAIN = 'seed.invalid'
+BRANDS = ['Nike', 'Adidas', 'New Balance', 'Asics', 'Puma', 'Converse', 'Vans', 'Li-Ning', 'Anta', 'Under Armour']
+MODELS = ['Runner', 'Court', 'Glide', 'Trail', 'Classic', 'Pro', 'Flux', 'Zoom', 'Street', 'Retro']
+STATUS_WEIGHTS = {'pending': 10, 'paid': 25, 'processing': 15, 'shipped': 20, 'delivered': 25, 'cancelled': 5}
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a realistic catalogue for load testing: N products with every size in '
+        'ProductSize.SIZE_CHOICES and up to 5 images each, plus M orders. Uses bulk inserts, '
+        'so no signals (social posting) fire. Seeded rows can be removed with --clear.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=200)
+        parser.add_argument('--orders', type=int, default=1000)
+        parser.add_argument('--max-images', type=int, default=5)
+        parser.add_argument('--days', type=int, default=90, help='Spread order dates over this many days')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed, for repeatable catalogues')
+        parser.add_argument('--clear', action='store_true', help='Delete previously seeded rows first')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            if options['clear']:
+                orders, _ = Order.objects.filter(customer_email__endswith='@' + SEED_EMAIL_DOMAIN).delete()
+                products, _ = Product.objects.filter(description=SEED_DESCRIPTION).delete()
+                self.stdout.write(f'Removed {products} seeded product rows and {orders} seeded order rows')
+            products = self.create_products(rng, options['products'], options['max_images'])
+            orders, items = self.create_orders(rng, products, options['orders'], options['days'])
+        # Bulk inserts send no signals
+        invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(products)} products ({len(products) * len(ProductSize.SIZE_CHOICES)} sizes) '
+            f'and {orders} orders ({items} items)'
+        ))
+
+    def create_products(self, rng, count, max_images):
+        start = Product.objects.count()
+        now = timezone.now()
+        Product.objects.bulk_create([
+            Product(
+                name=f'{rng.choice(BRANDS)} {rng.choice(MODELS)} {start + i + 1}',
+                description=SEED_DESCRIPTION,
+                brand=rng.choice(BRANDS),
+                category=rng.choice(Product.CATEGORY_CHOICES)[0],
+                base_price=Decimal(rng.randrange(2500, 12000, 50)),
+                is_on_sale=rng.random() < 0.15,
+                is_trending=rng.random() < 0.2,
+                is_published=True,
+                published_at=now,
+            )
+            for i in range(count)
+        ], batch_size=BATCH_SIZE)
+        # Not every backend returns primary keys from bulk_create
+        products = list(
+            Product.objects.filter(description=SEED_DESCRIPTION).order_by('-pk')[:count]
+            .values_list('pk', 'name', 'base_price')
+        )
+
+        sizes, images = [], []
+        for pk, _, base_price in products:
+            for n, (size, _) in enumerate(ProductSize.SIZE_CHOICES):
+                # Larger sizes cost a little more; about a fifth are sold out
+                stock = 0 if rng.random() < 0.2 else rng.randint(1, 12)
+                sizes.append(ProductSize(product_id=pk, size=size, price=base_price + 50 * (n // 6), stock=stock))
+            for n in range(rng.randint(1, max(1, max_images))):
+                images.append(ProductImage(product_id=pk, image=f'products/seed/{pk}_{n}.jpg', is_primary=n == 0, order=n))
+        ProductSize.objects.bulk_create(sizes, batch_size=BATCH_SIZE)
+        ProductImage.objects.bulk_create(images, batch_size=BATCH_SIZE)
+        return products
+
+    def create_orders(self, rng, products, count, days):
+        if not products or not count:
+            return 0, 0
+        start = Order.objects.count()
+        statuses, weights = zip(*STATUS_WEIGHTS.items())
+        now = timezone.now()
+        total_items = 0
+
+        for offset in range(0, count, BATCH_SIZE):
+            batch = range(offset, min(count, offset + BATCH_SIZE))
+            orders, lines = [], []
+            for i in batch:
+                n = start + i + 1
+                picks = [(rng.choice(products), rng.choice(ProductSize.SIZE_CHOICES)[0], rng.randint(1, 2))
+                         for _ in range(rng.randint(1, 3))]
+                total = sum(price * quantity for (_, _, price), _, quantity in picks)
+                orders.append(Order(
+                    order_id=f'SEED-{n:08d}-{rng.getrandbits(24):06x}', customer_name=f'Customer {n}',
+                    customer_email=f'customer{n}@{SEED_EMAIL_DOMAIN}', customer_phone='09170000000',
+                    customer_address='Dipolog City, Zamboanga del Norte', total_amount=total,
+                    payment_method=rng.choice(['GCash', 'PayMaya', 'Bank Transfer', 'COD']),
+                    status=rng.choices(statuses, weights)[0],
+                ))
+                lines.append(picks)
+            Order.objects.bulk_create(orders)
+            created = {o.order_id: o for o in Order.objects.filter(order_id__in=[o.order_id for o in orders])}
+
+            # auto_now_add/auto_now overwrite dates on insert, so backdate afterwards
+            items = []
+            for order, picks in zip(orders, lines):
+                saved = created[order.order_id]
+                saved.created_at = now - timedelta(seconds=rng.randint(0, days * 86400))
+                saved.updated_at = min(now, saved.created_at + timedelta(hours=rng.randint(0, 72)))
+                for (pk, name, price), size, quantity in picks:
+                    items.append(OrderItem(order=saved, product_id=pk, product_name=name, size=size,
+                                           price=price, quantity=quantity))
+            Order.objects.bulk_update(created.values(), ['created_at', 'updated_at'], batch_size=BATCH_SIZE)
+            OrderItem.objects.bulk_create(items, batch_size=BATCH_SIZE)
+            total_items += len(items)
+        return count, total_items
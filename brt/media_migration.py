@@ -0,0 +1,247 @@
+"""Copy or move product images between local storage and Cloudinary.
+
+Media is stored in MEDIA_ROOT when DEBUG is on or Cloudinary isn't set up,
+and on Cloudinary otherwise, so a database can end up pointing into both.
+Names tell the two apart: ``MediaCloudinaryStorage`` names are Cloudinary
+public ids and start with the MEDIA_URL prefix (``media/products/...``),
+while local names are paths under MEDIA_ROOT (``products/...``).
+
+``migrate()`` copies every image that isn't on the target yet. A bounded
+thread pool does the transfers:
+
+- each file is read from the source and written to the target;
+- the target's checksum of the stored file (Cloudinary's ``etag``, or the
+  file read back from disk) must equal the MD5 of the source bytes;
+- width, height and size are measured from the bytes on the way.
+
+Images already on the target but missing their width, height or size are
+read and measured too (a backfill).
+
+Progress is saved to a JSON checkpoint file as transfers finish, and an
+interrupted run carries on from it. Transfers are idempotent, so work done
+after the last checkpoint is repeated harmlessly. Only at the end are the
+new names written, with one ``bulk_update``; until then the site keeps
+serving the originals. With ``move``, the originals are deleted once the
+new names are committed.
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+import posixpath
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+
+from .models import ProductImage
+
+logger = logging.getLogger(__name__)
+
+FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp', 'GIF': '.gif'}
+
+
+class MediaMigrationError(Exception):
+    pass
+
+
+def cloudinary_prefix():
+    from cloudinary_storage import app_settings
+
+    prefix = app_settings.PREFIX.strip('/')
+    return f'{prefix}/' if prefix else ''
+
+
+def measure(data):
+    """``(width, height, format)`` of an image's bytes."""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        return image.width, image.height, image.format
+
+
+class LocalMedia:
+    name = 'local'
+
+    def __init__(self, root=None):
+        self.storage = FileSystemStorage(location=root or settings.MEDIA_ROOT, base_url=settings.MEDIA_URL)
+
+    def holds(self, name):
+        return not name.startswith(cloudinary_prefix())
+
+    def read(self, name):
+        with self.storage.open(name, 'rb') as f:
+            return f.read()
+
+    def write(self, name, data):
+        """Store ``data`` under a local version of ``name``; returns ``(stored name, md5)``."""
+        name = name.removeprefix(cloudinary_prefix())
+        if not posixpath.splitext(name)[1]:
+            # Cloudinary public ids have no extension
+            name += FORMAT_EXTENSIONS.get(measure(data)[2], '')
+        digest = hashlib.md5(data).hexdigest()
+        if self.storage.exists(name) and hashlib.md5(self.read(name)).hexdigest() == digest:
+            return name, digest  # copied by an earlier, interrupted run
+        stored = self.storage.save(name, ContentFile(data))
+        return stored, hashlib.md5(self.read(stored)).hexdigest()
+
+    def delete(self, name):
+        self.storage.delete(name)
+
+
+class CloudinaryMedia:
+    name = 'cloudinary'
+
+    def __init__(self):
+        from cloudinary_storage.storage import MediaCloudinaryStorage
+
+        self.storage = MediaCloudinaryStorage()
+
+    def holds(self, name):
+        return name.startswith(cloudinary_prefix())
+
+    def read(self, name):
+        return self.storage.open(name).read()
+
+    def write(self, name, data):
+        import cloudinary.uploader
+        from cloudinary_storage import app_settings
+
+        # A fixed public id (and overwrite) makes a repeated upload replace, not duplicate
+        public_id = cloudinary_prefix() + posixpath.splitext(name.removeprefix(cloudinary_prefix()))[0]
+        result = cloudinary.uploader.upload(io.BytesIO(data), public_id=public_id, overwrite=True,
+                                            resource_type='image', tags=app_settings.MEDIA_TAG)
+        return result['public_id'], result.get('etag')
+
+    def delete(self, name):
+        self.storage.delete(name)
+
+
+def media_store(name, local_root=None):
+    if name == 'local':
+        return LocalMedia(local_root)
+    if name == 'cloudinary':
+        return CloudinaryMedia()
+    raise MediaMigrationError(f'Unknown storage: {name}')
+
+
+class Checkpoint:
+    """Finished transfers, saved as JSON so an interrupted run can resume."""
+
+    def __init__(self, path, target):
+        self.path = path
+        self.done, self.failed = {}, {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state.get('target') != target:
+                raise MediaMigrationError(f'{path} is a checkpoint for a migration to {state.get("target")}')
+            self.done = state['done']
+        self.target = target
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'target': self.target, 'done': self.done, 'failed': self.failed}, f)
+        os.replace(tmp, self.path)
+
+    def remove(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _transfer(source, target, name):
+    data = source.read(name)
+    width, height, _ = measure(data)
+    if source is target:
+        stored = name
+    else:
+        stored, checksum = target.write(name, data)
+        if checksum != hashlib.md5(data).hexdigest():
+            raise MediaMigrationError(f'checksum mismatch for {stored}')
+    return {'name': stored, 'width': width, 'height': height, 'file_size': len(data)}
+
+
+def plan(target):
+    """``(image id, name, needs copying)`` for every image to copy or backfill."""
+    for pk, name, width, file_size in ProductImage.objects.order_by('pk').values_list('pk', 'image', 'width', 'file_size'):
+        if not name:
+            continue
+        copy = not target.holds(name)
+        if copy or width is None or file_size is None:
+            yield pk, name, copy
+
+
+def migrate(to, move=False, workers=4, checkpoint_path=None, checkpoint_every=25, local_root=None, progress=None):
+    """Copy (or move) every product image to storage ``to``; returns ``(updated, failed)`` counts.
+
+    ``updated`` includes images that were only measured.
+    """
+    target = media_store(to, local_root)
+    other = media_store('cloudinary' if to == 'local' else 'local', local_root)
+    checkpoint = Checkpoint(checkpoint_path, to)
+    todo = [(pk, name, copy) for pk, name, copy in plan(target) if str(pk) not in checkpoint.done]
+    total = len(todo) + len(checkpoint.done)
+
+    # At most two transfers per worker are queued, so memory use stays flat however many images there are
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='media-migrate') as pool:
+        running, pending = {}, iter(todo)
+        finished = 0
+        while True:
+            for pk, name, copy in pending:
+                running[pool.submit(_transfer, other if copy else target, target, name)] = (pk, name)
+                if len(running) >= workers * 2:
+                    break
+            if not running:
+                break
+            completed, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in completed:
+                pk, name = running.pop(future)
+                try:
+                    checkpoint.done[str(pk)] = {**future.result(), 'source': name}
+                except Exception as e:
+                    checkpoint.failed[str(pk)] = str(e)
+                    logger.warning('media transfer failed', extra={'image_id': pk, 'file': name, 'error': str(e)})
+                finished += 1
+                if finished % checkpoint_every == 0:
+                    checkpoint.save()
+                    if progress:
+                        progress(len(checkpoint.done), len(checkpoint.failed), total)
+    checkpoint.save()
+    if progress:
+        progress(len(checkpoint.done), len(checkpoint.failed), total)
+
+    updated = _apply(checkpoint.done)
+    if move:
+        for name in (source for source, stored in updated if source != stored):
+            try:
+                other.delete(name)
+            except Exception as e:
+                logger.warning('could not delete migrated original', extra={'file': name, 'error': str(e)})
+    if not checkpoint.failed:
+        checkpoint.remove()
+    return len(updated), len(checkpoint.failed)
+
+
+def _apply(done):
+    """Write the new names and measurements in bulk (no save signals, so nothing is re-announced).
+
+    Returns ``(original name, new name)`` for each image updated.
+    """
+    images = ProductImage.objects.in_bulk([int(pk) for pk in done])
+    changed = []
+    for pk, result in done.items():
+        image = images.get(int(pk))
+        if image is None or image.image.name != result['source']:
+            continue  # deleted or replaced since it was copied
+        image.image = result['name']
+        image.width, image.height, image.file_size = result['width'], result['height'], result['file_size']
+        changed.append(image)
+    with transaction.atomic():
+        ProductImage.objects.bulk_update(changed, ['image', 'width', 'height', 'file_size'], batch_size=500)
+    return [(done[str(image.pk)]['source'], image.image.name) for image in changed]
@@ -0,0 +1,311 @@
+"""Per-request performance instrumentation.
+
+For a sampled request PerformanceMiddleware records:
+- wall time;
+- database query count and time, via ``connection.execute_wrapper``;
+- cache hits and misses;
+- top-level template render time;
+- outbound HTTP time through ``requests``.
+
+It reports them in a ``Server-Timing`` response header (browser devtools
+show it under Network > Timing) and in the metrics registry served at
+``/metrics``.
+
+Settings:
+    PERF_SAMPLE_RATE    fraction of requests to instrument, 0 disables (default 0)
+    PERF_SERVER_TIMING  add the Server-Timing header (default: DEBUG)
+
+When PERF_SAMPLE_RATE is 0 the middleware removes itself at startup
+(MiddlewareNotUsed) and installs no hooks, so it costs nothing. Unsampled
+requests pay one random() call. Cache, template and HTTP hooks are
+installed once per process. They check a context variable and do nothing
+outside a sampled request.
+
+Streaming responses (exports, event streams) are timed until the view
+returns, not until the last byte is sent.
+"""
+import contextvars
+import logging
+import random
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .metrics import COUNT_BUCKETS, REGISTRY
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('request_timings', default=None)
+_MISSING = object()
+
+REQUEST_DURATION = REGISTRY.histogram(
+    'http_request_duration_seconds', 'Wall time of sampled requests', ['view', 'method', 'status'])
+DB_QUERIES = REGISTRY.histogram(
+    'http_request_db_queries', 'Database queries per sampled request', ['view'], buckets=COUNT_BUCKETS)
+DB_DURATION = REGISTRY.histogram('http_request_db_seconds', 'Database time per sampled request', ['view'])
+TEMPLATE_DURATION = REGISTRY.histogram(
+    'http_request_template_seconds', 'Template render time per sampled request', ['view'])
+OUTBOUND_DURATION = REGISTRY.histogram(
+    'http_request_outbound_seconds', 'Outbound HTTP time per sampled request', ['view'])
+CACHE_LOOKUPS = REGISTRY.counter('cache_lookups', 'Cache lookups made by sampled requests', ['result'])
+
+
+class Timings:
+    __slots__ = ('db_count', 'db_time', 'cache_hits', 'cache_misses', 'template_time', 'template_depth',
+                 'http_count', 'http_time')
+
+    def __init__(self):
+        self.db_count = self.cache_hits = self.cache_misses = self.http_count = self.template_depth = 0
+        self.db_time = self.template_time = self.http_time = 0.0
+
+    def server_timing(self, total):
+        def ms(seconds):
+            return f'{seconds * 1000:.1f}'
+        return ', '.join([
+            f'db;dur={ms(self.db_time)};desc="{self.db_count} queries"',
+            f'tpl;dur={ms(self.template_time)}',
+            f'http;dur={ms(self.http_time)};desc="{self.http_count} calls"',
+            f'cache;desc="{self.cache_hits} hits, {self.cache_misses} misses"',
+            f'total;dur={ms(total)}',
+        ])
+
+
+def current():
+    """Timings for the sampled request in progress, or None."""
+    return _current.get()
+
+
+# --- Hooks -----------------------------------------------------------------------
+
+def _db_wrapper(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db_time += time.perf_counter() - start
+        timings.db_count += 1
+
+
+def _record_cache(hits, misses):
+    timings = _current.get()
+    if timings is not None:
+        timings.cache_hits += hits
+        timings.cache_misses += misses
+
+
+def _instrument_cache_class(cls):
+    if getattr(cls, '_perf_instrumented', False):
+        return
+    original_get, original_get_many = cls.get, cls.get_many
+
+    def get(self, key, default=None, version=None):
+        value = original_get(self, key, _MISSING, version)
+        if value is _MISSING:
+            _record_cache(0, 1)
+            return default
+        _record_cache(1, 0)
+        return value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        found = original_get_many(self, keys, version)
+        _record_cache(len(found), len(keys) - len(found))
+        return found
+
+    cls.get, cls.get_many = get, get_many
+    cls._perf_instrumented = True
+
+
+def _instrument_templates():
+    from django.template.backends.django import Template
+
+    if getattr(Template, '_perf_instrumented', False):
+        return
+    original_render = Template.render
+
+    def render(self, context=None, request=None):
+        timings = _current.get()
+        if timings is None:
+            return original_render(self, context, request)
+        # Only the outermost render counts; render_to_string inside a template nests
+        timings.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return original_render(self, context, request)
+        finally:
+            timings.template_depth -= 1
+            if not timings.template_depth:
+                timings.template_time += time.perf_counter() - start
+
+    Template.render = render
+    Template._perf_instrumented = True
+
+
+def _instrument_requests():
+    try:
+        import requests
+    except ImportError:
+        return
+    if getattr(requests.Session, '_perf_instrumented', False):
+        return
+    original_send = requests.Session.send
+
+    def send(self, request, **kwargs):
+        timings = _current.get()
+        if timings is None:
+            return original_send(self, request, **kwargs)
+        start = time.perf_counter()
+        try:
+            return original_send(self, request, **kwargs)
+        finally:
+            timings.http_time += time.perf_counter() - start
+            timings.http_count += 1
+
+    requests.Session.send = send
+    requests.Session._perf_instrumented = True
+
+
+def install_hooks():
+    from django.core.cache import caches
+
+    for alias in settings.CACHES:
+        _instrument_cache_class(type(caches[alias]))
+    _instrument_templates()
+    _instrument_requests()
+
+
+# --- Middleware -------------------------------------------------------------------
+
+class PerformanceMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.sample_rate = float(getattr(settings, 'PERF_SAMPLE_RATE', 0))
+        if self.sample_rate <= 0:
+            raise MiddlewareNotUsed()
+        self.server_timing = getattr(settings, 'PERF_SERVER_TIMING', settings.DEBUG)
+        self.get_response = get_response
+        install_hooks()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+        timings, token, start = self._start()
+        try:
+            with self._db_hooks():
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, timings, start)
+
+    async def __acall__(self, request):
+        if random.random() >= self.sample_rate:
+            return await self.get_response(request)
+        timings, token, start = self._start()
+        # Connections are per thread: the async ORM runs queries on the request's
+        # thread-sensitive worker thread, so the wrappers have to be added there
+        hooks = await sync_to_async(self._db_hooks)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(hooks.close)()
+            _current.reset(token)
+        return self._finish(request, response, timings, start)
+
+    def _start(self):
+        timings = Timings()
+        return timings, _current.set(timings), time.perf_counter()
+
+    def _db_hooks(self):
+        stack = ExitStack()
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(_db_wrapper))
+        return stack
+
+    def _finish(self, request, response, timings, start):
+        total = time.perf_counter() - start
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+
+        REQUEST_DURATION.observe(total, view=view, method=request.method, status=response.status_code)
+        DB_QUERIES.observe(timings.db_count, view=view)
+        DB_DURATION.observe(timings.db_time, view=view)
+        TEMPLATE_DURATION.observe(timings.template_time, view=view)
+        OUTBOUND_DURATION.observe(timings.http_time, view=view)
+        if timings.cache_hits:
+            CACHE_LOOKUPS.inc(timings.cache_hits, result='hit')
+        if timings.cache_misses:
+            CACHE_LOOKUPS.inc(timings.cache_misses, result='miss')
+
+        if self.server_timing:
+            response['Server-Timing'] = timings.server_timing(total)
+        return response
+
+
+class NPlusOneMiddleware:
+    """Development aid: report requests that repeat a query shape (see brt/nplusone.py).
+
+    Settings:
+        NPLUSONE_ENABLED    turn the middleware on (default False)
+        NPLUSONE_THRESHOLD  repeats of one query shape that count as N+1 (default 3)
+        NPLUSONE_RAISE      raise NPlusOneError instead of logging the report
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'NPLUSONE_ENABLED', False):
+            raise MiddlewareNotUsed()
+        from .nplusone import DEFAULT_THRESHOLD
+
+        self.threshold = getattr(settings, 'NPLUSONE_THRESHOLD', DEFAULT_THRESHOLD)
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        from .nplusone import QueryRecorder
+
+        recorder = QueryRecorder()
+        with recorder.hooks():
+            response = self.get_response(request)
+        self._report(request, recorder)
+        return response
+
+    async def __acall__(self, request):
+        from .nplusone import QueryRecorder
+
+        recorder = QueryRecorder()
+        hooks = await sync_to_async(recorder.hooks)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(hooks.close)()
+        self._report(request, recorder)
+        return response
+
+    def _report(self, request, recorder):
+        from .nplusone import NPlusOneError
+
+        report = recorder.report(self.threshold, label=f'{request.method} {request.path}')
+        if not report:
+            return
+        if getattr(settings, 'NPLUSONE_RAISE', False):
+            raise NPlusOneError(report)
+        logger.warning('n+1 queries detected', extra={
+            'method': request.method, 'path': request.path, 'queries': recorder.total, 'report': report,
+        })
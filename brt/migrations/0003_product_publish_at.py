@@ -0,0 +1,22 @@
+# Generated by Django 4.2.8 on 2026-10-19 08:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('brt', '0002_analytics_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='publish_at',
+            field=models.DateTimeField(blank=True, help_text='Release on the storefront and social media at this time', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_published', False), ('publish_at__isnull', False)), fields=['publish_at'], name='brt_product_release_queue'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.8 on 2026-10-19 09:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('brt', '0004_productimage_dimensions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboundJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(max_length=200)),
+                ('args', models.JSONField(blank=True, default=list)),
+                ('priority', models.PositiveSmallIntegerField(default=0)),
+                ('name', models.CharField(blank=True, max_length=200)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('claimed_until', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['priority', 'id'],
+                'indexes': [models.Index(fields=['priority', 'id'], name='brt_outbound_job_order')],
+            },
+        ),
+    ]
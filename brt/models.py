@@ -3,6 +3,16 @@ from django.core.validators import MaxValueValidator, MinValueValidator
 import uuid
 from decimal import Decimal
 
+class ProductQuerySet(models.QuerySet):
+    def visible(self):
+        """Products shown on the storefront: everything except scheduled drops not yet released."""
+        return self.exclude(is_published=False, publish_at__isnull=False)
+
+    def scheduled(self):
+        """Unreleased products with a publish_at, soonest first (see brt/releases.py)."""
+        return self.filter(is_published=False, publish_at__isnull=False).order_by('publish_at')
+
+
 class Product(models.Model):
     CATEGORY_CHOICES = [
         ('new', 'New Arrivals'),
@@ -25,20 +35,59 @@ class Product(models.Model):
     # Publishing status for admin manual publish control
     is_published = models.BooleanField(default=False)
     published_at = models.DateTimeField(null=True, blank=True)
+    # Scheduled drop: hidden from the storefront until the release_products
+    # command publishes it at this time
+    publish_at = models.DateTimeField(null=True, blank=True, help_text="Release on the storefront and social media at this time")
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # The release queue: only unreleased, scheduled products are indexed
+            models.Index(
+                fields=['publish_at'], name='brt_product_release_queue',
+                condition=models.Q(is_published=False, publish_at__isnull=False),
+            ),
+        ]
     
     def __str__(self):
         return self.name
     
+    def _prefetched(self, name):
+        """Return prefetched related objects for ``name`` (list), or None."""
+        cache = getattr(self, '_prefetched_objects_cache', {})
+        if name in cache:
+            return list(cache[name])
+        return None
+    
+    def _in_stock_sizes(self):
+        sizes = self._prefetched('sizes')
+        if sizes is None:
+            return None
+        return sorted((s for s in sizes if s.stock > 0), key=lambda s: s.price)
+    
+    # The helpers below use prefetch_related('sizes'/'images') results when
+    # available, so list pages (and async views) don't run a query per product.
+    
     def in_stock(self):
+        sizes = self._in_stock_sizes()
+        if sizes is not None:
+            return bool(sizes)
         return self.sizes.filter(stock__gt=0).exists()
     
     def min_price(self):
         """Get the lowest price from available sizes"""
+        sizes = self._in_stock_sizes()
+        if sizes is not None:
+            return sizes[0].price if sizes else self.base_price
         min_p = self.sizes.filter(stock__gt=0).order_by('price').first()
         return min_p.price if min_p else self.base_price
     
     def max_price(self):
         """Get the highest price from available sizes"""
+        sizes = self._in_stock_sizes()
+        if sizes is not None:
+            return sizes[-1].price if sizes else self.base_price
         max_p = self.sizes.filter(stock__gt=0).order_by('-price').first()
         return max_p.price if max_p else self.base_price
     
@@ -52,6 +101,9 @@ class Product(models.Model):
     
     def primary_image(self):
         """Get the primary image or first image"""
+        images = self._prefetched('images')
+        if images is not None:
+            return next((i for i in images if i.is_primary), images[0] if images else None)
         img = self.images.filter(is_primary=True).first()
         if not img:
             img = self.images.first()
@@ -80,6 +132,11 @@ class ProductImage(models.Model):
     image = models.ImageField(upload_to=product_image_path)
     is_primary = models.BooleanField(default=False)
     order = models.PositiveIntegerField(default=0)
+    # Recorded at upload (brt/uploads.py for direct uploads) so nothing has
+    # to fetch the file from storage to learn them
+    width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    file_size = models.PositiveBigIntegerField(null=True, blank=True, editable=False)
     
     class Meta:
         ordering = ['order', '-is_primary']
@@ -103,6 +160,12 @@ class ProductImage(models.Model):
             max_order = ProductImage.objects.filter(product=self.product).aggregate(models.Max('order'))['order__max']
             self.order = (max_order or 0) + 1
         
+        # A file uploaded through a form is still in memory (or a temp file): measure it now
+        if self.image and not self.image._committed:
+            from django.core.files.images import get_image_dimensions
+            self.width, self.height = get_image_dimensions(self.image)
+            self.file_size = self.image.size
+        
         super().save(*args, **kwargs)
         
         # If no primary image exists for this product, make this one primary
@@ -176,9 +239,21 @@ class Order(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # High-water mark scans in brt/rollups.py
+            models.Index(fields=['updated_at'], name='brt_order_updated_at_idx'),
+        ]
     
     def __str__(self):
         return f"Order {self.order_id}"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Remember the loaded status so post_save can detect transitions
+        # without re-reading the row
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
 
 
 class OrderItem(models.Model):
@@ -200,3 +275,86 @@ class OrderItem(models.Model):
     
     def __str__(self):
         return f"{self.product_name} ({self.size}) x{self.quantity}"
+
+
+class DailySalesRollup(models.Model):
+    """Per-day sales totals, maintained by the refresh_rollups command (see brt/rollups.py)."""
+    day = models.DateField(unique=True)
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        ordering = ['-day']
+    
+    def __str__(self):
+        return f"{self.day}: {self.orders} orders, ₱{self.revenue}"
+
+
+class DailyProductSalesRollup(models.Model):
+    """Units and revenue per product and size per day."""
+    day = models.DateField(db_index=True)
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, related_name='+')
+    product_name = models.CharField(max_length=255)
+    size = models.CharField(max_length=10)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        ordering = ['-day', 'product_name', 'size']
+    
+    def __str__(self):
+        return f"{self.day}: {self.product_name} ({self.size}) x{self.units}"
+
+
+class InventoryRollup(models.Model):
+    """Lifetime units sold against current stock for each ProductSize."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    size = models.CharField(max_length=10)
+    units_sold = models.PositiveIntegerField(default=0)
+    stock = models.IntegerField(default=0)
+    refreshed_at = models.DateTimeField()
+    
+    class Meta:
+        unique_together = ('product', 'size')
+        ordering = ['product', 'size']
+    
+    def __str__(self):
+        return f"{self.product_id} - {self.size}"
+    
+    def sell_through(self):
+        """Share of the available units that have sold, 0-100."""
+        available = self.units_sold + max(self.stock, 0)
+        if not available:
+            return Decimal('0.0')
+        return (Decimal(self.units_sold) * 100 / available).quantize(Decimal('0.1'))
+
+
+class RollupCheckpoint(models.Model):
+    """High-water mark on Order.updated_at for incremental rollup refreshes."""
+    name = models.CharField(max_length=50, unique=True)
+    high_water_mark = models.DateTimeField(null=True, blank=True)
+    refreshed_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return self.name
+
+
+class OutboundJob(models.Model):
+    """A queued Graph API posting job, run by brt/outbound.py."""
+    # Dotted path of the function to call, e.g. brt.signals.post_product_drop
+    task = models.CharField(max_length=200)
+    args = models.JSONField(default=list, blank=True)
+    priority = models.PositiveSmallIntegerField(default=0)
+    name = models.CharField(max_length=200, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Set while a worker runs the job; a worker that dies mid-job lets it lapse
+    claimed_until = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['priority', 'id']
+        indexes = [models.Index(fields=['priority', 'id'], name='brt_outbound_job_order')]
+
+    def __str__(self):
+        return self.name or self.task
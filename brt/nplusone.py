@@ -0,0 +1,153 @@
+"""Detect N+1 queries: the same query shape run over and over in one request.
+
+Every query is reduced to a fingerprint, its SQL with literals and parameter
+lists collapsed:
+
+    SELECT ... FROM "brt_productimage" WHERE "brt_productimage"."product_id" = ?
+
+A fingerprint seen ``threshold`` or more times is reported with the code
+line that ran it (the innermost frame in this project) and the template tag
+or variable that triggered it, if any.
+
+Tests::
+
+    with assert_no_nplusone():
+        self.client.get('/shop/')
+
+Development: add ``brt.middleware.NPlusOneMiddleware`` (enabled by
+NPLUSONE_ENABLED) to print a report for each offending request, or raise
+with NPLUSONE_RAISE.
+"""
+import os
+import re
+import sys
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import connections
+
+DEFAULT_THRESHOLD = 3
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_RE = re.compile(r'%s|\?')
+_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_SPACE_RE = re.compile(r'\s+')
+
+_THIS_FILE = os.path.abspath(__file__)
+
+
+class NPlusOneError(AssertionError):
+    pass
+
+
+def fingerprint(sql):
+    """Normalise ``sql`` so queries that differ only in their parameters compare equal."""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _PLACEHOLDER_RE.sub('?', sql)
+    sql = _LIST_RE.sub('(...)', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+def _project_root():
+    return os.path.abspath(str(settings.BASE_DIR)) + os.sep
+
+
+def _location():
+    """Return ``(code location, template location)`` for the query being executed."""
+    from django.template.base import Node, VariableNode
+
+    root = _project_root()
+    code = template = None
+    frame = sys._getframe(2)
+    while frame is not None and (code is None or template is None):
+        filename = frame.f_code.co_filename
+        if code is None and filename.startswith(root) and filename != _THIS_FILE and 'site-packages' not in filename:
+            code = f'{os.path.relpath(filename, root)}:{frame.f_lineno} in {frame.f_code.co_name}'
+        if template is None:
+            node = frame.f_locals.get('self')
+            # type() rather than isinstance(): the latter would evaluate lazy objects such as request.user
+            node_type = type(node)
+            if issubclass(node_type, Node) and getattr(node, 'token', None) is not None and node.origin:
+                contents = node.token.contents
+                kind = '{{ %s }}' % contents if issubclass(node_type, VariableNode) else '{%% %s %%}' % contents
+                name = node.origin.template_name or node.origin.name
+                template = f'{name}:{node.token.lineno} {kind}'
+        frame = frame.f_back
+    return code, template
+
+
+@dataclass
+class Detection:
+    fingerprint: str
+    count: int
+    example: str
+    locations: Counter = field(default_factory=Counter)
+
+    def __str__(self):
+        where = '\n'.join(f'    {n}x {location}' for location, n in self.locations.most_common(3))
+        return f'{self.count} similar queries: {self.example[:300]}\n{where}'
+
+
+class QueryRecorder:
+    """Record the fingerprint and origin of every query run while active."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.examples = {}
+        self.locations = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        key = fingerprint(sql)
+        self.counts[key] += 1
+        if key not in self.examples:
+            self.examples[key] = sql
+            self.locations[key] = Counter()
+        code, template = _location()
+        self.locations[key][' / '.join(filter(None, (template, code))) or 'unknown'] += 1
+        return execute(sql, params, many, context)
+
+    def hooks(self):
+        stack = ExitStack()
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(self))
+        return stack
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def detections(self, threshold=DEFAULT_THRESHOLD):
+        return [
+            Detection(key, count, self.examples[key], self.locations[key])
+            for key, count in self.counts.most_common() if count >= threshold
+        ]
+
+    def report(self, threshold=DEFAULT_THRESHOLD, label='request'):
+        detections = self.detections(threshold)
+        if not detections:
+            return ''
+        body = '\n'.join(str(d) for d in detections)
+        return f'N+1 queries in {label} ({self.total} queries total):\n{body}'
+
+
+@contextmanager
+def record_queries():
+    recorder = QueryRecorder()
+    with recorder.hooks():
+        yield recorder
+
+
+@contextmanager
+def assert_no_nplusone(threshold=DEFAULT_THRESHOLD, max_queries=None):
+    """Fail if any query shape repeats ``threshold`` times, or more than ``max_queries`` run."""
+    with record_queries() as recorder:
+        yield recorder
+    report = recorder.report(threshold, label='block')
+    if report:
+        raise NPlusOneError(report)
+    if max_queries is not None and recorder.total > max_queries:
+        raise NPlusOneError(f'{recorder.total} queries run, expected at most {max_queries}')
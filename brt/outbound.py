@@ -0,0 +1,330 @@
+"""Rate-limited scheduling of outbound Graph API traffic.
+
+Every Graph API call takes a token from the ``app`` bucket and from the
+bucket of the page or Instagram account it targets (``page:<id>``,
+``ig:<id>``). Buckets refill at GRAPH_RATE_PER_SECOND up to GRAPH_BURST
+tokens. A batch request costs one token per sub-request, because that is
+how Facebook counts it. Bucket state lives in the shared cache, so with
+REDIS_URL set the limits hold across all processes together.
+
+Rates follow the usage Facebook reports on each response:
+
+- ``X-App-Usage`` adjusts the ``app`` bucket.
+- ``X-Business-Use-Case-Usage`` and ``X-Page-Usage`` adjust the bucket of
+  the page or account.
+
+Below 50% usage a bucket runs at full rate. From 50% it slows linearly,
+down to a tenth of the rate near 100%. At 100%, or on a rate-limit error,
+it pauses: for ``estimated_time_to_regain_access`` when Facebook reports
+it, otherwise for GRAPH_THROTTLE_PAUSE seconds.
+
+Posting jobs (publishing one product) are saved as ``OutboundJob`` rows, in
+the same transaction as the change that queues them. A worker thread in
+the process that queued a job runs it after the commit. Jobs run one at a
+time per process, in priority order: new drops before re-posts, then first
+come first served. The worker waits on the buckets instead of firing calls
+that would be rejected, so a bulk publish runs at the highest rate the
+current limits allow.
+
+Jobs survive the process that queued them:
+
+- A worker claims a job for GRAPH_JOB_LEASE seconds. If its process dies
+  mid-job, the job runs again once the lease lapses.
+- A job is not retried when it fails. The posting functions log and skip
+  their own Graph API errors, and re-running a half-finished post would
+  duplicate what already went out. A job whose worker keeps dying is
+  dropped after MAX_ATTEMPTS runs.
+- A gunicorn worker that is shutting down finishes its current job and
+  leaves the rest queued.
+- Jobs left behind are run by the next worker that is woken: a new
+  submit, a gunicorn worker starting (gunicorn.conf.py), or the
+  ``release_products`` loop.
+
+Metrics: ``graph_queue_depth``, ``graph_usage_percent``,
+``graph_bucket_rate``, ``graph_throttle_wait_seconds`` and
+``graph_throttled``.
+"""
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .metrics import REGISTRY
+from .models import OutboundJob
+
+logger = logging.getLogger(__name__)
+
+NEW_DROP = 0
+REPOST = 10
+PRIORITY_NAMES = {NEW_DROP: 'new_drop', REPOST: 'repost'}
+
+# Graph error codes for rate limiting: app and user level limits pause the
+# app bucket, page/custom/business use case limits the target's bucket
+APP_RATE_LIMIT_CODES = {4, 17}
+RATE_LIMIT_ERROR_CODES = APP_RATE_LIMIT_CODES | {32, 613, 80001, 80002}
+SLOWDOWN_FROM = 50
+MIN_RATE_FACTOR = 0.1
+
+BUCKET_LOCK_WAIT = 1.0
+BUCKET_LOCK_TIMEOUT = 2
+BUCKET_STATE_TIMEOUT = 24 * 60 * 60
+# Runs of a job (counting ones whose worker died) before it is dropped
+MAX_ATTEMPTS = 3
+
+QUEUE_DEPTH = REGISTRY.gauge('graph_queue_depth', 'Posting jobs waiting to run', ['priority'])
+USAGE = REGISTRY.gauge('graph_usage_percent', 'Latest usage reported by the Graph API', ['scope'])
+BUCKET_RATE = REGISTRY.gauge('graph_bucket_rate', 'Current Graph API call rate per second', ['scope'])
+THROTTLE_WAIT = REGISTRY.histogram(
+    'graph_throttle_wait_seconds', 'Time Graph API calls waited for a token', ['scope'])
+THROTTLED = REGISTRY.counter('graph_throttled', 'Graph API rate-limit errors and usage-based pauses', ['scope'])
+
+
+class TokenBucket:
+    """A token bucket kept in the shared cache, so every process draws on the same tokens.
+
+    Updates are serialised by a short lock taken with ``cache.add``. Times
+    are wall-clock seconds, since the state is read by other processes.
+    """
+
+    def __init__(self, rate, capacity, scope='app'):
+        self.base_rate = float(rate)
+        self.capacity = float(capacity)
+        self.key = f'graph:bucket:{scope}'
+
+    @contextmanager
+    def _state(self):
+        lock = f'{self.key}:lock'
+        deadline = time.monotonic() + BUCKET_LOCK_WAIT
+        while not cache.add(lock, 1, BUCKET_LOCK_TIMEOUT):
+            if time.monotonic() > deadline:
+                break  # held by a process that died; its lock expires shortly anyway
+            time.sleep(0.005)
+        try:
+            now = time.time()
+            state = cache.get(self.key) or {
+                'tokens': self.capacity, 'updated': now, 'rate': self.base_rate, 'paused_until': 0.0,
+            }
+            if now > state['paused_until']:
+                since = max(state['updated'], state['paused_until'])
+                state['tokens'] = min(self.capacity, state['tokens'] + (now - since) * state['rate'])
+            state['updated'] = now
+            yield state, now
+            cache.set(self.key, state, BUCKET_STATE_TIMEOUT)
+        finally:
+            cache.delete(lock)
+
+    @property
+    def rate(self):
+        state = cache.get(self.key)
+        return state['rate'] if state else self.base_rate
+
+    def reserve(self, cost=1):
+        """Take ``cost`` tokens; return how long the caller must wait before using them."""
+        with self._state() as (state, now):
+            state['tokens'] -= min(cost, self.capacity)
+            wait = -state['tokens'] / state['rate'] if state['tokens'] < 0 else 0.0
+            return max(wait, state['paused_until'] - now)
+
+    def set_usage(self, percent):
+        factor = 1.0
+        if percent >= SLOWDOWN_FROM:
+            factor = max(MIN_RATE_FACTOR, (100 - percent) / (100 - SLOWDOWN_FROM))
+        with self._state() as (state, now):
+            state['rate'] = self.base_rate * factor
+
+    def pause(self, seconds):
+        with self._state() as (state, now):
+            state['paused_until'] = max(state['paused_until'], now + seconds)
+            state['tokens'] = min(state['tokens'], 0.0)
+
+
+def _usage_percent(header):
+    """Highest percentage in a usage header, and the seconds until access returns (or 0)."""
+    try:
+        data = json.loads(header)
+    except (TypeError, ValueError):
+        return None, 0
+    entries = []
+    if isinstance(data, dict) and any(isinstance(v, list) for v in data.values()):
+        # X-Business-Use-Case-Usage: {"<object id>": [{"type": ..., "call_count": ...}, ...]}
+        for value in data.values():
+            entries.extend(e for e in value if isinstance(e, dict))
+    elif isinstance(data, dict):
+        entries.append(data)
+    percent, regain = None, 0
+    for entry in entries:
+        for key in ('call_count', 'total_time', 'total_cputime', 'acc_id_util_pct'):
+            if isinstance(entry.get(key), (int, float)):
+                percent = max(percent or 0, entry[key])
+        regain = max(regain, (entry.get('estimated_time_to_regain_access') or 0) * 60)
+    return percent, regain
+
+
+class OutboundScheduler:
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._worker = None
+
+    # --- Rate limiting ---------------------------------------------------------
+
+    def bucket(self, scope):
+        with self._lock:
+            bucket = self._buckets.get(scope)
+            if bucket is None:
+                rate = getattr(settings, 'GRAPH_RATE_PER_SECOND', 2.0)
+                bucket = self._buckets[scope] = TokenBucket(rate, getattr(settings, 'GRAPH_BURST', 20), scope)
+                BUCKET_RATE.set(bucket.rate, scope=scope)
+            return bucket
+
+    def acquire(self, scope, cost=1):
+        """Block until a call to ``scope`` (costing ``cost`` calls) may be sent."""
+        waits = {name: self.bucket(name).reserve(cost) for name in ('app', scope)}
+        for name, wait in waits.items():
+            THROTTLE_WAIT.observe(wait, scope=name)
+        wait = max(waits.values())
+        if wait > 0:
+            time.sleep(wait)
+
+    def record_response(self, scope, response):
+        """Adapt the buckets to the usage headers on a Graph API response."""
+        headers = getattr(response, 'headers', None) or {}
+        for name, header in (('app', 'X-App-Usage'), (scope, 'X-Business-Use-Case-Usage'), (scope, 'X-Page-Usage')):
+            percent, regain = _usage_percent(headers.get(header))
+            if percent is None:
+                continue
+            bucket = self.bucket(name)
+            USAGE.set(percent, scope=name)
+            if percent >= 100 or regain:
+                self.throttled(name, regain)
+            else:
+                bucket.set_usage(percent)
+            BUCKET_RATE.set(bucket.rate, scope=name)
+
+    def record_error(self, scope, body):
+        """Pause ``scope`` if ``body`` is a Graph rate-limit error. Returns True if it was."""
+        error = body.get('error') if isinstance(body, dict) else None
+        if not isinstance(error, dict) or error.get('code') not in RATE_LIMIT_ERROR_CODES:
+            return False
+        self.throttled('app' if error.get('code') in APP_RATE_LIMIT_CODES else scope)
+        return True
+
+    def throttled(self, scope, seconds=None):
+        seconds = seconds or getattr(settings, 'GRAPH_THROTTLE_PAUSE', 60)
+        self.bucket(scope).pause(seconds)
+        THROTTLED.inc(scope=scope)
+        logger.warning('graph api throttled; pausing', extra={'scope': scope, 'pause_seconds': seconds})
+
+    # --- Job queue -------------------------------------------------------------
+
+    def submit(self, task, *args, priority=NEW_DROP, name=''):
+        """Queue ``task(*args)``; lower priorities run first.
+
+        ``task`` is the dotted path of a function and ``args`` must be JSON
+        serialisable. The job is saved in the caller's transaction and this
+        process's worker is woken once it commits.
+        """
+        job = OutboundJob.objects.create(task=task, args=list(args), priority=priority, name=name)
+        transaction.on_commit(self.wake)
+        self._update_depth()
+        return job
+
+    def depth(self):
+        return OutboundJob.objects.count()
+
+    def _update_depth(self):
+        counts = dict(OutboundJob.objects.order_by().values_list('priority').annotate(Count('pk')))
+        for priority, label in PRIORITY_NAMES.items():
+            QUEUE_DEPTH.set(counts.get(priority, 0), priority=label)
+
+    def wake(self):
+        """Make sure this process's worker thread is draining the queue."""
+        with self._lock:
+            self._wakeup.set()
+            if self._stopping or (self._worker is not None and self._worker.is_alive()):
+                return
+            self._worker = threading.Thread(target=self._run, name='graph-outbound', daemon=True)
+            self._worker.start()
+
+    def join(self, timeout=None):
+        """Wait for the worker thread to run out of jobs (for tests and management commands)."""
+        worker = self._worker
+        if worker is not None:
+            worker.join(timeout)
+
+    def stop(self, timeout=None):
+        """Finish the running job and stop; queued jobs stay saved for another worker."""
+        with self._lock:
+            self._stopping = True
+        self.join(timeout)
+
+    def _run(self):
+        from django.db import connections
+
+        try:
+            while True:
+                self._wakeup.clear()
+                self.run_pending()
+                with self._lock:
+                    # Checked under the lock so a job submitted as this
+                    # thread exits starts a new one instead of waiting
+                    if self._stopping or not self._wakeup.is_set():
+                        self._worker = None
+                        return
+        finally:
+            # The worker runs outside any request; don't keep its connections open
+            connections.close_all()
+
+    def run_pending(self):
+        """Run queued jobs in priority order until none are left; returns how many ran."""
+        ran = 0
+        while not self._stopping:
+            job = self._claim()
+            if job is None:
+                break
+            self._execute(job)
+            ran += 1
+        self._update_depth()
+        return ran
+
+    def _claim(self):
+        """Take the next job that no live worker holds, or None."""
+        lease = timedelta(seconds=getattr(settings, 'GRAPH_JOB_LEASE', 15 * 60))
+        while True:
+            now = timezone.now()
+            job = (OutboundJob.objects.filter(Q(claimed_until__isnull=True) | Q(claimed_until__lt=now))
+                   .order_by('priority', 'pk').first())
+            if job is None:
+                return None
+            # attempts doubles as a version: only one worker wins the update
+            claimed = OutboundJob.objects.filter(pk=job.pk, attempts=job.attempts).update(
+                attempts=F('attempts') + 1, claimed_until=now + lease)
+            if claimed:
+                job.attempts += 1
+                return job
+
+    def _execute(self, job):
+        if job.attempts > MAX_ATTEMPTS:
+            # Its earlier runs never finished (the worker died mid-job)
+            logger.error('giving up on posting job', extra={'job': job.name, 'attempts': job.attempts - 1})
+            job.delete()
+            return
+        try:
+            import_string(job.task)(*job.args)
+        except Exception:
+            logger.exception('posting job failed', extra={'job': job.name, 'attempt': job.attempts})
+        job.delete()
+
+
+scheduler = OutboundScheduler()
@@ -0,0 +1,103 @@
+"""Scheduled product releases.
+
+A product with ``publish_at`` set and ``is_published`` false is a scheduled
+drop. It is hidden from the storefront (``Product.objects.visible()``) and
+is not announced when its images are saved. The ``release_products``
+command runs ``run()``, which sleeps until the next ``publish_at``
+(re-checking at least every ``max_sleep`` seconds for newly scheduled
+drops). Then it:
+
+1. shortly before the release (``lead`` seconds), verifies the images of
+   the products due, so the image-check cache used by posting is warm;
+2. at the release time, publishes every due product with one UPDATE;
+3. in the same transaction, queues their social posts for the Graph API
+   worker (brt/outbound.py).
+
+Each pass of the loop also wakes the Graph API worker, so posts left
+queued by a web worker that was restarted are sent from this process.
+
+The storefront and the post queue therefore switch over together, however
+many products share a release time. The partial index
+``brt_product_release_queue`` keeps the "next due" query cheap however
+many products have already been released.
+"""
+import logging
+import time
+from functools import partial
+
+from django.db import transaction
+from django.utils import timezone
+
+from .catalogue import changed as catalogue_changed
+from .models import Product, ProductImage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEAD = 30
+DEFAULT_MAX_SLEEP = 60
+
+
+def next_release_at():
+    return Product.objects.scheduled().values_list('publish_at', flat=True).first()
+
+
+def warm(until):
+    """Verify the images of products due by ``until`` ahead of their release."""
+    from .signals import _build_full_image_url, verify_image_urls
+
+    due = Product.objects.scheduled().filter(publish_at__lte=until)
+    urls = []
+    for img in ProductImage.objects.filter(product__in=due):
+        url = _build_full_image_url(img.image)
+        if url and url.startswith('http'):
+            urls.append(url)
+    if urls:
+        verify_image_urls(urls)
+    return len(urls)
+
+
+def release_due(now=None):
+    """Publish every scheduled product whose ``publish_at`` has passed; returns their ids."""
+    from .outbound import NEW_DROP, scheduler
+
+    now = now or timezone.now()
+    with transaction.atomic():
+        due = Product.objects.scheduled().filter(publish_at__lte=now)
+        # Lock the rows so two release processes can't both publish (and post) a product
+        ids = list(due.select_for_update(skip_locked=True).values_list('pk', flat=True))
+        if not ids:
+            return []
+        Product.objects.filter(pk__in=ids).update(is_published=True, published_at=now)
+        transaction.on_commit(partial(catalogue_changed, *ids))
+        for pk in ids:
+            scheduler.submit('brt.signals.post_product_drop', pk, 'scheduled_release',
+                             priority=NEW_DROP, name=f'release product {pk}')
+    logger.info('released scheduled products', extra={'products': ids, 'count': len(ids)})
+    return ids
+
+
+def run(lead=DEFAULT_LEAD, max_sleep=DEFAULT_MAX_SLEEP, stdout=None):
+    """Release products as they fall due; runs until interrupted."""
+    from .outbound import scheduler
+
+    warmed_for = None
+    while True:
+        scheduler.wake()
+        due_at = next_release_at()
+        now = timezone.now()
+        if due_at is None:
+            time.sleep(max_sleep)
+            continue
+        wait = (due_at - now).total_seconds()
+        if wait > lead:
+            time.sleep(min(wait - lead, max_sleep))
+            continue
+        if wait > 0:
+            if warmed_for != due_at:
+                warm(due_at)
+                warmed_for = due_at
+            time.sleep(min(wait, max_sleep))
+            continue
+        ids = release_due()
+        if stdout is not None and ids:
+            stdout.write(f'{timezone.now():%Y-%m-%d %H:%M:%S} released {len(ids)} product(s): {ids}')
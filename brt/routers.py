@@ -0,0 +1,99 @@
+"""Route catalogue reads to the read replica, with read-your-writes pinning.
+
+When ``DATABASES['replica']`` is configured (DATABASE_REPLICA_URL), reads of
+Product, ProductSize and ProductImage made while serving a request go to the
+replica. Everything else, including every write, uses ``default``.
+
+A request that writes (admin edit, checkout) sets a short-lived cookie. For
+REPLICA_PIN_SECONDS afterwards that browser reads everything from the
+primary, so it never sees its own change missing because of replica lag.
+Work outside a request (management commands, background posting threads)
+always reads from the primary.
+"""
+import contextvars
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+REPLICA_ALIAS = 'replica'
+PIN_COOKIE = 'db_pin'
+CATALOGUE_MODELS = {('brt', 'product'), ('brt', 'productsize'), ('brt', 'productimage')}
+
+# Per-request routing state: {'pinned': bool, 'wrote': bool}. A mutable dict
+# so writes made inside sync_to_async threads are seen by the request.
+_state = contextvars.ContextVar('db_routing_state', default=None)
+
+
+class CatalogueReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state['pinned'] or state['wrote']:
+            return None
+        if (model._meta.app_label, model._meta.model_name) not in CATALOGUE_MODELS:
+            return None
+        if REPLICA_ALIAS not in settings.DATABASES:
+            return None
+        return REPLICA_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state['wrote'] = True
+        # Explicit, so an object read from the replica is saved to the primary
+        # (with no router answer Django would write to instance._state.db)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == REPLICA_ALIAS:
+            return False
+        return None
+
+
+class ReplicaPinningMiddleware:
+    """Track writes per request and pin the browser to the primary after one."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = self._start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            state = _state.get()
+            _state.reset(token)
+        return self._finish(response, state)
+
+    async def __acall__(self, request):
+        token = self._start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            state = _state.get()
+            _state.reset(token)
+        return self._finish(response, state)
+
+    def _start(self, request):
+        try:
+            pinned = float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            pinned = False
+        return _state.set({'pinned': pinned, 'wrote': False})
+
+    def _finish(self, response, state):
+        if state['wrote']:
+            seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+            response.set_cookie(PIN_COOKIE, str(int(time.time() + seconds)), max_age=seconds,
+                                httponly=True, samesite='Lax')
+        return response
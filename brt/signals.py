@@ -5,29 +5,39 @@ def get_appsecret_proof(access_token, app_secret):
 
 import os
 import json
-import traceback
+import logging
 import time
-import threading
 import requests
 import hmac
 import hashlib
-import json
 from django.conf import settings
 from django.core.cache import cache
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from .models import Product, ProductImage
+from .log import correlation, external_call, log_payload
+from .metrics import REGISTRY
+from .outbound import RATE_LIMIT_ERROR_CODES, scheduler
+from .models import Product, ProductImage, ProductSize, Order
 
-"""Signals: auto-post new products to Facebook and Instagram with debug logging.
+"""Signals: auto-post new products to Facebook and Instagram.
 
-This file verifies image URLs and logs full API responses to help debug failures.
+Every step is logged as structured JSON through brt/log.py. Each publish
+gets its own correlation id. Graph API and Cloudinary calls are timed, and
+response bodies are logged for errors and for a sample of successful calls.
 """
 
+logger = logging.getLogger(__name__)
 
-def _verify_image_url(image_url, timeout=5):
-    """Verify image URL is reachable and looks like an image.
 
-    Returns (ok: bool, info: dict).
+IMAGE_VERIFY_LOOKUPS = REGISTRY.counter(
+    'image_verify_lookups', 'Image URL verifications by cache outcome', ['result'])
+
+
+def _probe_image_url(image_url, timeout, validators):
+    """HEAD (falling back to a streamed GET) ``image_url``.
+
+    Returns (ok, info, response headers); ok is None when ``validators``
+    got a 304 Not Modified.
     """
     info = {
         'status_code': None,
@@ -37,33 +47,228 @@ def _verify_image_url(image_url, timeout=5):
         'error': None,
     }
     try:
-        head = requests.head(image_url, allow_redirects=True, timeout=timeout)
+        with external_call(logger, 'image_host', 'head', url=image_url) as call:
+            head = requests.head(image_url, allow_redirects=True, timeout=timeout, headers=validators)
+            call['status'] = head.status_code
+        if head.status_code == 304:
+            return None, info, head.headers
+        headers = head.headers
         info['status_code'] = head.status_code
         info['final_url'] = head.url
         info['content_type'] = head.headers.get('Content-Type')
         info['content_length'] = head.headers.get('Content-Length')
         if head.status_code >= 400 or not info['content_type']:
-            get = requests.get(image_url, stream=True, timeout=timeout)
+            with external_call(logger, 'image_host', 'get', url=image_url) as call:
+                get = requests.get(image_url, stream=True, timeout=timeout)
+                call['status'] = get.status_code
+            headers = get.headers
             info['status_code'] = get.status_code
             info['final_url'] = get.url
             info['content_type'] = get.headers.get('Content-Type')
             info['content_length'] = get.headers.get('Content-Length')
             get.close()
         ok = 200 <= int(info['status_code']) < 400 and (info['content_type'] or '').startswith('image')
-        return ok, info
+        return ok, info, headers
     except Exception as e:
         info['error'] = str(e)
-        return False, info
+        return False, info, {}
+
+
+def _verify_cache_key(image_url):
+    return 'image_verify:' + hashlib.sha256(image_url.encode('utf-8')).hexdigest()
+
+
+def _verify_image_url(image_url, timeout=5):
+    """Verify image URL is reachable and looks like an image.
+
+    Returns (ok: bool, info: dict). Results are kept in the shared cache:
+    successes for IMAGE_VERIFY_TTL seconds, after which they are revalidated
+    with If-None-Match / If-Modified-Since, failures for IMAGE_VERIFY_FAILURE_TTL.
+    """
+    key = _verify_cache_key(image_url)
+    cached = cache.get(key)
+    now = time.time()
+    if cached and now < cached['fresh_until']:
+        IMAGE_VERIFY_LOOKUPS.inc(result='hit')
+        return cached['ok'], cached['info']
+
+    validators = {}
+    if cached and cached['ok']:
+        if cached.get('etag'):
+            validators['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            validators['If-Modified-Since'] = cached['last_modified']
+
+    ttl = getattr(settings, 'IMAGE_VERIFY_TTL', 3600)
+    ok, info, headers = _probe_image_url(image_url, timeout, validators)
+    if ok is None:
+        IMAGE_VERIFY_LOOKUPS.inc(result='revalidated')
+        cached['fresh_until'] = now + ttl
+        cache.set(key, cached, ttl * 24)
+        return cached['ok'], cached['info']
+
+    IMAGE_VERIFY_LOOKUPS.inc(result='miss')
+    if ok:
+        # Kept well past its freshness so it can be revalidated cheaply
+        fresh_for, keep_for = ttl, ttl * 24
+    else:
+        fresh_for = keep_for = getattr(settings, 'IMAGE_VERIFY_FAILURE_TTL', 60)
+    cache.set(key, {
+        'ok': ok, 'info': info, 'fresh_until': now + fresh_for,
+        'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified'),
+    }, keep_for)
+    return ok, info
+
+
+def verify_image_urls(image_urls, timeout=5):
+    """Verify several image URLs concurrently; returns ``{url: (ok, info)}``."""
+    import contextvars
+    from concurrent.futures import ThreadPoolExecutor
+
+    urls = list(dict.fromkeys(image_urls))
+    if len(urls) <= 1:
+        return {url: _verify_image_url(url, timeout) for url in urls}
+    workers = min(len(urls), getattr(settings, 'IMAGE_VERIFY_CONCURRENCY', 8))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # copy_context() so the probes' log records keep the publish's correlation id
+        futures = {url: pool.submit(contextvars.copy_context().run, _verify_image_url, url, timeout) for url in urls}
+        return {url: future.result() for url, future in futures.items()}
+
+
+def _response_json(response):
+    try:
+        return response.json()
+    except Exception:
+        return {'error': 'invalid_json', 'text': response.text}
+
+
+def _graph_request(method, operation, url, scope, cost=1, timeout=10, **kwargs):
+    """Send a Graph API request once the rate limiter for ``scope`` allows it (brt/outbound.py)."""
+    scheduler.acquire(scope, cost)
+    with external_call(logger, 'graph_api', operation, scope=scope) as call:
+        response = requests.request(method, url, timeout=timeout, **kwargs)
+        call['status'] = response.status_code
+    scheduler.record_response(scope, response)
+    return response
+
+
+def _graph_post(operation, url, data, scope):
+    """POST to the Graph API; returns the decoded body and logs it (sampled on success)."""
+    response = _graph_request('POST', operation, url, scope, data=data)
+    result = _response_json(response)
+    scheduler.record_error(scope, result)
+    log_payload(logger, 'graph api response', result, error='error' in result,
+                operation=operation, status=response.status_code)
+    return result
+
+
+# Graph API batch requests: up to 50 calls per HTTP round trip. Sub-requests
+# failing with one of these error codes (unknown, service unavailable, rate
+# limits) or a 5xx, or that timed out (null reply), are retried on their own.
+GRAPH_BATCH_LIMIT = 50
+BATCH_MAX_ATTEMPTS = 3
+BATCH_RETRY_DELAY = 1.0
+TRANSIENT_ERROR_CODES = {1, 2, 341} | RATE_LIMIT_ERROR_CODES
+
+
+def _graph_base():
+    return getattr(settings, 'GRAPH_API_BASE_URL', 'https://graph.facebook.com').rstrip('/')
+
+
+def _is_transient(code, body):
+    if code is None or code >= 500:
+        return True
+    error = body.get('error') if isinstance(body, dict) else None
+    return isinstance(error, dict) and bool(error.get('is_transient') or error.get('code') in TRANSIENT_ERROR_CODES)
+
+
+def _decode_batch_body(body):
+    try:
+        return json.loads(body) if body else {}
+    except ValueError:
+        return {'error': 'invalid_json', 'text': body}
+
+
+def _graph_batch(operation, calls, access_token, appsecret_proof, scope):
+    """Send ``calls`` (``(method, relative_url, params)`` tuples) as Graph API batch requests.
+
+    Returns one decoded body per call, in the same order; failed calls get
+    a body with an ``error`` key. Only calls that failed transiently are
+    resent, up to BATCH_MAX_ATTEMPTS times in total.
+    """
+    from urllib.parse import urlencode
+
+    results = [None] * len(calls)
+    todo = list(range(len(calls)))
+    for attempt in range(1, BATCH_MAX_ATTEMPTS + 1):
+        retry = []
+        for start in range(0, len(todo), GRAPH_BATCH_LIMIT):
+            chunk = todo[start:start + GRAPH_BATCH_LIMIT]
+            batch = [
+                {'method': calls[i][0], 'relative_url': calls[i][1], 'body': urlencode(calls[i][2])}
+                for i in chunk
+            ]
+            data = {
+                'batch': json.dumps(batch),
+                'include_headers': 'false',
+                'access_token': access_token,
+                'appsecret_proof': appsecret_proof,
+            }
+            try:
+                # Facebook counts every sub-request of a batch against the limits
+                response = _graph_request('POST', f'batch:{operation}', _graph_base() + '/', scope,
+                                          cost=len(chunk), timeout=30, data=data)
+                replies = _response_json(response)
+                status = response.status_code
+            except Exception as e:
+                replies, status = {'error': {'message': str(e)}}, None
+
+            if not isinstance(replies, list):
+                # The whole batch was rejected (bad token, network error...)
+                scheduler.record_error(scope, replies)
+                for i in chunk:
+                    results[i] = replies
+                if _is_transient(status, replies):
+                    retry.extend(chunk)
+                continue
+            replies = replies + [None] * (len(chunk) - len(replies))
+            limited = False
+            for i, reply in zip(chunk, replies):
+                if reply is None:
+                    results[i] = {'error': {'message': 'no response (timed out)'}}
+                    retry.append(i)
+                    continue
+                body = _decode_batch_body(reply.get('body'))
+                results[i] = body
+                # One pause per batch, however many sub-requests were limited
+                limited = limited or scheduler.record_error(scope, body)
+                if (reply.get('code') or 0) >= 400 or 'error' in body:
+                    if _is_transient(reply.get('code'), body):
+                        retry.append(i)
+
+        if not retry or attempt == BATCH_MAX_ATTEMPTS:
+            break
+        logger.info('retrying failed batch sub-requests',
+                    extra={'operation': operation, 'failed': len(retry), 'attempt': attempt})
+        todo = retry
+        time.sleep(BATCH_RETRY_DELAY * attempt)
+
+    for i, body in enumerate(results):
+        if 'error' in body:
+            log_payload(logger, 'graph api batch sub-request failed', body, error=True,
+                        operation=operation, relative_url=calls[i][1])
+    return results
 
 
 # Log environment detection once at import so Render logs show what env vars are available
 try:
-    _site = os.environ.get('SITE_URL')
-    _render_host = os.environ.get('RENDER_EXTERNAL_HOSTNAME') or getattr(settings, 'RENDER_EXTERNAL_HOSTNAME', None)
-    _cloud_name = os.environ.get('CLOUDINARY_CLOUD_NAME')
-    _cloud_key = bool(os.environ.get('CLOUDINARY_API_KEY'))
-    _cloud_secret = bool(os.environ.get('CLOUDINARY_API_SECRET'))
-    print(f"[signals env] SITE_URL={_site!r}, RENDER_EXTERNAL_HOSTNAME={_render_host!r}, CLOUDINARY_CLOUD_NAME={_cloud_name!r}, CLOUD_KEY_SET={_cloud_key}, CLOUD_SECRET_SET={_cloud_secret}")
+    logger.info('signals environment', extra={
+        'site_url': os.environ.get('SITE_URL'),
+        'render_external_hostname': os.environ.get('RENDER_EXTERNAL_HOSTNAME') or getattr(settings, 'RENDER_EXTERNAL_HOSTNAME', None),
+        'cloudinary_cloud_name': os.environ.get('CLOUDINARY_CLOUD_NAME'),
+        'cloudinary_key_set': bool(os.environ.get('CLOUDINARY_API_KEY')),
+        'cloudinary_secret_set': bool(os.environ.get('CLOUDINARY_API_SECRET')),
+    })
 except Exception:
     pass
 
@@ -99,49 +304,76 @@ def _upload_image_to_cloudinary(image_field):
     try:
         import cloudinary.uploader
     except Exception as e:
-        print(f"[Cloudinary] cloudinary package not available: {e}")
+        logger.warning('cloudinary package not available', extra={'error': str(e)})
         return None
 
     try:
         path = getattr(image_field, 'path', None)
-        if path:
-            result = cloudinary.uploader.upload(path, folder="sidestep_products", resource_type="image")
-        else:
-            f = image_field.open('rb')
-            try:
-                result = cloudinary.uploader.upload(f, folder="sidestep_products", resource_type="image")
-            finally:
+        with external_call(logger, 'cloudinary', 'upload', name=image_field.name):
+            if path:
+                result = cloudinary.uploader.upload(path, folder="sidestep_products", resource_type="image")
+            else:
+                f = image_field.open('rb')
                 try:
-                    f.close()
-                except Exception:
-                    pass
+                    result = cloudinary.uploader.upload(f, folder="sidestep_products", resource_type="image")
+                finally:
+                    try:
+                        f.close()
+                    except Exception:
+                        pass
         secure = result.get('secure_url') if isinstance(result, dict) else None
-        print(f"[Cloudinary] upload result secure_url: {secure}")
+        logger.info('cloudinary upload finished', extra={'secure_url': secure})
         return secure
-    except Exception as e:
-        print(f"[Cloudinary] upload failed: {e}")
-        print(traceback.format_exc())
+    except Exception:
+        logger.exception('cloudinary upload failed')
         return None
 
 
+def _upload_resized_to_cloudinary(buf, folder, **options):
+    """Upload an in-memory image produced by an aspect-ratio fix; returns the secure URL or None."""
+    try:
+        import cloudinary.uploader
+        with external_call(logger, 'cloudinary', 'upload_resized', folder=folder):
+            result = cloudinary.uploader.upload(buf, folder=folder, resource_type="image", **options)
+    except Exception:
+        logger.exception('cloudinary upload of resized image failed', extra={'folder': folder})
+        return None
+    secure = result.get('secure_url') if isinstance(result, dict) else None
+    if not secure:
+        log_payload(logger, 'no secure_url in cloudinary upload result', result, error=True)
+    return secure
+
+
+def _fetch_image(image_url, timeout):
+    from PIL import Image
+    from io import BytesIO
+
+    with external_call(logger, 'image_host', 'download', url=image_url) as call:
+        img_resp = requests.get(image_url, timeout=timeout)
+        call['status'] = img_resp.status_code
+        call['bytes'] = len(img_resp.content)
+    img_resp.raise_for_status()
+    return Image.open(BytesIO(img_resp.content))
+
+
 def post_to_facebook_page(message, image_url=None):
     page_id = getattr(settings, 'FACEBOOK_PAGE_ID', None)
     access_token = getattr(settings, 'FACEBOOK_PAGE_ACCESS_TOKEN', None)
     app_secret = getattr(settings, 'FACEBOOK_APP_SECRET', None)
     if not page_id or not access_token or not app_secret:
-        print('FACEBOOK_PAGE_ID, FACEBOOK_PAGE_ACCESS_TOKEN, or FACEBOOK_APP_SECRET not set')
+        logger.warning('FACEBOOK_PAGE_ID, FACEBOOK_PAGE_ACCESS_TOKEN, or FACEBOOK_APP_SECRET not set')
         return
 
     appsecret_proof = get_appsecret_proof(access_token, app_secret)
 
     if image_url:
-        print(f"[Facebook] Using image_url: {image_url}")
         ok, info = _verify_image_url(image_url)
-        print('[Facebook] image verification:', info)
+        logger.info('facebook image verification', extra={'ok': ok, 'info': info})
         if not ok:
-            print('[Facebook] Image URL failed verification; aborting Facebook photo post')
+            logger.warning('facebook image failed verification; aborting photo post', extra={'url': image_url})
             return
-        url = f'https://graph.facebook.com/{page_id}/photos'
+        operation = 'photos'
+        url = f'{_graph_base()}/{page_id}/photos'
         data = {
             'caption': message,
             'url': image_url,
@@ -149,7 +381,8 @@ def post_to_facebook_page(message, image_url=None):
             'appsecret_proof': appsecret_proof
         }
     else:
-        url = f'https://graph.facebook.com/{page_id}/feed'
+        operation = 'feed'
+        url = f'{_graph_base()}/{page_id}/feed'
         data = {
             'message': message,
             'access_token': access_token,
@@ -157,21 +390,11 @@ def post_to_facebook_page(message, image_url=None):
         }
 
     try:
-        response = requests.post(url, data=data, timeout=10)
-        print('[Facebook] post HTTP status:', response.status_code)
-        try:
-            resp_json = response.json()
-        except Exception:
-            print('[Facebook] response text:', response.text)
-            resp_json = {'error': 'invalid_json', 'text': response.text}
-        print('[Facebook] post response json:', resp_json)
-        if 'error' in resp_json:
-            print('[Facebook] post error details:', resp_json.get('error'))
-        else:
-            print('[Facebook] post success:', resp_json)
-    except Exception as e:
-        print('[Facebook] Error posting:', e)
-        print(traceback.format_exc())
+        resp_json = _graph_post(operation, url, data, f'page:{page_id}')
+        if 'error' not in resp_json:
+            logger.info('facebook post created', extra={'post_id': resp_json.get('id')})
+    except Exception:
+        logger.exception('facebook post failed')
 
 
 def post_to_instagram(message, image_url=None):
@@ -179,35 +402,30 @@ def post_to_instagram(message, image_url=None):
     access_token = getattr(settings, 'FACEBOOK_PAGE_ACCESS_TOKEN', None)
     app_secret = getattr(settings, 'FACEBOOK_APP_SECRET', None)
     if not ig_account_id or not access_token or not app_secret:
-        print('INSTAGRAM_BUSINESS_ACCOUNT_ID, FACEBOOK_PAGE_ACCESS_TOKEN, or FACEBOOK_APP_SECRET not set')
+        logger.warning('INSTAGRAM_BUSINESS_ACCOUNT_ID, FACEBOOK_PAGE_ACCESS_TOKEN, or FACEBOOK_APP_SECRET not set')
         return
 
     appsecret_proof = get_appsecret_proof(access_token, app_secret)
     if not image_url:
-        print('Image URL required for Instagram post')
+        logger.warning('image URL required for Instagram post')
         return
 
-
-    print(f"[Instagram] Using image_url: {image_url}")
     ok, info = _verify_image_url(image_url)
-    print('[Instagram] image verification:', info)
+    logger.info('instagram image verification', extra={'ok': ok, 'info': info})
     if not ok:
-        print('[Instagram] Image URL failed verification; aborting Instagram post')
+        logger.warning('instagram image failed verification; aborting post', extra={'url': image_url})
         return
 
     # Validate aspect ratio for Instagram (must be between 0.8 and 1.91)
     try:
-        from PIL import Image
         from io import BytesIO
-        img_resp = requests.get(image_url, timeout=10)
-        img_resp.raise_for_status()
-        img = Image.open(BytesIO(img_resp.content))
+        img = _fetch_image(image_url, timeout=10)
         width, height = img.size
         aspect_ratio = width / height if height else 0
-        print(f"[Instagram] Image size: {width}x{height}, aspect ratio: {aspect_ratio:.2f}")
         # If aspect ratio is invalid, auto-resize and upload to Cloudinary
         if aspect_ratio < 0.8 or aspect_ratio > 1.91:
-            print(f"[Instagram] Image aspect ratio {aspect_ratio:.2f} is invalid. Auto-resizing...")
+            logger.info('instagram image has invalid aspect ratio; cropping',
+                        extra={'width': width, 'height': height, 'aspect_ratio': round(aspect_ratio, 2)})
             # Calculate new size to fit within 0.8–1.91
             min_ratio, max_ratio = 0.8, 1.91
             new_width, new_height = width, height
@@ -228,19 +446,15 @@ def post_to_instagram(message, image_url=None):
             img.save(buf, format='JPEG')
             buf.seek(0)
             # Upload to Cloudinary (requires cloudinary package and config)
-            try:
-                import cloudinary.uploader
-                upload_result = cloudinary.uploader.upload(buf, folder="instagram_resized", resource_type="image")
-                image_url = upload_result['secure_url']
-                print(f"[Instagram] Uploaded resized image to Cloudinary: {image_url}")
-            except Exception as e:
-                print(f"[Instagram] Cloudinary upload failed: {e}. Skipping post.")
+            image_url = _upload_resized_to_cloudinary(buf, 'instagram_resized')
+            if not image_url:
+                logger.warning('skipping instagram post: resized image could not be uploaded')
                 return
-    except Exception as e:
-        print(f"[Instagram] Could not validate or resize image aspect ratio: {e}. Skipping post.")
+    except Exception:
+        logger.exception('could not validate or resize image for instagram; skipping post', extra={'url': image_url})
         return
 
-    media_url = f'https://graph.facebook.com/v19.0/{ig_account_id}/media'
+    media_url = f'{_graph_base()}/v19.0/{ig_account_id}/media'
     media_data = {
         'image_url': image_url,
         'caption': message,
@@ -249,67 +463,50 @@ def post_to_instagram(message, image_url=None):
     }
 
     try:
-        media_resp = requests.post(media_url, data=media_data, timeout=10)
-        print('[Instagram] media HTTP status:', media_resp.status_code)
-        try:
-            media_result = media_resp.json()
-        except Exception:
-            print('[Instagram] media response text:', media_resp.text)
-            media_result = {'error': 'invalid_json', 'text': media_resp.text}
-        print('[Instagram] media response json:', media_result)
+        media_result = _graph_post('media', media_url, media_data, f'ig:{ig_account_id}')
         if 'error' in media_result:
-            print('[Instagram] media error details:', media_result.get('error'))
             return
 
         creation_id = media_result.get('id')
         if not creation_id:
-            print('[Instagram] Failed to get creation id from media response')
+            logger.warning('no creation id in instagram media response')
             return
 
         # Poll for status until media is ready
-        status_url = f'https://graph.facebook.com/v19.0/{creation_id}?fields=status_code&access_token={access_token}&appsecret_proof={appsecret_proof}'
+        status_url = f'{_graph_base()}/v19.0/{creation_id}?fields=status_code&access_token={access_token}&appsecret_proof={appsecret_proof}'
         max_attempts = 10
         for attempt in range(max_attempts):
             try:
-                status_resp = requests.get(status_url, timeout=10)
+                status_resp = _graph_request('GET', 'media_status', status_url, f'ig:{ig_account_id}')
                 status_json = status_resp.json()
                 status_code = status_json.get('status_code')
-                print(f'[Instagram] Media status attempt {attempt+1}: {status_code}')
                 if status_code == 'FINISHED':
                     break
                 elif status_code == 'ERROR':
-                    print(f'[Instagram] Media processing error: {status_json}')
+                    log_payload(logger, 'instagram media processing failed', status_json, error=True)
                     return
-            except Exception as e:
-                print(f'[Instagram] Error polling media status: {e}')
+            except Exception:
+                logger.exception('error polling instagram media status')
                 return
             time.sleep(2)
         else:
-            print('[Instagram] Media was not ready after polling. Skipping publish.')
+            logger.warning('instagram media not ready after polling; skipping publish',
+                           extra={'creation_id': creation_id, 'attempts': max_attempts})
             return
 
-        publish_url = f'https://graph.facebook.com/v19.0/{ig_account_id}/media_publish'
+        publish_url = f'{_graph_base()}/v19.0/{ig_account_id}/media_publish'
         publish_data = {
             'creation_id': creation_id,
             'access_token': access_token,
             'appsecret_proof': appsecret_proof
         }
-        publish_resp = requests.post(publish_url, data=publish_data, timeout=10)
-        print('[Instagram] publish HTTP status:', publish_resp.status_code)
-        try:
-            publish_result = publish_resp.json()
-        except Exception:
-            print('[Instagram] publish response text:', publish_resp.text)
-            publish_result = {'error': 'invalid_json', 'text': publish_resp.text}
-        print('[Instagram] publish response json:', publish_result)
+        publish_result = _graph_post('media_publish', publish_url, publish_data, f'ig:{ig_account_id}')
         if 'error' in publish_result:
-            print('[Instagram] publish error details:', publish_result.get('error'))
             return
-        print('[Instagram] successfully requested publish, response:', publish_result)
+        logger.info('instagram publish requested', extra={'media_id': publish_result.get('id')})
 
-    except Exception as e:
-        print('[Instagram] Error posting:', e)
-        print(traceback.format_exc())
+    except Exception:
+        logger.exception('instagram post failed')
 
 
 def post_multiple_to_facebook(message, image_urls):
@@ -318,45 +515,35 @@ def post_multiple_to_facebook(message, image_urls):
     access_token = getattr(settings, 'FACEBOOK_PAGE_ACCESS_TOKEN', None)
     app_secret = getattr(settings, 'FACEBOOK_APP_SECRET', None)
     if not page_id or not access_token or not app_secret:
-        print('FACEBOOK_PAGE_ID, FACEBOOK_PAGE_ACCESS_TOKEN, or FACEBOOK_APP_SECRET not set')
+        logger.warning('FACEBOOK_PAGE_ID, FACEBOOK_PAGE_ACCESS_TOKEN, or FACEBOOK_APP_SECRET not set')
         return
 
     appsecret_proof = get_appsecret_proof(access_token, app_secret)
-    uploaded_ids = []
+    verified = []
+    checks = verify_image_urls(image_urls)
     for img in image_urls:
-        try:
-            ok, info = _verify_image_url(img)
-            print('[Facebook multi] image verification:', info)
-            if not ok:
-                print(f'[Facebook multi] skipping image (failed verification): {img}')
-                continue
-            url = f'https://graph.facebook.com/{page_id}/photos'
-            data = {
-                'url': img,
-                'published': 'false',
-                'access_token': access_token,
-                'appsecret_proof': appsecret_proof,
-            }
-            resp = requests.post(url, data=data, timeout=10)
-            try:
-                rj = resp.json()
-            except Exception:
-                print('[Facebook multi] invalid json response:', resp.text)
-                continue
-            if 'id' in rj:
-                uploaded_ids.append(rj['id'])
-            else:
-                print('[Facebook multi] upload photo failed:', rj)
-        except Exception as e:
-            print('[Facebook multi] error uploading photo:', e)
-            print(traceback.format_exc())
+        ok, info = checks[img]
+        if ok:
+            verified.append(img)
+        else:
+            logger.warning('skipping facebook photo: failed verification', extra={'url': img, 'info': info})
+
+    # Upload every photo unpublished in one batch request
+    calls = [('POST', f'{page_id}/photos', {'url': img, 'published': 'false'}) for img in verified]
+    uploaded_ids = []
+    results = _graph_batch('photos_unpublished', calls, access_token, appsecret_proof, f'page:{page_id}')
+    for img, rj in zip(verified, results):
+        if 'id' in rj:
+            uploaded_ids.append(rj['id'])
+        else:
+            logger.warning('facebook photo upload failed', extra={'url': img})
 
     if not uploaded_ids:
-        print('[Facebook multi] no photos uploaded, aborting multi-photo post')
+        logger.warning('no facebook photos uploaded; aborting multi-photo post')
         return
 
     try:
-        feed_url = f'https://graph.facebook.com/{page_id}/feed'
+        feed_url = f'{_graph_base()}/{page_id}/feed'
         attached = [{'media_fbid': fid} for fid in uploaded_ids]
         data = {
             'message': message,
@@ -364,16 +551,11 @@ def post_multiple_to_facebook(message, image_urls):
             'access_token': access_token,
             'appsecret_proof': appsecret_proof,
         }
-        resp = requests.post(feed_url, data=data, timeout=10)
-        try:
-            rj = resp.json()
-        except Exception:
-            print('[Facebook multi] feed response invalid json:', resp.text)
-            return
-        print('[Facebook multi] feed response:', rj)
-    except Exception as e:
-        print('[Facebook multi] error creating feed post:', e)
-        print(traceback.format_exc())
+        rj = _graph_post('feed', feed_url, data, f'page:{page_id}')
+        if 'error' not in rj:
+            logger.info('facebook multi-photo post created', extra={'post_id': rj.get('id'), 'photos': len(uploaded_ids)})
+    except Exception:
+        logger.exception('error creating facebook feed post')
 
 
 def post_instagram_carousel(message, image_urls):
@@ -386,35 +568,31 @@ def post_instagram_carousel(message, image_urls):
     access_token = getattr(settings, 'FACEBOOK_PAGE_ACCESS_TOKEN', None)
     app_secret = getattr(settings, 'FACEBOOK_APP_SECRET', None)
     if not ig_account_id or not access_token or not app_secret:
-        print('INSTAGRAM_BUSINESS_ACCOUNT_ID, FACEBOOK_PAGE_ACCESS_TOKEN, or FACEBOOK_APP_SECRET not set')
+        logger.warning('INSTAGRAM_BUSINESS_ACCOUNT_ID, FACEBOOK_PAGE_ACCESS_TOKEN, or FACEBOOK_APP_SECRET not set')
         return
 
     appsecret_proof = get_appsecret_proof(access_token, app_secret)
-    child_ids = []
+    child_urls = []
+    checks = verify_image_urls(image_urls[:10])
     for img in image_urls[:10]:
         try:
-            ok, info = _verify_image_url(img)
-            print('[Instagram carousel] image verification:', info)
+            ok, info = checks[img]
             if not ok:
-                print(f'[Instagram carousel] skipping image (failed verification): {img}')
+                logger.warning('skipping carousel image: failed verification', extra={'url': img, 'info': info})
                 continue
             # Validate and auto-fix aspect ratio before creating child media
             try:
                 from PIL import Image as PILImage
                 from io import BytesIO
-                img_resp = requests.get(img, timeout=5)
-                img_resp.raise_for_status()
-                pil_img = PILImage.open(BytesIO(img_resp.content))
+                pil_img = _fetch_image(img, timeout=5)
                 width, height = pil_img.size
                 aspect_ratio = width / height if height else 0
-                print(f'[Instagram carousel] Image aspect ratio: {aspect_ratio:.2f} ({width}x{height})')
-                
+
                 # Instagram carousel requires 0.8 to 1.91 aspect ratio
                 if aspect_ratio < 0.8 or aspect_ratio > 1.91:
-                    print(f'[Instagram carousel] Auto-resizing image (aspect ratio {aspect_ratio:.2f}): {img}')
                     # Maximize width while fitting within 0.8–1.91
                     min_ratio, max_ratio = 0.8, 1.91
-                    
+
                     if aspect_ratio < min_ratio:
                         # Too tall - keep full width, crop height to 0.8 ratio
                         new_height = int(width / min_ratio)
@@ -425,10 +603,13 @@ def post_instagram_carousel(message, image_urls):
                         new_width = int(height * max_ratio)
                         left, top = max((width - new_width) // 2, 0), 0
                         right, bottom = left + new_width, height
-                    
-                    print(f'[Instagram carousel] Cropping from {width}x{height} to {right-left}x{bottom-top}')
+
+                    logger.info('cropping carousel image to a valid aspect ratio', extra={
+                        'url': img, 'aspect_ratio': round(aspect_ratio, 2),
+                        'from_size': f'{width}x{height}', 'to_size': f'{right - left}x{bottom - top}',
+                    })
                     pil_img = pil_img.crop((left, top, right, bottom))
-                    
+
                     # Scale up to Instagram's maximum size (1440px for best quality)
                     crop_width, crop_height = pil_img.size
                     # Only resize if smaller than 1440px to avoid quality loss
@@ -436,66 +617,43 @@ def post_instagram_carousel(message, image_urls):
                         target_width = 1440
                         target_height = int(target_width / (crop_width / crop_height))
                         pil_img = pil_img.resize((target_width, target_height), PILImage.LANCZOS)
-                        print(f'[Instagram carousel] Upscaled to {target_width}x{target_height} for maximum quality')
-                    
+
                     # Upload resized to Cloudinary as PNG for lossless quality
                     buf = BytesIO()
                     pil_img.save(buf, format='PNG', optimize=True)
                     buf.seek(0)
-                    try:
-                        import cloudinary.uploader
-                        print(f'[Instagram carousel] Uploading resized image to Cloudinary...')
-                        upload_result = cloudinary.uploader.upload(
-                            buf, 
-                            folder="instagram_carousel_resized", 
-                            resource_type="image",
-                            timeout=30
-                        )
-                        img = upload_result.get('secure_url')
-                        if not img:
-                            print(f'[Instagram carousel] No secure_url in upload result: {upload_result}, skipping image')
-                            continue
-                        print(f'[Instagram carousel] Uploaded resized image to Cloudinary: {img}')
-                    except Exception as e:
-                        print(f'[Instagram carousel] Cloudinary upload failed: {e}')
-                        print(f'[Instagram carousel] Traceback: {traceback.format_exc()}')
-                        print(f'[Instagram carousel] Skipping image')
+                    img = _upload_resized_to_cloudinary(buf, 'instagram_carousel_resized', timeout=30)
+                    if not img:
+                        logger.warning('skipping carousel image: resized image could not be uploaded')
                         continue
-            except Exception as e:
-                print(f'[Instagram carousel] Could not process image {img}: {e}')
-                continue
-            
-            media_url = f'https://graph.facebook.com/v19.0/{ig_account_id}/media'
-            data = {
-                'image_url': img,
-                'is_carousel_item': 'true',
-                'access_token': access_token,
-                'appsecret_proof': appsecret_proof,
-            }
-            print(f'[Instagram carousel] Creating child media for URL: {img}')
-            resp = requests.post(media_url, data=data, timeout=10)
-            try:
-                rj = resp.json()
             except Exception:
-                print('[Instagram carousel] invalid json response:', resp.text)
+                logger.exception('could not process carousel image', extra={'url': img})
                 continue
-            cid = rj.get('id')
-            if cid:
-                child_ids.append(cid)
-                print(f'[Instagram carousel] Child media created successfully: {cid}')
-            else:
-                print('[Instagram carousel] child media creation failed:', rj)
-        except Exception as e:
-            print('[Instagram carousel] error creating child media:', e)
-            print(traceback.format_exc())
+
+            child_urls.append(img)
+        except Exception:
+            logger.exception('error preparing carousel image', extra={'url': img})
+
+    # Create every child container in one batch request
+    calls = [
+        ('POST', f'v19.0/{ig_account_id}/media', {'image_url': img, 'is_carousel_item': 'true'})
+        for img in child_urls
+    ]
+    child_ids = []
+    results = _graph_batch('carousel_item', calls, access_token, appsecret_proof, f'ig:{ig_account_id}')
+    for img, rj in zip(child_urls, results):
+        if rj.get('id'):
+            child_ids.append(rj['id'])
+        else:
+            logger.warning('carousel child media creation failed', extra={'url': img})
 
     if len(child_ids) < 2:
-        print(f'[Instagram carousel] Only {len(child_ids)} valid child media (need at least 2), aborting carousel')
+        logger.warning('not enough carousel children (need at least 2); aborting carousel',
+                       extra={'children': len(child_ids)})
         return
 
     try:
-        print(f'[Instagram carousel] Creating parent container with {len(child_ids)} children: {child_ids}')
-        parent_url = f'https://graph.facebook.com/v19.0/{ig_account_id}/media'
+        parent_url = f'{_graph_base()}/v19.0/{ig_account_id}/media'
         data = {
             'media_type': 'CAROUSEL',
             'children': ','.join(child_ids),
@@ -503,140 +661,235 @@ def post_instagram_carousel(message, image_urls):
             'access_token': access_token,
             'appsecret_proof': appsecret_proof,
         }
-        print(f'[Instagram carousel] Parent container data: media_type=CAROUSEL, children={",".join(child_ids)}, caption length={len(message)}')
-        resp = requests.post(parent_url, data=data, timeout=10)
-        try:
-            rj = resp.json()
-        except Exception:
-            print('[Instagram carousel] parent media invalid json:', resp.text)
-            return
+        rj = _graph_post('carousel', parent_url, data, f'ig:{ig_account_id}')
         creation_id = rj.get('id')
         if not creation_id:
-            print('[Instagram carousel] failed to create parent container:', rj)
             return
 
-        publish_url = f'https://graph.facebook.com/v19.0/{ig_account_id}/media_publish'
+        publish_url = f'{_graph_base()}/v19.0/{ig_account_id}/media_publish'
         publish_data = {
             'creation_id': creation_id,
             'access_token': access_token,
             'appsecret_proof': appsecret_proof,
         }
-        pub_resp = requests.post(publish_url, data=publish_data, timeout=10)
-        try:
-            pub_rj = pub_resp.json()
-        except Exception:
-            print('[Instagram carousel] publish invalid json:', pub_resp.text)
-            return
-        print('[Instagram carousel] publish response:', pub_rj)
-    except Exception as e:
-        print('[Instagram carousel] error publishing carousel:', e)
-        print(traceback.format_exc())
+        pub_rj = _graph_post('media_publish', publish_url, publish_data, f'ig:{ig_account_id}')
+        if 'error' not in pub_rj:
+            logger.info('instagram carousel published', extra={'media_id': pub_rj.get('id'), 'children': len(child_ids)})
+    except Exception:
+        logger.exception('error publishing instagram carousel')
 
 @receiver(post_save, sender=ProductImage)
 def announce_product_image(sender, instance, created, **kwargs):
     """When a ProductImage is saved, post ALL product images as a carousel to FB and IG.
-    
-    This creates a single multi-image post instead of individual posts per image.
-    Uses cache-based deduplication to avoid multiple posts when saving multiple images.
+
+    Saves are coalesced per product (brt/debounce.py): one announcement is
+    made ANNOUNCE_QUIET_SECONDS after the last image of a batch is
+    committed, with the product's images as they are at that point.
     """
     try:
-        product = instance.product
         # Only act when the image file exists on the instance
         if not getattr(instance, 'image', None):
             return
-        
+
         # Skip if product is already published
-        if product.is_published:
-            print(f'[ProductImage signal] Skipping post for product {product.id} (already published)')
+        if instance.product.is_published:
+            logger.info('skipping post: product already published', extra={'product_id': instance.product_id})
             return
-        
-        # Deduplication: only post once per product within 60 seconds
-        cache_key = f'product_posted_{product.id}'
-        if cache.get(cache_key):
-            print(f'[ProductImage signal] Skipping post for product {product.id} (already posted recently)')
+        # Scheduled drops are announced by brt/releases.py at their release time
+        if instance.product.publish_at is not None:
+            logger.info('skipping post: product release is scheduled', extra={'product_id': instance.product_id})
             return
-        # Set cache lock for 60 seconds
-        cache.set(cache_key, True, 60)
-        
+
         from django.db import transaction
-        def do_post():
-            try:
-                product = instance.product
-                
-                # Collect ALL image URLs for this product
-                image_urls = []
-                for img in product.images.all().order_by('order'):
-                    if not getattr(img, 'image', None):
-                        continue
-                    img_url = _build_full_image_url(img.image)
-                    if not img_url:
-                        continue
-                    
-                    # If URL is relative or self-hosted, upload to Cloudinary
-                    site_url = os.environ.get('SITE_URL') or os.environ.get('RENDER_EXTERNAL_HOSTNAME') or getattr(settings, 'RENDER_EXTERNAL_HOSTNAME', None)
-                    normalized_site = None
-                    if site_url:
-                        if not site_url.startswith('http'):
-                            site_url = 'https://' + site_url
-                        normalized_site = site_url.rstrip('/')
-                    
-                    should_upload = False
-                    if img_url.startswith('/'):
-                        should_upload = True
-                    elif normalized_site and img_url.startswith(normalized_site):
-                        should_upload = True
-                    
-                    if should_upload:
-                        uploaded = _upload_image_to_cloudinary(img.image)
-                        if uploaded:
-                            img_url = uploaded
-                        else:
-                            print(f"[ProductImage signal] Unable to upload to Cloudinary for image: {img}")
-                            # Skip this image if upload failed and it's relative
-                            if img_url.startswith('/'):
-                                continue
-                    
-                    image_urls.append(img_url)
-                
-                if not image_urls:
-                    print(f"[ProductImage signal] No valid images to post for product {product.id}")
-                    return
-                
-                # Build sizes/stock/price string
-                size_lines = []
-                for size_obj in product.sizes.all():
-                    price = size_obj.price if size_obj.price != 0 else product.base_price
-                    size_str = f"{size_obj.size} ({size_obj.stock}) - ₱{price}"
-                    size_lines.append(size_str)
-                sizes_info = "\n".join(size_lines)
-                
-                message = (
-                    f"🚨 New Photos Just In! 🚨\n"
-                    f"Check out the {product.brand} {product.name}—now with more angles!\n\n"
-                    f"Sizes & Stock:\n{sizes_info}\n\n"
-                    f"See all the details: https://www.sidestep.studio/product/{product.id}/\n"
-                    f"Got questions or want to reserve? Slide into our DMs! #sidestep #sneakerupdate"
-                )
-                
-                print(f"[ProductImage signal] Posting {len(image_urls)} images as carousel for product {product.id}")
-                # Post as multi-image carousel
-                post_multiple_to_facebook(message, image_urls)
-                post_instagram_carousel(message, image_urls)
-                
-                # Mark product as published after successful posting
-                if not product.is_published:
-                    from django.utils import timezone
-                    product.is_published = True
-                    product.published_at = timezone.now()
-                    product.save(update_fields=['is_published', 'published_at'])
-                    print(f"[ProductImage signal] Marked product {product.id} as published")
-            except Exception as e:
-                print('[ProductImage signal] Error handling product image post:', e)
-                print(traceback.format_exc())
-        
-        # Run the external-posting work in a background thread so the DB
-        # transaction/worker isn't blocked by network calls (prevents timeouts).
-        transaction.on_commit(lambda: threading.Thread(target=do_post, daemon=True).start())
-    except Exception as e:
-        print('[ProductImage signal] Error in announce_product_image:', e)
-        print(traceback.format_exc())
+        from .debounce import debounce
+
+        product_id = instance.product_id
+        delay = getattr(settings, 'ANNOUNCE_QUIET_SECONDS', 10)
+        transaction.on_commit(lambda: debounce(f'announce_product:{product_id}', lambda: _announce(product_id), delay))
+    except Exception:
+        logger.exception('error in announce_product_image')
+
+
+def _announce(product_id):
+    """Queue the announcement on the rate-limited Graph API worker (brt/outbound.py)."""
+    from django.db import connections
+    from .outbound import NEW_DROP
+
+    try:
+        scheduler.submit('brt.signals._post_announcement', product_id, priority=NEW_DROP,
+                         name=f'announce product {product_id}')
+    finally:
+        # This runs on the debounce thread; don't leave its connection open
+        connections.close_all()
+
+
+def _post_announcement(product_id):
+    """Post a product's current images, unless it has been published meanwhile."""
+    with correlation(product_id=product_id, trigger='image_saved'):
+        product = Product.objects.filter(pk=product_id).first()
+        if product is None or product.is_published:
+            logger.info('skipping post: product deleted or already published')
+            return
+        if product.publish_at is not None:
+            logger.info('skipping post: product release is scheduled')
+            return
+        _post_product_images(product)
+
+
+def _collect_image_urls(product):
+    """Public URLs of a product's images, uploading self-hosted files to Cloudinary first."""
+    image_urls = []
+    for img in product.images.all().order_by('order'):
+        if not getattr(img, 'image', None):
+            continue
+        img_url = _build_full_image_url(img.image)
+        if not img_url:
+            continue
+
+        # If URL is relative or self-hosted, upload to Cloudinary
+        site_url = os.environ.get('SITE_URL') or os.environ.get('RENDER_EXTERNAL_HOSTNAME') or getattr(settings, 'RENDER_EXTERNAL_HOSTNAME', None)
+        normalized_site = None
+        if site_url:
+            if not site_url.startswith('http'):
+                site_url = 'https://' + site_url
+            normalized_site = site_url.rstrip('/')
+
+        should_upload = False
+        if img_url.startswith('/'):
+            should_upload = True
+        elif normalized_site and img_url.startswith(normalized_site):
+            should_upload = True
+
+        if should_upload:
+            uploaded = _upload_image_to_cloudinary(img.image)
+            if uploaded:
+                img_url = uploaded
+            else:
+                logger.warning('unable to upload image to cloudinary', extra={'image': img.image.name})
+                # Skip this image if upload failed and it's relative
+                if img_url.startswith('/'):
+                    continue
+
+        image_urls.append(img_url)
+    return image_urls
+
+
+def _post_product_images(product):
+    try:
+        image_urls = _collect_image_urls(product)
+        if not image_urls:
+            logger.warning('no valid images to post')
+            return
+
+        # Build sizes/stock/price string
+        size_lines = []
+        for size_obj in product.sizes.all():
+            price = size_obj.price if size_obj.price != 0 else product.base_price
+            size_str = f"{size_obj.size} ({size_obj.stock}) - ₱{price}"
+            size_lines.append(size_str)
+        sizes_info = "\n".join(size_lines)
+
+        message = (
+            f"🚨 New Photos Just In! 🚨\n"
+            f"Check out the {product.brand} {product.name}—now with more angles!\n\n"
+            f"Sizes & Stock:\n{sizes_info}\n\n"
+            f"See all the details: https://www.sidestep.studio/product/{product.id}/\n"
+            f"Got questions or want to reserve? Slide into our DMs! #sidestep #sneakerupdate"
+        )
+
+        logger.info('posting product images as carousel', extra={'images': len(image_urls)})
+        # Post as multi-image carousel
+        post_multiple_to_facebook(message, image_urls)
+        post_instagram_carousel(message, image_urls)
+
+        # Mark product as published after successful posting
+        if not product.is_published:
+            from django.utils import timezone
+            product.is_published = True
+            product.published_at = timezone.now()
+            product.save(update_fields=['is_published', 'published_at'])
+            logger.info('marked product as published')
+    except Exception:
+        logger.exception('error handling product image post')
+
+
+def post_product_drop(product_id, trigger='admin'):
+    """Post the "fresh drop" carousel for a product published from the admin."""
+    with correlation(product_id=product_id, trigger=trigger):
+        try:
+            product = Product.objects.filter(pk=product_id).first()
+            if product is None:
+                return
+            image_urls = _collect_image_urls(product)
+            if not image_urls:
+                logger.warning('no valid images to post')
+                return
+
+            # Build sizes/stock/price string
+            size_lines = []
+            for size_obj in product.sizes.all():
+                size_str = f"{size_obj.size} ({size_obj.stock}) - ₱{size_obj.price}"
+                size_lines.append(size_str)
+            sizes_info = "\n".join(size_lines)
+            message = (
+                f"🔥 Fresh Drop Alert! 🔥\n"
+                f"Step up your game with the new {product.brand} {product.name}!\n\n"
+                f"Sizes & Stock:\n{sizes_info}\n\n"
+                f"Tap the link to see more photos and details: https://www.sidestep.studio/product/{product.id}/\n"
+                f"DM us to reserve your pair or ask questions! #sidestep #sneakerhead #newdrop"
+            )
+            post_multiple_to_facebook(message, image_urls)
+            post_instagram_carousel(message, image_urls)
+        except Exception:
+            logger.exception('posting failed for published product')
+
+
+@receiver(post_save, sender=Order)
+def publish_order_status(sender, instance, created, **kwargs):
+    """Push Order.status transitions to the shared cache for the SSE streams."""
+    previous = getattr(instance, '_loaded_status', None)
+    if not created and previous == instance.status:
+        return
+    instance._loaded_status = instance.status
+
+    from django.db import transaction
+    from .events import publish_status_change
+
+    def do_publish():
+        try:
+            publish_status_change(instance, previous)
+        except Exception:
+            # Never fail the save because the cache is unavailable
+            logger.exception('error publishing order status change', extra={'order_id': instance.order_id})
+
+    transaction.on_commit(do_publish)
+
+
+@receiver(post_save, sender=ProductSize)
+@receiver(post_delete, sender=ProductSize)
+def bump_stock_version(sender, instance, **kwargs):
+    """Invalidate the product's cached availability (brt/availability.py) once the change commits."""
+    from functools import partial
+    from django.db import transaction
+    from .availability import bump
+    from .catalogue import changed
+
+    transaction.on_commit(partial(bump, instance.product_id))
+    transaction.on_commit(partial(changed, instance.product_id))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, instance, **kwargs):
+    """Refresh the product's cached availability and catalogue index entry once the change commits.
+
+    The availability payload (brt/availability.py) depends on the product
+    too: whether it is visible, and that it still exists.
+    """
+    from functools import partial
+    from django.db import transaction
+    from .availability import bump
+    from .catalogue import changed
+
+    transaction.on_commit(partial(bump, instance.pk))
+    transaction.on_commit(partial(changed, instance.pk))
@@ -0,0 +1,94 @@
+"""Static files storage that also shrinks images at collectstatic time.
+
+WhiteNoise already writes gzip (and Brotli, when the ``Brotli`` package is
+installed) copies of CSS/JS/SVG and serves hashed names with far-future
+``immutable`` headers. It leaves PNG/JPEG alone because they are already
+compressed, so this storage recompresses them losslessly as they are
+written:
+
+- PNG: re-encoded by Pillow with ``optimize=True``. The result is decoded and
+  compared pixel for pixel with the original and only kept if identical and
+  smaller.
+- JPEG: optimised with ``jpegtran`` (Huffman tables only, no re-quantisation)
+  when it is on PATH. Re-encoding through Pillow would be lossy, so JPEGs are
+  left untouched otherwise.
+"""
+import hashlib
+import io
+import shutil
+import subprocess
+
+from django.core.files.base import ContentFile
+from PIL import Image
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+PNG_EXTENSIONS = ('.png',)
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+
+
+def optimize_png(data):
+    """Return a smaller, pixel-identical PNG, or None if it can't be improved."""
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        params = {key: image.info[key] for key in ('transparency', 'icc_profile', 'dpi', 'gamma') if key in image.info}
+        out = io.BytesIO()
+        image.save(out, format='PNG', optimize=True, **params)
+        optimized = out.getvalue()
+        if len(optimized) >= len(data):
+            return None
+        with Image.open(io.BytesIO(optimized)) as check:
+            if check.mode != image.mode or check.tobytes() != image.tobytes():
+                return None
+    return optimized
+
+
+def optimize_jpeg(data):
+    """Return a smaller JPEG from jpegtran, or None if unavailable or no gain."""
+    jpegtran = shutil.which('jpegtran')
+    if not jpegtran:
+        return None
+    result = subprocess.run(
+        [jpegtran, '-copy', 'all', '-optimize'], input=data, capture_output=True, timeout=60,
+    )
+    if result.returncode != 0 or not result.stdout or len(result.stdout) >= len(data):
+        return None
+    return result.stdout
+
+
+def optimize_image(name, data):
+    lower = name.lower()
+    try:
+        if lower.endswith(PNG_EXTENSIONS):
+            return optimize_png(data)
+        if lower.endswith(JPEG_EXTENSIONS):
+            return optimize_jpeg(data)
+    except (OSError, ValueError, subprocess.SubprocessError):
+        # Corrupt or unusual file: ship it as collected
+        return None
+    return None
+
+
+class OptimizedStaticFilesStorage(CompressedManifestStaticFilesStorage):
+    """Recompress images as they are written to STATIC_ROOT.
+
+    Both the plain copy and the hashed copy go through ``_save``. The hash is
+    computed from the source file, so names stay stable between deploys, and
+    results are memoised by content so each image is only optimised once.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._optimized = {}
+
+    def _save(self, name, content):
+        if name.lower().endswith(PNG_EXTENSIONS + JPEG_EXTENSIONS):
+            content.seek(0)
+            data = content.read()
+            key = hashlib.sha256(data).digest()
+            if key not in self._optimized:
+                self._optimized[key] = optimize_image(name, data)
+            if self._optimized[key] is not None:
+                content = ContentFile(self._optimized[key])
+            else:
+                content.seek(0)
+        return super()._save(name, content)
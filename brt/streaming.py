@@ -0,0 +1,51 @@
+"""Helpers for streaming large querysets and CSV downloads without buffering them in memory."""
+import csv
+
+from django.db import connections
+from django.http import StreamingHttpResponse
+
+
+class Echo:
+    """File-like object whose write() hands the value back instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows, header=None):
+    """Yield each row of ``rows`` as an encoded CSV line."""
+    writer = csv.writer(Echo())
+    if header:
+        yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def streaming_csv_response(rows, filename, header=None):
+    response = StreamingHttpResponse(csv_lines(rows, header), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def iterate(queryset, chunk_size=2000):
+    """Iterate over ``queryset`` in constant memory.
+
+    Normally this is ``queryset.iterator()``, which streams through a
+    server-side cursor and prefetches related objects per chunk. Behind a
+    transaction-mode pooler server-side cursors are disabled
+    (DISABLE_SERVER_SIDE_CURSORS) and psycopg2 would buffer the whole result,
+    so page through by primary key instead. Rows then come back in pk order.
+    """
+    if not connections[queryset.db].settings_dict.get('DISABLE_SERVER_SIDE_CURSORS'):
+        yield from queryset.iterator(chunk_size=chunk_size)
+        return
+
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        page = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        page = list(page[:chunk_size])
+        if not page:
+            return
+        yield from page
+        last_pk = page[-1].pk
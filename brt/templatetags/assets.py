@@ -0,0 +1,92 @@
+"""Template tags for page bundles built by ``manage.py build_assets``.
+
+    {% load assets %}
+    {% page_styles 'shop' %}      critical CSS inline, the rest non-blocking
+    {% page_scripts 'shop' %}     deferred, minified bundle
+    {% preload_image product %}   preload hint for the product's primary image
+    {% product_slides product n %} a shop grid card's images (n: position on the page)
+
+Until the bundles are built, the tags emit the original files from
+``brt.assets.PAGES``, so development works without a build step.
+"""
+import json
+
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
+
+from brt import assets
+
+register = template.Library()
+
+# Cards in roughly the first two rows of the shop grid load their image
+# straight away; later ones wait until they are scrolled near
+EAGER_CARDS = 8
+
+
+def _stylesheet_link(href):
+    # rel=preload + onload swaps the stylesheet in without blocking first paint
+    return format_html(
+        '<link rel="preload" href="{0}" as="style" onload="this.onload=null;this.rel=\'stylesheet\'">'
+        '<noscript><link rel="stylesheet" href="{0}"></noscript>',
+        href,
+    )
+
+
+@register.simple_tag
+def page_styles(page):
+    entry = assets.load_manifest().get(page)
+    critical = assets.read_built(entry['critical']) if entry else None
+    if critical is None:
+        # Not built, or built before this page was added
+        return format_html_join(
+            '\n', '<link rel="stylesheet" href="{}">', ((static(name),) for name in assets.PAGES[page]['css'])
+        )
+    # The critical CSS is our own build output, not user input
+    parts = [format_html('<style>{}</style>', mark_safe(critical))]
+    parts += [_stylesheet_link(url) for url in entry['imports']]
+    parts.append(_stylesheet_link(static(entry['css'])))
+    return mark_safe('\n'.join(parts))
+
+
+@register.simple_tag
+def page_scripts(page):
+    entry = assets.load_manifest().get(page)
+    names = [entry['js']] if entry and entry.get('js') else assets.PAGES[page]['js']
+    return format_html_join('\n', '<script src="{}" defer></script>', ((static(name),) for name in names))
+
+
+@register.simple_tag
+def preload_image(product):
+    """Preload the image the browser will paint first (the LCP element)."""
+    image = product.primary_image() if product else None
+    if not image or not image.image:
+        return ''
+    return format_html('<link rel="preload" as="image" href="{}" fetchpriority="high">', image.image.url)
+
+
+def _image_attrs(image):
+    attrs = {'src': image.image.url}
+    if image.width and image.height:
+        attrs.update(width=image.width, height=image.height)
+    return attrs
+
+
+@register.simple_tag
+def product_slides(product, position=1):
+    """The primary image as an ``<img>``; the others as ``data-slides`` for shop.js to load on demand."""
+    images = list(product.images.all())
+    primary = product.primary_image()
+    if primary is None or not primary.image:
+        return format_html('<div class="slides"><img src="{}" class="sneaker_img product_img" alt=""></div>',
+                           static('images/placeholder.png'))
+    extra = [_image_attrs(image) for image in images if image.pk != primary.pk and image.image]
+    attrs = _image_attrs(primary)
+    size = format_html(' width="{}" height="{}"', attrs['width'], attrs['height']) if 'width' in attrs else ''
+    loading = '' if position <= EAGER_CARDS else mark_safe(' loading="lazy"')
+    return format_html(
+        '<div class="slides"{}><img src="{}"{}{} decoding="async" class="sneaker_img product_img" alt="{}"></div>',
+        format_html(' data-slides="{}"', json.dumps(extra)) if extra else '',
+        attrs['src'], size, loading, product.name,
+    )
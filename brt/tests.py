@@ -1,3 +1,1470 @@
-from django.test import TestCase
+import io
+import json
+import logging
+import os
+import tempfile
+from unittest import mock
+from decimal import Decimal
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from .inventory import import_inventory
+from .order_export import export_lines, filter_orders
+from .rollups import refresh_rollups
+from . import assets
+from .log import JsonFormatter, QueueHandler, correlation, log_payload
+from .metrics import Registry
+from .nplusone import NPlusOneError, assert_no_nplusone, fingerprint, record_queries
+from .middleware import REQUEST_DURATION
+from .storage import optimize_png
+from .routers import PIN_COOKIE, CatalogueReplicaRouter, ReplicaPinningMiddleware
+from .models import (
+    DailyProductSalesRollup, DailySalesRollup, InventoryRollup, Order, OrderItem, OutboundJob, Product, ProductImage,
+    ProductSize,
+)
+
+
+def make_product(index, sizes=3, images=2):
+    product = Product.objects.create(
+        name=f'Shoe {index}', description='Test shoe', brand=f'Brand {index % 4}', base_price=5000,
+    )
+    for n, (size, _) in enumerate(ProductSize.SIZE_CHOICES[:sizes]):
+        ProductSize.objects.create(product=product, size=size, price=5000 + n * 100, stock=n)
+    for n in range(images):
+        ProductImage.objects.create(product=product, image=f'products/test/shoe_{index}_{n}.png')
+    return product
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ProductAdminChangelistTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.user)
+
+    def changelist_query_count(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/admin/brt/product/')
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        for i in range(5):
+            make_product(i)
+        small = self.changelist_query_count()
+        for i in range(5, 100):
+            make_product(i)
+        self.assertEqual(self.changelist_query_count(), small)
+
+    def test_annotations_match_model_methods(self):
+        product = make_product(1, sizes=4, images=3)
+        annotated = self.client.get('/admin/brt/product/').context['cl'].result_list[0]
+        self.assertEqual(annotated._in_stock, product.in_stock())
+        self.assertEqual(annotated._min_price, product.min_price())
+        self.assertEqual(annotated._max_price, product.max_price())
+        self.assertEqual(annotated._total_stock, 0 + 1 + 2 + 3)
+        self.assertEqual(annotated._image_count, 3)
+
+    def test_annotated_columns_are_sortable(self):
+        make_product(1)
+        for column in range(1, 10):
+            response = self.client.get('/admin/brt/product/', {'o': column})
+            self.assertEqual(response.status_code, 200)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class InventoryImportExportTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Runner', description='x', brand='Nike', base_price=4200)
+        ProductSize.objects.create(product=self.product, size='US 9', price=5000, stock=1)
+
+    def test_import_upserts_and_reports_bad_rows(self):
+        csv_text = (
+            'product,size,price,stock\n'
+            f'{self.product.pk},US 9,5500,7\n'
+            f'{self.product.pk},US 10,0,3\n'
+            f'{self.product.pk},US 99,100,1\n'
+            '999999,US 9,100,1\n'
+            f'{self.product.pk},US 11,abc,1\n'
+        )
+        result = import_inventory(io.StringIO(csv_text), chunk_size=2)
+        self.assertEqual((result.rows, result.applied, result.error_count), (5, 2, 3))
+        self.assertEqual([line for line, _ in result.errors], [4, 5, 6])
+        sizes = {s.size: s for s in self.product.sizes.all()}
+        self.assertEqual((sizes['US 9'].price, sizes['US 9'].stock), (Decimal('5500'), 7))
+        # Price 0 falls back to base price, as in ProductSize.save()
+        self.assertEqual(sizes['US 10'].price, Decimal('4200'))
+
+    def test_export_round_trips_through_import(self):
+        out = io.StringIO()
+        call_command('export_inventory', stdout=out)
+        ProductSize.objects.update(stock=0)
+        result = import_inventory(io.StringIO(out.getvalue()))
+        self.assertEqual(result.error_count, 0)
+        self.assertEqual(self.product.sizes.get().stock, 1)
+
+    def test_admin_upload_and_streaming_export(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        upload = SimpleUploadedFile('inv.csv', f'product,size,stock\n{self.product.pk},US 9,12\n'.encode())
+        response = self.client.post('/admin/brt/product/inventory/import/', {'csv_file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.product.sizes.get().stock, 12)
+
+        response = self.client.get('/admin/brt/product/inventory/export/')
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'product,size,price,stock,product_name')
+        self.assertEqual(lines[1], f'{self.product.pk},US 9,5000.00,12,Runner')
+
+
+def make_order(index, status='paid', items=2):
+    order = Order.objects.create(
+        order_id=f'ORD-{index:08d}', customer_name='Juan', customer_email='juan@example.com',
+        customer_phone='0917', customer_address='Dipolog City', total_amount=1000 * items, status=status,
+    )
+    for n in range(items):
+        OrderItem.objects.create(order=order, product_name=f'Shoe {n}', size='US 9', price=1000, quantity=1)
+    return order
+
+
+class OrderEventTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def test_status_transitions_are_published_on_commit(self):
+        from django.core.cache import cache
+        from .events import SEQ_KEY
+
+        order = Order.objects.get(pk=make_order(1, status='pending').pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            order.status = 'paid'
+            order.save()
+        event = cache.get(f'order_status_{order.order_id}')
+        self.assertEqual((event['status'], event['previous_status']), ('paid', 'pending'))
+        self.assertEqual(cache.get(f"order_event_{event['seq']}"), event)
+
+        seq = cache.get(SEQ_KEY)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            order.customer_name = 'Maria'
+            order.save()
+        self.assertEqual(callbacks, [])
+        self.assertEqual(cache.get(SEQ_KEY), seq)
+
+    def test_order_stream_starts_with_the_current_status(self):
+        order = make_order(1, status='shipped')
+        self.assertEqual(self.client.get('/orders/ORD-99999999/events/').status_code, 404)
+
+        response = self.client.get(f'/orders/{order.order_id}/events/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        retry, frame = [chunk.decode() for chunk in response.streaming_content]
+        self.assertTrue(retry.startswith('retry: '))
+        self.assertIn('event: status', frame)
+        data = json.loads(frame.split('data: ', 1)[1])
+        self.assertEqual((data['order_id'], data['status']), (order.order_id, 'shipped'))
+
+    def test_feed_is_staff_only(self):
+        from .events import publish_status_change
+
+        self.assertEqual(self.client.get('/orders/events/').status_code, 403)
+        User.objects.create_user('shopper', password='pw')
+        self.client.login(username='shopper', password='pw')
+        self.assertEqual(self.client.get('/orders/events/').status_code, 403)
+
+        User.objects.create_user('staff', password='pw', is_staff=True)
+        self.client.login(username='staff', password='pw')
+        order = make_order(1)
+        seen = publish_status_change(order)
+        event = publish_status_change(order, previous_status='pending')
+        response = self.client.get('/orders/events/', HTTP_LAST_EVENT_ID=str(seen['seq']))
+        self.assertEqual(response.status_code, 200)
+        frames = b''.join(response.streaming_content).decode()
+        self.assertIn(f"id: {event['seq']}", frames)
+        self.assertNotIn(f"id: {seen['seq']}", frames)
+
+
+class OrderExportTests(TestCase):
+    def test_csv_has_one_row_per_item_in_constant_queries(self):
+        for i in range(3):
+            make_order(i)
+        make_order(3, items=0)
+        with self.assertNumQueries(2):
+            lines = list(export_lines(Order.objects.all(), 'csv', chunk_size=100))
+        self.assertEqual(len(lines), 1 + 3 * 2 + 1)
+
+    def test_keyset_pagination_when_server_side_cursors_are_disabled(self):
+        for i in range(5):
+            make_order(i)
+        with mock.patch.dict(connections['default'].settings_dict, {'DISABLE_SERVER_SIDE_CURSORS': True}):
+            # One page query plus one items prefetch per page of 2, and a final empty page
+            with self.assertNumQueries(3 * 2 + 1):
+                lines = list(export_lines(Order.objects.all(), 'jsonl', chunk_size=2))
+        self.assertEqual([json.loads(line)['order_id'] for line in lines], [f'ORD-{i:08d}' for i in range(5)])
+
+    def test_jsonl_nests_items_and_filters_by_status(self):
+        make_order(1, status='paid')
+        make_order(2, status='cancelled')
+        lines = list(export_lines(filter_orders(statuses=['paid']), 'jsonl'))
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(len(json.loads(lines[0])['items']), 2)
+
+    def test_admin_export_view_streams(self):
+        make_order(1)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.get('/admin/brt/order/export/', {'format': 'csv', 'status': ['paid']})
+        self.assertTrue(response.streaming)
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 3)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class RollupTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Runner', description='x', brand='Nike', base_price=1000)
+        ProductSize.objects.create(product=self.product, size='US 9', price=1000, stock=3)
+
+    def add_order(self, index, status='paid', quantity=1):
+        order = make_order(index, status=status, items=0)
+        OrderItem.objects.create(order=order, product=self.product, product_name='Runner', size='US 9',
+                                 price=1000, quantity=quantity)
+        return order
+
+    def test_incremental_refresh_picks_up_status_changes(self):
+        self.add_order(1, quantity=1)
+        pending = self.add_order(2, status='pending', quantity=2)
+        refresh_rollups()
+        day = DailySalesRollup.objects.get()
+        self.assertEqual((day.orders, day.units), (1, 1))
+
+        pending.status = 'paid'
+        pending.save()
+        refresh_rollups()
+        day = DailySalesRollup.objects.get()
+        self.assertEqual((day.orders, day.units), (2, 3))
+        self.assertEqual(DailyProductSalesRollup.objects.get().units, 3)
+        inventory = InventoryRollup.objects.get()
+        self.assertEqual((inventory.units_sold, inventory.stock), (3, 3))
+        self.assertEqual(str(inventory.sell_through()), '50.0')
+
+    def test_dashboard_reads_only_rollups(self):
+        self.add_order(1)
+        refresh_rollups()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/admin/brt/dailysalesrollup/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Runner')
+        for query in ctx.captured_queries:
+            self.assertNotIn('"brt_order"', query['sql'])
+            self.assertNotIn('"brt_orderitem"', query['sql'])
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class AsyncStorefrontViewTests(TestCase):
+    """Async views must render without the templates touching the ORM."""
+
+    def setUp(self):
+        self.product = make_product(1, sizes=4, images=2)
+        make_order(1)
+
+    async def test_shop(self):
+        response = await self.async_client.get('/shop/', {'sort': 'price_low', 'size': ['US 4.5']})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Shoe 1')
+        self.assertContains(response, '₱5100.00 - ₱5300.00')
+
+    async def test_shop_grid_sends_only_primary_images(self):
+        await ProductImage.objects.filter(product=self.product).aupdate(width=800, height=600)
+        response = await self.async_client.get('/shop/')
+        html = response.content.decode()
+        self.assertEqual(html.count('class="sneaker_img product_img"'), 1)
+        self.assertIn('shoe_1_0.png" width="800" height="600" decoding="async"', html)
+        self.assertIn('data-slides="[{&quot;src&quot;: &quot;/media/products/test/shoe_1_1.png&quot;, '
+                      '&quot;width&quot;: 800, &quot;height&quot;: 600}]"', html)
+
+    async def test_product_detail(self):
+        response = await self.async_client.get(f'/product/{self.product.pk}/')
+        self.assertContains(response, 'In Stock')
+        response = await self.async_client.get('/product/999999/')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_track_order(self):
+        response = await self.async_client.get('/track-order/', {'id': 'ORD-00000001'})
+        self.assertContains(response, 'Paid')
+        response = await self.async_client.get('/track-order/', {'id': 'nope'})
+        self.assertContains(response, 'Order not found')
+
+
+class ReplicaRouterTests(TestCase):
+    """No queries are sent to the (fake) replica; it exists only in settings."""
+
+    def setUp(self):
+        self.router = CatalogueReplicaRouter()
+        patcher = mock.patch.dict(settings.DATABASES, {'replica': dict(settings.DATABASES['default'])})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def route(self, cookies=None, view=None):
+        """Run ``view`` inside the pinning middleware; return (reads seen by view, response)."""
+        seen = {}
+
+        def get_response(request):
+            seen['before'] = self.router.db_for_read(Product)
+            seen['order'] = self.router.db_for_read(Order)
+            if view:
+                view()
+            seen['after'] = self.router.db_for_read(ProductSize)
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        request.COOKIES.update(cookies or {})
+        return seen, ReplicaPinningMiddleware(get_response)(request)
+
+    def test_catalogue_reads_use_replica_during_requests(self):
+        seen, response = self.route()
+        self.assertEqual((seen['before'], seen['order'], seen['after']), ('replica', None, 'replica'))
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        # Outside a request (commands, background threads) reads stay on the primary
+        self.assertIsNone(self.router.db_for_read(Product))
+
+    def test_write_pins_reads_to_primary(self):
+        seen, response = self.route(view=lambda: self.router.db_for_write(Product))
+        self.assertEqual((seen['before'], seen['after']), ('replica', None))
+        pin = response.cookies[PIN_COOKIE].value
+
+        seen, _ = self.route(cookies={PIN_COOKIE: pin})
+        self.assertIsNone(seen['before'])
+        seen, _ = self.route(cookies={PIN_COOKIE: '1'})  # expired pin
+        self.assertEqual(seen['before'], 'replica')
+
+    def test_objects_read_from_replica_are_saved_to_primary(self):
+        product = make_product(0)
+        replica_copy = Product.objects.get(pk=product.pk)
+        replica_copy._state.db = 'replica'  # as left by a read routed to the replica
+        replica_copy.name = 'Renamed'
+        self.route(view=lambda: replica_copy.save(update_fields=['name']))
+        self.assertEqual(Product.objects.using('default').get(pk=product.pk).name, 'Renamed')
+
+    def test_replica_never_migrated(self):
+        self.assertFalse(self.router.allow_migrate('replica', 'brt'))
+        self.assertIsNone(self.router.allow_migrate('default', 'brt'))
+
+
+class MediaServingTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        os.makedirs(os.path.join(tmp.name, 'products'))
+        with open(os.path.join(tmp.name, 'products', 'a.jpg'), 'wb') as f:
+            f.write(bytes(range(100)))
+        override = override_settings(MEDIA_ROOT=tmp.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_whole_file_with_cache_headers(self):
+        response = self.client.get('/media/products/a.jpg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), bytes(range(100)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('max-age=', response['Cache-Control'])
+
+        again = self.client.get('/media/products/a.jpg', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+    def test_byte_ranges(self):
+        response = self.client.get('/media/products/a.jpg', HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(self.body(response), bytes(range(10, 20)))
+
+        response = self.client.get('/media/products/a.jpg', HTTP_RANGE='bytes=-5')
+        self.assertEqual(self.body(response), bytes(range(95, 100)))
+        response = self.client.get('/media/products/a.jpg', HTTP_RANGE='bytes=90-')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(self.body(response), bytes(range(90, 100)))
+
+        response = self.client.get('/media/products/a.jpg', HTTP_RANGE='bytes=200-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_missing_and_outside_media_root(self):
+        self.assertEqual(self.client.get('/media/products/missing.jpg').status_code, 404)
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+
+
+class ImageOptimizationTests(TestCase):
+    def test_png_recompression_is_lossless(self):
+        from PIL import Image
+
+        image = Image.new('RGBA', (64, 64), (255, 0, 0, 128))
+        image.putpixel((3, 3), (0, 255, 0, 255))
+        raw = io.BytesIO()
+        image.save(raw, format='PNG', compress_level=0)
+
+        optimized = optimize_png(raw.getvalue())
+        self.assertLess(len(optimized), len(raw.getvalue()))
+        self.assertEqual(Image.open(io.BytesIO(optimized)).tobytes(), image.tobytes())
+        # Already optimal input is left alone
+        self.assertIsNone(optimize_png(optimized))
+
+
+class CriticalCssTests(TestCase):
+    CSS = """
+        @import url('https://fonts.example/css?family=X');
+        body { margin: 0 }
+        .hero  .title , .footer { color: red; }
+        .hero:hover { color: blue }
+        #about p { padding: 1px }
+        @media (max-width: 600px) { .hero { display: none } .footer { margin: 0 } }
+        @keyframes fade { from { opacity: 0 } to { opacity: 1 } }
+    """
+    TEMPLATE = """<body><section class="hero {% if x %}active{% endif %}"><h1 class="title">{{ t }}</h1></section>
+        {# fold #}<footer class="footer" id="about"><p>...</p></footer></body>"""
+
+    def test_only_above_the_fold_rules_are_critical(self):
+        blocks = assets.parse_css(assets.IMPORT_RE.sub('', self.CSS))
+        tokens = assets.above_the_fold_tokens(self.TEMPLATE)
+        self.assertEqual(tokens[0], {'hero', 'active', 'title'})
+
+        critical = assets.serialize(assets.critical_blocks(blocks, *tokens))
+        self.assertEqual(critical, 'body{margin:0}.hero .title{color:red}@media (max-width: 600px){.hero{display:none}}')
+        self.assertIn('@keyframes fade{from{opacity:0}to{opacity:1}}', assets.serialize(blocks))
+        self.assertEqual(assets.IMPORT_RE.findall(self.CSS), ['https://fonts.example/css?family=X'])
+        self.assertEqual(
+            assets.absolute_urls('a{background:url(../images/bg.png)}b{background:url("https://x/y.png")}', 'css/shop.css'),
+            'a{background:url("/static/images/bg.png")}b{background:url("https://x/y.png")}',
+        )
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_template_tags(self):
+        from django.template import Context, Template
+
+        product = make_product(1, sizes=1, images=1)
+        template = Template("{% load assets %}{% page_styles 'shop' %}{% page_scripts 'shop' %}{% preload_image p %}")
+
+        with mock.patch.object(assets, 'load_manifest', return_value={}):
+            html = template.render(Context({'p': product}))
+        self.assertIn('<link rel="stylesheet" href="/static/css/shop.css">', html)
+        self.assertIn('<script src="/static/js/shop.js" defer></script>', html)
+        self.assertIn(f'rel="preload" as="image" href="{product.primary_image().image.url}"', html)
+
+        built = {'shop': {'critical': 'dist/shop.critical.css', 'css': 'dist/shop.min.css',
+                          'js': 'dist/shop.min.js', 'imports': []}}
+        with mock.patch.object(assets, 'load_manifest', return_value=built), \
+                mock.patch.object(assets, 'read_built', return_value='.a{color:red}'):
+            html = template.render(Context({'p': None}))
+        self.assertIn('<style>.a{color:red}</style>', html)
+        self.assertIn('href="/static/dist/shop.min.css" as="style"', html)
+        self.assertIn('<script src="/static/dist/shop.min.js" defer></script>', html)
+        self.assertNotIn('as="image"', html)
+
+        # A manifest entry whose files are gone falls back to the unbuilt stylesheets
+        missing = {'shop': {**built['shop'], 'critical': 'dist/missing.critical.css'}}
+        with mock.patch.object(assets, 'load_manifest', return_value=missing):
+            html = template.render(Context({'p': None}))
+        self.assertIn('<link rel="stylesheet" href="/static/css/shop.css">', html)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class PerformanceMiddlewareTests(TestCase):
+    def setUp(self):
+        make_product(1, sizes=2, images=1)
+
+    @override_settings(PERF_SAMPLE_RATE=1, PERF_SERVER_TIMING=True)
+    def test_sampled_request_reports_server_timing_and_metrics(self):
+        before = REQUEST_DURATION.count(view='brt:shop', method='GET', status=200)
+        response = self.client.get('/shop/')
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="[1-9]\d* queries"')
+        self.assertRegex(timing, r'tpl;dur=[\d.]+')
+        self.assertIn('total;dur=', timing)
+        self.assertEqual(REQUEST_DURATION.count(view='brt:shop', method='GET', status=200), before + 1)
+
+    @override_settings(PERF_SAMPLE_RATE=1, PERF_SERVER_TIMING=True)
+    async def test_asgi_request_counts_queries(self):
+        response = await self.async_client.get('/shop/')
+        self.assertRegex(response['Server-Timing'], r'desc="[1-9]\d* queries"')
+
+    @override_settings(PERF_SAMPLE_RATE=1, PERF_SERVER_TIMING=True)
+    def test_counts_cache_lookups(self):
+        from django.core.cache import cache
+        from django.urls import path
+
+        def view(request):
+            cache.set('perf-hit', 1)
+            cache.get('perf-hit')
+            cache.get('perf-miss')
+            return HttpResponse()
+
+        urlconf = type('urls', (), {'urlpatterns': [path('cached/', view)]})
+        with override_settings(ROOT_URLCONF=urlconf):
+            response = self.client.get('/cached/')
+        self.assertIn('cache;desc="1 hits, 1 misses"', response['Server-Timing'])
+
+    def test_disabled_by_default(self):
+        self.assertNotIn('Server-Timing', self.client.get('/shop/'))
+
+    @override_settings(METRICS_TOKEN='s3cret', DEBUG=False)
+    def test_metrics_endpoint_requires_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE http_request_duration_seconds histogram', response.content.decode())
+
+    def test_registry_exposition(self):
+        registry = Registry()
+        latency = registry.histogram('latency_seconds', 'Latency', ['view'], buckets=(0.1, 1))
+        for value in (0.05, 0.5, 5):
+            latency.observe(value, view='shop')
+        registry.counter('hits', 'Hits').inc(3)
+        text = registry.render()
+        self.assertIn('latency_seconds_bucket{view="shop",le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{view="shop",le="+Inf"} 3', text)
+        self.assertIn('latency_seconds_count{view="shop"} 3', text)
+        self.assertIn('latency_seconds_window{view="shop",quantile="0.5"} 0.5', text)
+        self.assertIn('hits_total 3', text)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class NPlusOneTests(TestCase):
+    """Query-count guarantees for the storefront, checkout and admin changelists."""
+
+    def setUp(self):
+        self.products = [make_product(i, sizes=3, images=2) for i in range(5)]
+        for i in range(5):
+            make_order(i)
+
+    def test_fingerprint_ignores_literals(self):
+        self.assertEqual(
+            fingerprint('SELECT * FROM t WHERE id = 5 AND name = \'x\' AND pk IN (%s, %s, %s)'),
+            'SELECT * FROM t WHERE id = ? AND name = ? AND pk IN (...)',
+        )
+
+    def test_detects_loop_queries_with_template_location(self):
+        from django.template import Context, Template
+
+        template = Template('{% for p in products %}{{ p.primary_image }}{% endfor %}')
+        with self.assertRaises(NPlusOneError) as cm:
+            with assert_no_nplusone():
+                template.render(Context({'products': Product.objects.all()}))
+        self.assertIn('{{ p.primary_image }}', str(cm.exception))
+        self.assertIn('brt/models.py', str(cm.exception))
+
+    @override_settings(NPLUSONE_ENABLED=True, NPLUSONE_RAISE=True)
+    def test_middleware_flags_requests(self):
+        from django.urls import path
+
+        def view(request):
+            return HttpResponse(' '.join(str(p.min_price()) for p in Product.objects.all()))
+
+        urlconf = type('urls', (), {'urlpatterns': [path('slow/', view)]})
+        with override_settings(ROOT_URLCONF=urlconf), self.assertRaisesMessage(NPlusOneError, 'GET /slow/'):
+            self.client.get('/slow/')
+        self.assertEqual(self.client.get('/shop/').status_code, 200)
+
+        with override_settings(ROOT_URLCONF=urlconf, NPLUSONE_RAISE=False), \
+                self.assertLogs('brt.middleware', level='WARNING') as logs:
+            self.assertEqual(self.client.get('/slow/').status_code, 200)
+        record, = logs.records
+        self.assertEqual((record.getMessage(), record.path), ('n+1 queries detected', '/slow/'))
+        self.assertIn('GET /slow/', record.report)
+
+    def test_storefront(self):
+        # products, images, sizes, brand list, price range
+        with assert_no_nplusone(max_queries=5):
+            self.assertEqual(self.client.get('/shop/').status_code, 200)
+        with assert_no_nplusone(max_queries=3):
+            self.assertEqual(self.client.get(f'/product/{self.products[0].pk}/').status_code, 200)
+
+    def test_checkout(self):
+        data = {
+            'customer_name': 'Juan', 'customer_email': 'juan@example.com', 'customer_phone': '0917',
+            'customer_address': 'Dipolog City', 'payment_method': 'cod', 'total_amount': '5000',
+        }
+        with assert_no_nplusone(max_queries=6):
+            response = self.client.post('/checkout/', data)
+        self.assertEqual(response.status_code, 302)
+
+    def test_admin_changelists(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        for url in ('/admin/brt/product/', '/admin/brt/productimage/', '/admin/brt/order/',
+                    '/admin/brt/inventoryrollup/'):
+            with self.subTest(url=url), record_queries() as recorder:
+                self.assertEqual(self.client.get(url).status_code, 200)
+                self.assertEqual(recorder.report(), '')
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class BenchmarkCommandTests(TestCase):
+    def test_seed_catalogue(self):
+        call_command('seed_catalogue', products=4, orders=6, stdout=io.StringIO())
+        products = Product.objects.filter(description__startswith='Seeded')
+        self.assertEqual(products.count(), 4)
+        self.assertEqual(ProductSize.objects.filter(product__in=products).count(), 4 * len(ProductSize.SIZE_CHOICES))
+        for product in products.prefetch_related('images'):
+            self.assertTrue(1 <= len(product.images.all()) <= 5)
+        self.assertEqual(Order.objects.count(), 6)
+        self.assertTrue(OrderItem.objects.exists())
+
+        call_command('seed_catalogue', products=1, orders=0, clear=True, stdout=io.StringIO())
+        self.assertEqual(Product.objects.count(), 1)
+        self.assertEqual(Order.objects.count(), 0)
+
+    def test_run_benchmarks_writes_comparable_results(self):
+        call_command('seed_catalogue', products=3, orders=3, stdout=io.StringIO())
+        with tempfile.TemporaryDirectory() as tmp:
+            first = os.path.join(tmp, 'first.json')
+            call_command('run_benchmarks', iterations=3, output=first, stdout=io.StringIO())
+            with open(first) as f:
+                report = json.load(f)
+            out = io.StringIO()
+            call_command('run_benchmarks', iterations=3, scenario=['shop'], output=os.path.join(tmp, 'b.json'),
+                         compare=first, stdout=out)
+
+        scenarios = report['scenarios']
+        self.assertEqual(set(scenarios) - {'shop', 'shop_sort_price', 'shop_brand_filter', 'shop_size_filter',
+                                           'shop_price_range', 'shop_search', 'product_detail', 'track_order',
+                                           'checkout'}, set())
+        self.assertEqual(scenarios['shop']['errors'], 0)
+        self.assertEqual(scenarios['checkout']['errors'], 0)
+        self.assertLessEqual(scenarios['shop']['queries_max'], 5)
+        self.assertEqual(report['catalogue']['orders'], 3)  # checkout orders are cleaned up
+        self.assertIn('Compared with', out.getvalue())
+
+
+class StructuredLoggingTests(TestCase):
+    def test_queue_handler_writes_json_lines_with_correlation(self):
+        import threading
+
+        stream = io.StringIO()
+        handler = QueueHandler(stream)
+        handler.setFormatter(JsonFormatter())
+        logger = logging.getLogger('brt.tests.structured')
+        logger.addHandler(handler)
+        logger.propagate = False
+        try:
+            def publish():
+                with correlation(product_id=7) as correlation_id:
+                    logger.info('posting %d images', 3, extra={'service': 'graph_api'})
+                    try:
+                        1 / 0
+                    except ZeroDivisionError:
+                        logger.exception('failed')
+                results.append(correlation_id)
+
+            results = []
+            thread = threading.Thread(target=publish)
+            thread.start()
+            thread.join()
+            logger.info('outside')
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+
+        first, second, third = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(first['msg'], 'posting 3 images')
+        self.assertEqual(first['correlation_id'], results[0])
+        self.assertEqual((first['product_id'], first['service']), (7, 'graph_api'))
+        self.assertEqual(second['correlation_id'], results[0])
+        self.assertIn('ZeroDivisionError', second['exc'])
+        self.assertNotIn('correlation_id', third)
+
+    def test_forked_workers_start_their_own_listener(self):
+        # As with gunicorn's preload_app: the handler is created in the master
+        stream = tempfile.TemporaryFile('w+')
+        self.addCleanup(stream.close)
+        handler = QueueHandler(stream)
+        handler.setFormatter(JsonFormatter())
+        logger = logging.getLogger('brt.tests.forked')
+        logger.addHandler(handler)
+        logger.propagate = False
+        self.addCleanup(logger.removeHandler, handler)
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                logger.info('from worker')
+                handler.close()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        logger.info('from master')
+        handler.close()
+
+        stream.seek(0)
+        self.assertEqual([json.loads(line)['msg'] for line in stream], ['from worker', 'from master'])
+
+    @override_settings(LOG_PAYLOAD_SAMPLE_RATE=0, LOG_PAYLOAD_MAX_CHARS=50)
+    def test_payloads_are_sampled_but_errors_always_logged(self):
+        with self.assertLogs('brt.signals', level='INFO') as logs:
+            log_payload(logging.getLogger('brt.signals'), 'ok', {'id': '1'})
+            log_payload(logging.getLogger('brt.signals'), 'bad', {'error': 'x' * 200}, error=True)
+        ok, bad = logs.records
+        self.assertFalse(hasattr(ok, 'payload'))
+        self.assertEqual(bad.levelname, 'WARNING')
+        self.assertTrue(bad.payload.endswith('chars)'))
+
+    @override_settings(LOG_PAYLOAD_SAMPLE_RATE=1)
+    def test_graph_calls_are_timed(self):
+        from django.core.cache import cache
+        from .log import EXTERNAL_CALL_DURATION
+        from .signals import _graph_post
+
+        from .outbound import OutboundScheduler
+
+        cache.clear()  # fresh rate-limit buckets
+
+        response = mock.Mock(status_code=200, headers={}, **{'json.return_value': {'id': '42'}})
+        with mock.patch('brt.signals.requests.request', return_value=response), \
+                mock.patch('brt.signals.scheduler', OutboundScheduler()), \
+                self.assertLogs('brt.signals', level='INFO') as logs, correlation('abc123'):
+            self.assertEqual(_graph_post('feed', 'https://graph.invalid/feed', {}, 'page:1'), {'id': '42'})
+
+        call, body = logs.records
+        self.assertEqual((call.service, call.operation, call.status, call.outcome), ('graph_api', 'feed', 200, 'ok'))
+        self.assertGreaterEqual(call.duration_ms, 0)
+        self.assertEqual(json.loads(body.payload), {'id': '42'})
+        self.assertIn('operation="feed",outcome="ok"', '\n'.join(EXTERNAL_CALL_DURATION.render()))
+
+
+@override_settings(ANNOUNCE_QUIET_SECONDS=0.1)
+class AnnouncementDebounceTests(TestCase):
+    def wait(self, key):
+        from .debounce import pending
+
+        thread = pending(key)
+        if thread is not None:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+
+    def test_burst_of_events_fires_once(self):
+        from .debounce import debounce
+
+        calls = []
+        for _ in range(5):
+            debounce('test:burst', lambda: calls.append(1), 0.1)
+        self.wait('test:burst')
+        self.assertEqual(calls, [1])
+
+    def test_waits_for_the_worker_holding_the_claim(self):
+        import time
+        from django.core.cache import cache
+        from .debounce import _claim_key, debounce
+
+        calls = []
+        cache.add(_claim_key('test:claimed'), 'other-worker', 60)
+        debounce('test:claimed', lambda: calls.append(1), 0.05)
+        time.sleep(0.2)
+        self.assertEqual(calls, [])
+        cache.delete(_claim_key('test:claimed'))
+        self.wait('test:claimed')
+        self.assertEqual(calls, [1])
+
+    def test_image_saves_are_coalesced_per_product(self):
+        product = Product.objects.create(name='Burst', description='x', brand='B', base_price=1000)
+        with mock.patch('brt.signals._announce') as announce:
+            with self.captureOnCommitCallbacks(execute=True):
+                for n in range(5):
+                    ProductImage.objects.create(product=product, image=f'products/test/burst_{n}.png', order=n)
+            self.wait(f'announce_product:{product.pk}')
+        announce.assert_called_once_with(product.pk)
+
+    def test_announcing_closes_the_debounce_threads_connection(self):
+        from .signals import _announce
+
+        with mock.patch('brt.signals.scheduler.submit', side_effect=RuntimeError('db down')) as submit, \
+                mock.patch('django.db.connections.close_all') as close_all, self.assertRaises(RuntimeError):
+            _announce(7)
+        self.assertEqual(submit.call_args.args, ('brt.signals._post_announcement', 7))
+        close_all.assert_called_once()
+
+
+class GraphStub:
+    """A local HTTP server standing in for the Graph API; records each request."""
+
+    def __init__(self, fail_once=()):
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from urllib.parse import parse_qs
+
+        self.requests = []
+        self.fail_once = set(fail_once)
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers['Content-Length'])
+                form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+                stub.requests.append((self.path, form))
+                if self.path == '/':
+                    body = [stub.reply(sub_request) for sub_request in json.loads(form['batch'])]
+                else:
+                    body = {'id': f'{self.path.rsplit("/", 1)[-1]}-1'}
+                payload = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def reply(self, sub_request):
+        from urllib.parse import parse_qs
+
+        params = parse_qs(sub_request['body'])
+        url = (params.get('image_url') or params['url'])[0]
+        if url in self.fail_once:
+            self.fail_once.discard(url)
+            return {'code': 500, 'body': json.dumps({'error': {'message': 'Service unavailable', 'code': 2}})}
+        if url.endswith('bad.jpg'):
+            return {'code': 400, 'body': json.dumps({'error': {'message': 'Invalid image', 'code': 100}})}
+        return {'code': 200, 'body': json.dumps({'id': 'media-' + url.rsplit('/', 1)[-1]})}
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@override_settings(FACEBOOK_PAGE_ID='page', INSTAGRAM_BUSINESS_ACCOUNT_ID='ig', FACEBOOK_PAGE_ACCESS_TOKEN='token',
+                   FACEBOOK_APP_SECRET='secret', LOG_PAYLOAD_SAMPLE_RATE=0)
+class GraphBatchTests(TestCase):
+    def setUp(self):
+        from PIL import Image
+        from django.core.cache import cache
+        from .outbound import OutboundScheduler
+
+        cache.clear()  # fresh rate-limit buckets
+        patches = [
+            mock.patch('brt.signals._verify_image_url', return_value=(True, {})),
+            mock.patch('brt.signals._fetch_image', side_effect=lambda *a, **k: Image.new('RGB', (100, 100))),
+            mock.patch('brt.signals.BATCH_RETRY_DELAY', 0),
+            mock.patch('brt.signals.scheduler', OutboundScheduler()),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.images = [f'https://cdn.example.com/{n}.jpg' for n in range(10)]
+
+    def stub(self, **kwargs):
+        stub = GraphStub(**kwargs)
+        self.addCleanup(stub.close)
+        override = override_settings(GRAPH_API_BASE_URL=stub.url)
+        override.enable()
+        self.addCleanup(override.disable)
+        return stub
+
+    def test_carousel_children_are_created_in_one_batch(self):
+        from .signals import post_instagram_carousel
+
+        stub = self.stub()
+        with self.assertLogs('brt.signals', level='INFO'):
+            post_instagram_carousel('New drop', self.images)
+
+        self.assertEqual([path for path, _ in stub.requests], ['/', '/v19.0/ig/media', '/v19.0/ig/media_publish'])
+        batch = json.loads(stub.requests[0][1]['batch'])
+        self.assertEqual(len(batch), 10)
+        self.assertEqual(batch[0]['relative_url'], 'v19.0/ig/media')
+        self.assertEqual(stub.requests[0][1]['access_token'], 'token')
+        parent = stub.requests[1][1]
+        self.assertEqual(parent['children'], ','.join(f'media-{n}.jpg' for n in range(10)))
+        self.assertEqual(stub.requests[2][1]['creation_id'], 'media-1')
+
+    def test_only_transient_failures_are_retried(self):
+        from .signals import _graph_batch
+
+        stub = self.stub(fail_once={self.images[3], self.images[7]})
+        calls = [('POST', 'page/photos', {'url': url, 'published': 'false'}) for url in self.images[:9]]
+        calls.append(('POST', 'page/photos', {'url': 'https://cdn.example.com/bad.jpg', 'published': 'false'}))
+        with self.assertLogs('brt.signals', level='INFO'):
+            results = _graph_batch('photos_unpublished', calls, 'token', 'proof', 'page:page')
+
+        self.assertEqual(len(stub.requests), 2)
+        from urllib.parse import parse_qs
+
+        retried = [parse_qs(r['body'])['url'][0] for r in json.loads(stub.requests[1][1]['batch'])]
+        self.assertEqual(retried, [self.images[3], self.images[7]])
+        self.assertEqual([r.get('id') for r in results[:9]], [f'media-{n}.jpg' for n in range(9)])
+        self.assertEqual(results[9]['error']['code'], 100)
+
+    def test_facebook_multi_photo_post_takes_two_round_trips(self):
+        from .signals import post_multiple_to_facebook
+
+        stub = self.stub()
+        with self.assertLogs('brt.signals', level='INFO'):
+            post_multiple_to_facebook('New drop', self.images[:4])
+
+        self.assertEqual([path for path, _ in stub.requests], ['/', '/page/feed'])
+        attached = json.loads(stub.requests[1][1]['attached_media'])
+        self.assertEqual(attached, [{'media_fbid': f'media-{n}.jpg'} for n in range(4)])
+
+
+def record_job(label):
+    """A posting job for OutboundSchedulerTests."""
+    RAN_JOBS.append(label)
+    if label == 'fails':
+        raise RuntimeError('graph api down')
+
+
+RAN_JOBS = []
+
+
+class OutboundSchedulerTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        RAN_JOBS.clear()
+
+    def test_token_bucket_spaces_calls_beyond_the_burst(self):
+        from .outbound import TokenBucket
+
+        bucket = TokenBucket(rate=10, capacity=2, scope='test')
+        self.assertEqual([bucket.reserve(), bucket.reserve()], [0, 0])
+        self.assertAlmostEqual(bucket.reserve(), 0.1, places=2)
+        self.assertAlmostEqual(bucket.reserve(5), 0.3, places=2)  # a batch costs up to the whole burst
+
+    def test_usage_headers_adapt_the_rate(self):
+        from .outbound import USAGE, OutboundScheduler
+
+        scheduler = OutboundScheduler()
+        response = mock.Mock(headers={
+            'X-App-Usage': json.dumps({'call_count': 75, 'total_time': 10, 'total_cputime': 5}),
+            'X-Business-Use-Case-Usage': json.dumps({'17841': [
+                {'type': 'instagram', 'call_count': 100, 'estimated_time_to_regain_access': 2},
+            ]}),
+        })
+        with self.assertLogs('brt.outbound', level='WARNING'):
+            scheduler.record_response('ig:17841', response)
+
+        app = scheduler.bucket('app')
+        self.assertAlmostEqual(app.rate, app.base_rate / 2)
+        self.assertEqual(USAGE.value(scope='app'), 75)
+        self.assertGreater(scheduler.bucket('ig:17841').reserve(), 110)  # paused for ~2 minutes
+        self.assertEqual(scheduler.bucket('page:1').reserve(), 0)
+
+    def test_rate_limit_errors_pause_the_right_bucket(self):
+        from .outbound import OutboundScheduler
+
+        scheduler = OutboundScheduler()
+        with self.assertLogs('brt.outbound', level='WARNING'):
+            self.assertTrue(scheduler.record_error('page:1', {'error': {'code': 32, 'message': 'Page limit'}}))
+        self.assertFalse(scheduler.record_error('page:1', {'error': {'code': 100, 'message': 'Bad param'}}))
+        self.assertGreater(scheduler.bucket('page:1').reserve(), 0)
+        self.assertEqual(scheduler.bucket('app').reserve(), 0)
+
+    def test_buckets_are_shared_between_processes(self):
+        from .outbound import OutboundScheduler
+
+        with override_settings(GRAPH_BURST=2):
+            first, second = OutboundScheduler(), OutboundScheduler()
+            self.assertEqual([first.bucket('app').reserve(), first.bucket('app').reserve()], [0, 0])
+            self.assertGreater(second.bucket('app').reserve(), 0)
+
+    def test_new_drops_run_before_reposts(self):
+        from .outbound import NEW_DROP, QUEUE_DEPTH, REPOST, OutboundScheduler
+
+        scheduler = OutboundScheduler()
+        scheduler.submit('brt.tests.record_job', 'repost 1', priority=REPOST)
+        scheduler.submit('brt.tests.record_job', 'drop', priority=NEW_DROP)
+        scheduler.submit('brt.tests.record_job', 'repost 2', priority=REPOST)
+        self.assertEqual(QUEUE_DEPTH.value(priority='repost'), 2)
+        self.assertEqual(scheduler.run_pending(), 3)
+        self.assertEqual(RAN_JOBS, ['drop', 'repost 1', 'repost 2'])
+        self.assertFalse(OutboundJob.objects.exists())
+        self.assertEqual(QUEUE_DEPTH.value(priority='repost'), 0)
+
+    def test_jobs_outlive_their_worker(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .outbound import MAX_ATTEMPTS, OutboundScheduler
+
+        scheduler = OutboundScheduler()
+        # Claimed by a worker that died mid-job: runs again once the lease lapses
+        job = scheduler.submit('brt.tests.record_job', 'interrupted', name='interrupted')
+        OutboundJob.objects.filter(pk=job.pk).update(attempts=1, claimed_until=timezone.now() + timedelta(minutes=5))
+        self.assertEqual(scheduler.run_pending(), 0)
+        OutboundJob.objects.filter(pk=job.pk).update(claimed_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(scheduler.run_pending(), 1)
+        self.assertEqual(RAN_JOBS, ['interrupted'])
+
+        # One whose worker keeps dying is dropped
+        job = scheduler.submit('brt.tests.record_job', 'crashes', name='crashes')
+        OutboundJob.objects.filter(pk=job.pk).update(attempts=MAX_ATTEMPTS)
+        with self.assertLogs('brt.outbound', level='ERROR') as logs:
+            self.assertEqual(scheduler.run_pending(), 1)
+        self.assertEqual(logs.records[-1].getMessage(), 'giving up on posting job')
+
+        # A failing job is logged, not retried
+        scheduler.submit('brt.tests.record_job', 'fails', name='fails')
+        with self.assertLogs('brt.outbound', level='ERROR') as logs:
+            self.assertEqual(scheduler.run_pending(), 1)
+        self.assertEqual(RAN_JOBS, ['interrupted', 'fails'])
+        self.assertEqual(logs.records[-1].getMessage(), 'posting job failed')
+        self.assertFalse(OutboundJob.objects.exists())
+
+    def test_stopped_scheduler_leaves_jobs_queued(self):
+        from .outbound import OutboundScheduler
+
+        scheduler = OutboundScheduler()
+        scheduler.submit('brt.tests.record_job', 'later')
+        scheduler.stop(timeout=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            scheduler.submit('brt.tests.record_job', 'later still')
+        self.assertEqual(scheduler.run_pending(), 0)
+        self.assertEqual(OutboundJob.objects.count(), 2)
+
+    def test_publish_action_queues_reposts_behind_new_drops(self):
+        from .outbound import NEW_DROP, REPOST
+
+        User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+        new, old = make_product(1), make_product(2)
+        Product.objects.filter(pk=old.pk).update(is_published=True)
+        with mock.patch('brt.outbound.scheduler.submit') as submit:
+            self.client.post('/admin/brt/product/', {'action': 'publish_selected', '_selected_action': [new.pk, old.pk]})
+
+        priorities = {call.kwargs['name']: call.kwargs['priority'] for call in submit.call_args_list}
+        self.assertEqual(priorities, {f'publish product {new.pk}': NEW_DROP, f'publish product {old.pk}': REPOST})
+        self.assertEqual(Product.objects.filter(is_published=True).count(), 2)
+
+
+class ImageVerificationCacheTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def head_response(self, status=200, **headers):
+        return mock.Mock(status_code=status, url='https://res.cloudinary.com/x.jpg', headers={
+            'Content-Type': 'image/jpeg', 'Content-Length': '1024', **headers,
+        })
+
+    def test_results_are_cached_by_url(self):
+        from .signals import _verify_image_url
+
+        with mock.patch('brt.signals.requests.head', return_value=self.head_response()) as head, \
+                self.assertLogs('brt.signals', level='INFO'):
+            first = _verify_image_url('https://res.cloudinary.com/x.jpg')
+            second = _verify_image_url('https://res.cloudinary.com/x.jpg')
+        self.assertEqual(head.call_count, 1)
+        self.assertTrue(first[0])
+        self.assertEqual(first, second)
+
+    def test_stale_entries_are_revalidated_with_etag(self):
+        from django.core.cache import cache
+        from .signals import _verify_cache_key, _verify_image_url
+
+        url = 'https://res.cloudinary.com/x.jpg'
+        responses = [self.head_response(ETag='"v1"'), self.head_response(status=304)]
+        with self.assertLogs('brt.signals', level='INFO'), \
+                mock.patch('brt.signals.requests.head', side_effect=responses) as head, \
+                mock.patch('brt.signals.requests.get') as get:
+            _verify_image_url(url)
+            entry = cache.get(_verify_cache_key(url))
+            cache.set(_verify_cache_key(url), {**entry, 'fresh_until': 0})
+            ok, info = _verify_image_url(url)
+        self.assertTrue(ok)
+        self.assertEqual(info['content_type'], 'image/jpeg')
+        self.assertEqual(head.call_args_list[1].kwargs['headers'], {'If-None-Match': '"v1"'})
+        self.assertGreater(cache.get(_verify_cache_key(url))['fresh_until'], 0)
+        get.assert_not_called()
+
+    @override_settings(IMAGE_VERIFY_FAILURE_TTL=30)
+    def test_failures_are_cached_briefly(self):
+        import time
+        from django.core.cache import cache
+        from .signals import _verify_cache_key, _verify_image_url
+
+        url = 'https://cdn.example.com/missing.jpg'
+        with mock.patch('brt.signals.requests.head', side_effect=OSError('timeout')) as head, \
+                self.assertLogs('brt.signals', level='WARNING'):
+            self.assertFalse(_verify_image_url(url)[0])
+            self.assertFalse(_verify_image_url(url)[0])
+        self.assertEqual(head.call_count, 1)
+        self.assertLessEqual(cache.get(_verify_cache_key(url))['fresh_until'] - time.time(), 30)
+
+    def test_a_product_image_set_is_verified_concurrently_once_per_url(self):
+        from .signals import verify_image_urls
+
+        urls = [f'https://res.cloudinary.com/{n}.jpg' for n in range(4)]
+        with mock.patch('brt.signals.requests.head', return_value=self.head_response()) as head, \
+                self.assertLogs('brt.signals', level='INFO'):
+            results = verify_image_urls(urls + urls[:2])
+            verify_image_urls(urls)  # e.g. Instagram after Facebook
+        self.assertEqual(set(results), set(urls))
+        self.assertTrue(all(ok for ok, _ in results.values()))
+        self.assertEqual(head.call_count, 4)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ScheduledReleaseTests(TestCase):
+    def setUp(self):
+        from datetime import timedelta
+        from django.utils import timezone
+
+        self.now = timezone.now()
+        self.live = make_product(1, images=0)
+        self.due = make_product(2, images=0)
+        self.later = make_product(3, images=0)
+        Product.objects.filter(pk=self.due.pk).update(publish_at=self.now - timedelta(seconds=1))
+        Product.objects.filter(pk=self.later.pk).update(publish_at=self.now + timedelta(hours=1))
+        self.due.refresh_from_db()
+        self.later.refresh_from_db()
+
+    def test_scheduled_products_are_hidden_until_released(self):
+        ProductSize.objects.filter(product=self.later).update(price=99999)
+        self.assertEqual(set(Product.objects.visible()), {self.live})
+        self.assertEqual(list(Product.objects.scheduled()), [self.due, self.later])
+        response = self.client.get('/shop/')
+        self.assertContains(response, 'Shoe 1')
+        self.assertNotContains(response, 'Shoe 2')
+        self.assertEqual(response.context['price_range']['max_price'], Decimal('5200'))
+        self.assertEqual(self.client.get(f'/product/{self.later.pk}/').status_code, 404)
+
+    def test_release_publishes_due_products_and_queues_their_posts(self):
+        from .outbound import NEW_DROP
+        from .releases import next_release_at, release_due
+
+        with mock.patch('brt.outbound.scheduler.submit') as submit, \
+                self.captureOnCommitCallbacks(execute=True), self.assertLogs('brt.releases', level='INFO'):
+            self.assertEqual(release_due(self.now), [self.due.pk])
+        self.due.refresh_from_db()
+        self.assertTrue(self.due.is_published)
+        self.assertEqual(self.due.published_at, self.now)
+        submit.assert_called_once()
+        self.assertEqual(submit.call_args.kwargs['priority'], NEW_DROP)
+        self.assertEqual(submit.call_args.args, ('brt.signals.post_product_drop', self.due.pk, 'scheduled_release'))
+        self.assertEqual(next_release_at(), self.later.publish_at)
+        self.assertEqual(release_due(self.now), [])
+
+    def test_image_saves_do_not_announce_scheduled_products(self):
+        with mock.patch('brt.debounce.debounce') as debounce, \
+                self.captureOnCommitCallbacks(execute=True), self.assertLogs('brt.signals', level='INFO'):
+            ProductImage.objects.create(product=self.later, image='products/test/later.png')
+        debounce.assert_not_called()
+
+    def test_command_once(self):
+        out = io.StringIO()
+        with mock.patch('brt.outbound.scheduler.submit'), self.assertLogs('brt.releases', level='INFO'):
+            call_command('release_products', '--once', stdout=out)
+        self.assertIn('Released 1 product(s)', out.getvalue())
+
+
+class DirectUploadTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        override = override_settings(MEDIA_ROOT=tmp.name, DIRECT_UPLOAD_BACKEND='local')
+        override.enable()
+        self.addCleanup(override.disable)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.product = Product.objects.create(name='Air Max', description='x', brand='Nike', base_price=1000)
+
+    def png(self, size=(40, 30)):
+        from PIL import Image
+
+        out = io.BytesIO()
+        Image.new('RGB', size, (200, 0, 0)).save(out, format='PNG')
+        return out.getvalue()
+
+    def sign(self, data, product=None):
+        url = f'/admin/brt/product/{(product or self.product).pk}/images/sign/'
+        return self.client.post(url, json.dumps(data), content_type='application/json')
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_browser_uploads_straight_to_storage_then_registers(self):
+        self.assertContains(self.client.get(f'/admin/brt/product/{self.product.pk}/change/'), 'id="direct-upload"')
+        data = self.png()
+        signed = self.sign({'filename': 'side view.png', 'content_type': 'image/png', 'size': len(data)}).json()
+        self.assertTrue(signed['fields']['key'].startswith('products/nike/air_max/side view_'))
+
+        upload = SimpleUploadedFile('side view.png', data, content_type='image/png')
+        reply = self.client.post(signed['url'], {**signed['fields'], 'file': upload})
+        self.assertEqual(reply.status_code, 201)
+        response = self.client.post(f'/admin/brt/product/{self.product.pk}/images/register/',
+                                    json.dumps({'token': signed['token'], 'reply': reply.json()}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        image = ProductImage.objects.get(product=self.product)
+        self.assertEqual((image.width, image.height, image.file_size), (40, 30, len(data)))
+        self.assertTrue(os.path.exists(image.image.path))
+
+    def test_tampered_or_foreign_uploads_are_rejected(self):
+        data = self.png()
+        signed = self.sign({'filename': 'a.png', 'content_type': 'image/png', 'size': len(data)}).json()
+        fields = {**signed['fields'], 'key': 'products/elsewhere/a.png'}
+        upload = SimpleUploadedFile('a.png', data, content_type='image/png')
+        self.assertEqual(self.client.post(signed['url'], {**fields, 'file': upload}).status_code, 400)
+
+        other = Product.objects.create(name='Other', description='x', brand='B', base_price=1000)
+        response = self.client.post(f'/admin/brt/product/{other.pk}/images/register/',
+                                    json.dumps({'token': signed['token'], 'reply': {'key': fields['key']}}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.sign({'filename': 'a.gif', 'content_type': 'image/gif', 'size': 10}).status_code, 400)
+        self.assertFalse(ProductImage.objects.exists())
+
+    @override_settings(DIRECT_UPLOAD_BACKEND='cloudinary')
+    def test_cloudinary_reply_signature_is_checked(self):
+        import cloudinary.utils
+        from .uploads import UploadError, register, sign
+
+        signed = sign(self.product, 'a.jpg', 'image/jpeg', 1000)
+        public_id = signed['fields']['public_id']
+        self.assertTrue(public_id.startswith('media/products/nike/air_max/a_'))
+        params = {k: v for k, v in signed['fields'].items() if k not in ('api_key', 'signature')}
+        secret = settings.CLOUDINARY_STORAGE['API_SECRET']
+        self.assertEqual(signed['fields']['signature'], cloudinary.utils.api_sign_request(params, secret))
+
+        reply = {'public_id': public_id, 'version': 1700000000, 'width': 800, 'height': 600, 'bytes': 1000}
+        with self.assertRaises(UploadError):
+            register(self.product, signed['token'], {**reply, 'signature': 'forged'})
+        reply['signature'] = cloudinary.utils.api_sign_request({'public_id': public_id, 'version': 1700000000}, secret)
+        image = register(self.product, signed['token'], reply)
+        self.assertEqual((image.image.name, image.width, image.file_size), (public_id, 800, 1000))
+
+
+class MediaMigrationTests(TestCase):
+    def setUp(self):
+        from PIL import Image
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        self.checkpoint = os.path.join(tmp.name, 'checkpoint.json')
+        product = Product.objects.create(name='Move', description='x', brand='B', base_price=1000)
+        self.images = []
+        for n in range(3):
+            name = f'products/b/move/{n}.png'
+            if n < 2:
+                os.makedirs(os.path.join(self.root, 'products/b/move'), exist_ok=True)
+                Image.new('RGB', (10 + n, 20), (n, 0, 0)).save(os.path.join(self.root, name))
+            self.images.append(ProductImage.objects.create(product=product, image=name, order=n + 1))
+
+    def fake_upload(self, corrupt=()):
+        import hashlib
+
+        def upload(file, public_id, **options):
+            data = file.read()
+            etag = 'bad' if public_id in corrupt else hashlib.md5(data).hexdigest()
+            return {'public_id': public_id, 'etag': etag}
+        return mock.patch('cloudinary.uploader.upload', side_effect=upload)
+
+    def migrate(self, **kwargs):
+        from .media_migration import migrate
+
+        return migrate('cloudinary', checkpoint_path=self.checkpoint, local_root=self.root, checkpoint_every=1, **kwargs)
+
+    def names(self):
+        return [ProductImage.objects.get(pk=image.pk).image.name for image in self.images]
+
+    def test_copies_to_cloudinary_and_resumes_after_failures(self):
+        with self.fake_upload() as upload, self.assertLogs('brt.media_migration', level='WARNING'):
+            self.assertEqual(self.migrate(workers=2), (2, 1))
+        self.assertEqual(upload.call_count, 2)
+        self.assertEqual(self.names(), ['media/products/b/move/0', 'media/products/b/move/1', 'products/b/move/2.png'])
+        first = ProductImage.objects.get(pk=self.images[0].pk)
+        self.assertEqual((first.width, first.height), (10, 20))
+        self.assertIn(str(self.images[2].pk), json.load(open(self.checkpoint))['failed'])
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'products/b/move/0.png')))
+
+        # The missing file turns up; only it is transferred on the next run
+        from PIL import Image
+        Image.new('RGB', (5, 5)).save(os.path.join(self.root, 'products/b/move/2.png'))
+        with self.fake_upload() as upload:
+            self.assertEqual(self.migrate(), (1, 0))
+        self.assertEqual(upload.call_count, 1)
+        self.assertEqual(self.names()[2], 'media/products/b/move/2')
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_checksum_mismatch_keeps_the_original(self):
+        with self.fake_upload(corrupt={'media/products/b/move/1'}), \
+                self.assertLogs('brt.media_migration', level='WARNING'):
+            self.assertEqual(self.migrate(move=True), (1, 2))
+        self.assertIn('checksum mismatch', json.load(open(self.checkpoint))['failed'][str(self.images[1].pk)])
+        self.assertEqual(self.names()[1], 'products/b/move/1.png')
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'products/b/move/0.png')))
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'products/b/move/1.png')))
+
+    def test_backfills_images_already_on_the_target(self):
+        out = io.StringIO()
+        with self.assertLogs('brt.media_migration', level='WARNING'):
+            call_command('migrate_media', '--to', 'local', '--move', '--local-root', self.root,
+                         '--checkpoint', self.checkpoint, stdout=out)
+        self.assertIn('Updated 2 image(s)', out.getvalue())
+        self.assertEqual(ProductImage.objects.get(pk=self.images[1].pk).width, 11)
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'products/b/move/1.png')))
+
+
+class ProductAvailabilityTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.product = make_product(1, sizes=3, images=0)
+        self.url = f'/product/{self.product.pk}/availability/'
+
+    def test_json_is_versioned_and_revalidated_without_queries(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([s['stock'] for s in data['sizes']], [0, 1, 2])
+        self.assertEqual(data['price_range'], '₱5100.00 - ₱5200.00')
+        self.assertIn('public', response['Cache-Control'])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).json(), data)
+            again = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+        size = ProductSize.objects.get(product=self.product, size='US 4')
+        size.stock = 7
+        with self.captureOnCommitCallbacks(execute=True):
+            size.save()
+        fresh = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(fresh.status_code, 200)
+        self.assertNotEqual(fresh['ETag'], response['ETag'])
+        self.assertEqual(fresh.json()['sizes'][0]['stock'], 7)
+
+    def test_inventory_import_bumps_the_version(self):
+        first = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            import_inventory(io.StringIO(f'product,size,stock\n{self.product.pk},US 4,3\n'))
+        self.assertNotEqual(self.client.get(self.url)['ETag'], first)
+
+    def test_per_process_caches_expire_what_other_processes_bump(self):
+        import time
+        from django.core.cache.backends.locmem import LocMemCache
+        from . import availability
+
+        worker_a, worker_b = LocMemCache('worker-a', {}), LocMemCache('worker-b', {})
+        with mock.patch.object(availability, 'cache', worker_b):
+            version = availability.current_version(self.product.pk)
+            self.assertEqual(availability.availability(self.product.pk, version)['sizes'][0]['stock'], 0)
+
+        ProductSize.objects.filter(product=self.product, size='US 4').update(stock=9)
+        with mock.patch.object(availability, 'cache', worker_a):
+            availability.bump(self.product.pk)  # e.g. an import run from manage.py
+
+        with mock.patch.object(availability, 'cache', worker_b):
+            self.assertEqual(availability.current_version(self.product.pk), version)
+            later = time.time() + settings.AVAILABILITY_MAX_AGE + 1
+            with mock.patch('django.core.cache.backends.locmem.time.time', return_value=later):
+                fresh = availability.current_version(self.product.pk)
+                self.assertNotEqual(fresh, version)
+                self.assertEqual(availability.availability(self.product.pk, fresh)['sizes'][0]['stock'], 9)
+
+    def test_scheduling_or_deleting_the_product_bumps_the_version(self):
+        from django.utils import timezone
+
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.product.publish_at = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+        self.product.publish_at = None
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_product_page_is_cacheable_and_scheduled_products_are_hidden(self):
+        from django.utils import timezone
+
+        page = self.client.get(f'/product/{self.product.pk}/')
+        self.assertIn('public', page['Cache-Control'])
+        self.assertContains(page, f'data-availability-url="{self.url}"')
+        Product.objects.filter(pk=self.product.pk).update(publish_at=timezone.now())
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class CatalogueIndexTests(TestCase):
+    def setUp(self):
+        from datetime import timedelta
+        from django.core.cache import cache
+        from django.utils import timezone
+        from .catalogue import CatalogueIndex
+
+        cache.clear()
+        categories = [c for c, _ in Product.CATEGORY_CHOICES]
+        for i in range(12):
+            product = make_product(i, sizes=1 + i % 4, images=0)
+            Product.objects.filter(pk=product.pk).update(
+                category=categories[i % len(categories)], is_on_sale=i % 3 == 0, is_trending=i % 4 == 1,
+                base_price=3000 + (i * 7) % 5 * 500,
+                created_at=timezone.now() - timedelta(days=10 * i),
+            )
+        Product.objects.filter(pk=product.pk).update(publish_at=timezone.now() + timedelta(days=1))
+        self.index = CatalogueIndex()
+
+    async def database(self, **params):
+        from .views import _filter_products
+
+        args = [params.get(k) for k in ('category', 'brands', 'sizes', 'min_price', 'max_price', 'q')]
+        products, brands, _ = await _filter_products(*args, params.get('sort', 'newest'))
+        return [p.pk for p in products], brands
+
+    async def test_matches_the_database_for_every_filter_and_sort(self):
+        from asgiref.sync import sync_to_async
+
+        cases = [
+            {}, {'category': 'new'}, {'category': 'sale'}, {'category': 'trending'}, {'category': 'running'},
+            {'brands': ['Brand 1', 'Brand 2']}, {'sizes': ['US 4.5', 'US 5']}, {'min_price': '5200'},
+            {'max_price': '5050'}, {'min_price': '5100', 'max_price': '5100'}, {'q': 'shoe 1'},
+            {'category': 'sale', 'brands': ['Brand 0'], 'sizes': ['US 4.5']},
+        ]
+        for params in cases:
+            for sort in ('newest', 'price_low', 'price_high', 'name'):
+                found = await sync_to_async(self.index.search)(sort=sort, **params)
+                ids, brands = await self.database(sort=sort, **params)
+                if sort in ('price_low', 'price_high'):
+                    # Equal prices may come back in any order from SQL
+                    self.assertEqual(sorted(found.ids), sorted(ids), (params, sort))
+                else:
+                    self.assertEqual(found.ids, ids, (params, sort))
+                self.assertEqual(found.brands, brands)
+
+    def test_facet_counts_ignore_their_own_selection(self):
+        found = self.index.search(brands=['Brand 1'], sizes=['US 4.5'])
+        expected = Product.objects.visible().filter(sizes__size='US 4.5', sizes__stock__gt=0)
+        self.assertEqual(sum(found.facets['brand'].values()), expected.count())
+        self.assertEqual(found.facets['size']['US 4.5'], len(found.ids))
+
+    def test_changes_are_applied_incrementally(self):
+        self.index.search()
+        rebuild = mock.patch.object(self.index, 'rebuild', wraps=self.index.rebuild)
+        product = Product.objects.visible().order_by('pk').first()
+        with rebuild as rebuilt, self.captureOnCommitCallbacks(execute=True):
+            product.brand = 'Renamed'
+            product.save()
+            ProductSize.objects.filter(product=product, size='US 4').update(stock=5)
+            ProductSize.objects.get(product=product, size='US 4').save()
+        with rebuild as rebuilt:
+            self.assertEqual(self.index.search(brands=['Renamed']).ids, [product.pk])
+            self.assertIn(product.pk, self.index.search(sizes=['US 4']).ids)
+            rebuilt.assert_not_called()
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        self.assertEqual(self.index.search(brands=['Renamed']).ids, [])
+
+    @override_settings(CATALOGUE_INDEX_ENABLED=True,
+                       STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_shop_uses_the_index(self):
+        with mock.patch('brt.catalogue.catalogue', self.index):
+            response = self.client.get('/shop/', {'brand': 'Brand 1'})
+        self.assertContains(response, '3 products found')
+        self.assertContains(response, '<span>Brand 2 (3)</span>', html=True)
@@ -0,0 +1,169 @@
+"""Direct browser-to-storage uploads of product images.
+
+Uploading through the admin inline streams every image through a web
+worker. With Cloudinary storage, the worker then uploads it again. Direct
+uploads skip the worker entirely:
+
+1. The admin page asks ``sign()`` for a signed upload form for one file.
+   The server picks the file's key (its storage name) and signs it, with
+   the file's type and size limits.
+2. The browser posts the file straight to storage.
+3. The browser sends the storage's reply to ``register()``. That checks the
+   reply belongs to the signed key and creates the ``ProductImage`` from
+   the key and the reported width, height and size. The file itself never
+   passes through the app.
+
+Two backends are available (``DIRECT_UPLOAD_BACKEND``):
+
+- ``cloudinary``: a signed Cloudinary upload. The upload reply is signed
+  by Cloudinary too, and that signature is checked on registration.
+- ``local``: a stand-in for development and tests. It posts to
+  ``brt.views.direct_upload``, which writes to the default storage.
+"""
+import os
+import time
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.utils.crypto import constant_time_compare
+from django.urls import reverse
+
+from .models import ProductImage, product_image_path
+
+CONTENT_TYPES = {'image/jpeg': '.jpg', 'image/png': '.png', 'image/webp': '.webp'}
+TOKEN_SALT = 'brt.uploads'
+
+
+class UploadError(Exception):
+    pass
+
+
+def _limits():
+    return getattr(settings, 'DIRECT_UPLOAD_MAX_BYTES', 20 * 1024 * 1024), getattr(settings, 'DIRECT_UPLOAD_EXPIRES', 900)
+
+
+class LocalUploads:
+    """Signed form posts to this app's ``direct_upload`` view."""
+
+    signer = signing.Signer(salt='brt.uploads.local')
+
+    def form(self, key, content_type, expires):
+        max_bytes, _ = _limits()
+        fields = {'key': key, 'content_type': content_type, 'expires': str(expires), 'max_bytes': str(max_bytes)}
+        fields['signature'] = self.signer.signature(self._signed_string(fields))
+        return reverse('brt:direct_upload'), fields
+
+    def _signed_string(self, fields):
+        return '|'.join(fields[name] for name in ('key', 'content_type', 'expires', 'max_bytes'))
+
+    def receive(self, fields, upload):
+        """Store an upload posted to the stand-in endpoint; returns the reply the browser passes on."""
+        from django.core.files.images import get_image_dimensions
+
+        try:
+            valid = constant_time_compare(fields['signature'], self.signer.signature(self._signed_string(fields)))
+        except KeyError:
+            valid = False
+        if not valid:
+            raise UploadError('Invalid upload signature')
+        if int(fields['expires']) < time.time():
+            raise UploadError('Upload form has expired')
+        if upload.size > int(fields['max_bytes']):
+            raise UploadError('File is too large')
+        if upload.content_type != fields['content_type']:
+            raise UploadError('File type does not match the signed upload')
+        width, height = get_image_dimensions(upload)
+        if not width:
+            raise UploadError('File is not an image')
+        key = default_storage.save(fields['key'], upload)
+        return {'key': key, 'width': width, 'height': height, 'bytes': upload.size}
+
+    def confirm(self, key, reply):
+        if reply.get('key') != key or not default_storage.exists(key):
+            raise UploadError('Upload not found in storage')
+        return key, reply
+
+
+class CloudinaryUploads:
+    """Signed uploads to the Cloudinary upload API, named as ``MediaCloudinaryStorage`` names them."""
+
+    def _public_id(self, key):
+        from cloudinary_storage import app_settings
+
+        # The storage prefixes names with MEDIA_URL; Cloudinary keeps the
+        # extension out of the public id and serves any format from it
+        prefix = app_settings.PREFIX.strip('/')
+        return f'{prefix}/{os.path.splitext(key)[0]}' if prefix else os.path.splitext(key)[0]
+
+    def form(self, key, content_type, expires):
+        import cloudinary.utils
+        from cloudinary_storage import app_settings
+
+        config = settings.CLOUDINARY_STORAGE
+        params = {
+            'public_id': self._public_id(key),
+            'timestamp': int(time.time()),
+            'tags': app_settings.MEDIA_TAG,
+            'allowed_formats': ','.join(ext.lstrip('.') for ext in CONTENT_TYPES.values()),
+        }
+        signature = cloudinary.utils.api_sign_request(params, config['API_SECRET'])
+        fields = {**params, 'api_key': config['API_KEY'], 'signature': signature}
+        return f'https://api.cloudinary.com/v1_1/{config["CLOUD_NAME"]}/image/upload', fields
+
+    def confirm(self, key, reply):
+        import cloudinary.utils
+
+        public_id = reply.get('public_id')
+        if public_id != self._public_id(key):
+            raise UploadError('Upload reply is for a different file')
+        if not cloudinary.utils.verify_api_response_signature(public_id, reply.get('version'), reply.get('signature')):
+            raise UploadError('Invalid upload reply signature')
+        if (reply.get('bytes') or 0) > _limits()[0]:
+            raise UploadError('File is too large')
+        return public_id, reply
+
+
+BACKENDS = {'local': LocalUploads, 'cloudinary': CloudinaryUploads}
+
+
+def backend():
+    name = getattr(settings, 'DIRECT_UPLOAD_BACKEND', None)
+    if name is None:
+        name = 'cloudinary' if getattr(settings, 'USE_CLOUDINARY', False) else 'local'
+    return BACKENDS[name]()
+
+
+def sign(product, filename, content_type, size):
+    """Return ``{'url', 'fields', 'token'}`` for uploading one image of ``product``."""
+    max_bytes, lifetime = _limits()
+    if content_type not in CONTENT_TYPES:
+        raise UploadError(f'Unsupported file type: {content_type}')
+    if size > max_bytes:
+        raise UploadError(f'File is larger than {max_bytes // (1024 * 1024)} MB')
+    stem = os.path.splitext(os.path.basename(filename))[0][:50] or 'image'
+    name = f'{stem}_{uuid.uuid4().hex[:8]}{CONTENT_TYPES[content_type]}'
+    key = product_image_path(ProductImage(product=product), name)
+    url, fields = backend().form(key, content_type, int(time.time()) + lifetime)
+    token = signing.dumps({'product': product.pk, 'key': key}, salt=TOKEN_SALT)
+    return {'url': url, 'fields': fields, 'token': token}
+
+
+def register(product, token, reply):
+    """Create the ``ProductImage`` for a finished upload from its signed token and storage reply."""
+    _, lifetime = _limits()
+    try:
+        signed = signing.loads(token, salt=TOKEN_SALT, max_age=lifetime * 2)
+    except signing.BadSignature:
+        raise UploadError('Invalid or expired upload token')
+    if signed['product'] != product.pk:
+        raise UploadError('Upload belongs to a different product')
+    name, reply = backend().confirm(signed['key'], reply or {})
+    image = ProductImage(product=product, image=name,
+                         width=reply.get('width'), height=reply.get('height'), file_size=reply.get('bytes'))
+    try:
+        image.save()
+    except ValueError as e:
+        raise UploadError(str(e))
+    return image
@@ -7,8 +7,14 @@ urlpatterns = [
     path('', views.index, name='index'),
     path('shop/', views.shop, name='shop'),
     path('product/<int:product_id>/', views.product_detail, name='product_detail'),
+    path('product/<int:product_id>/availability/', views.product_availability, name='product_availability'),
     path('checkout/', views.checkout, name='checkout'),
     path('order-confirmation/<int:order_id>/', views.order_confirmation, name='order_confirmation'),
     path('track-order/', views.track_order, name='track_order'),
+    path('orders/events/', views.order_events_feed, name='order_events_feed'),
+    path('orders/<str:order_id>/events/', views.order_events, name='order_events'),
     path('privacy/', views.privacy_policy, name='privacy_policy'),
+    path('uploads/direct/', views.direct_upload, name='direct_upload'),
+    path('healthz/', views.healthz, name='healthz'),
+    path('metrics', views.metrics, name='metrics'),
 ]
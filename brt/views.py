@@ -1,43 +1,140 @@
-from django.shortcuts import render, redirect, get_object_or_404
-from django.db import models
+from django.shortcuts import render, redirect
+from django.db import DatabaseError, connection, models
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.core.exceptions import PermissionDenied
+from django.utils.cache import patch_cache_control
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
 from .models import Order, OrderItem, Product, ProductSize
+from . import events
 from django.db.models import Min, Max
+import mimetypes
+import os
+import re
 import uuid
 
 def index(request):
     return render(request, 'landingpage.html')
 
-def product_detail(request, product_id):
+# The read-heavy views below are async so that, under ASGI, a slow database
+# round-trip doesn't hold a whole worker. Everything the templates touch is
+# fetched or prefetched up front: the templates must not trigger queries.
+
+async def product_detail(request, product_id):
     """Display single product detail page with images slider and size selection"""
-    product = get_object_or_404(Product.objects.prefetch_related('images', 'sizes'), pk=product_id)
+    try:
+        product = await Product.objects.prefetch_related('images', 'sizes').aget(pk=product_id)
+    except Product.DoesNotExist:
+        raise Http404('No Product matches the given query.')
+    # Scheduled drops stay hidden until released; staff can preview them
+    if not product.is_published and product.publish_at is not None:
+        is_staff = await sync_to_async(lambda: request.user.is_active and request.user.is_staff)()
+        if not is_staff:
+            raise Http404('No Product matches the given query.')
     
-    # Get sizes with stock and price info
-    sizes = product.sizes.all().order_by('size')
+    # Get sizes with stock and price info (prefetched, ordered by size)
+    sizes = list(product.sizes.all())
     
     context = {
         'product': product,
         'sizes': sizes,
     }
-    return render(request, 'product.html', context)
+    response = render(request, 'product.html', context)
+    # Stock on the page is refreshed by product.js from product_availability,
+    # so the HTML can be cached; staff previews of scheduled drops must not be
+    if product.is_published or product.publish_at is None:
+        patch_cache_control(response, public=True, max_age=settings.PRODUCT_PAGE_MAX_AGE)
+    else:
+        patch_cache_control(response, private=True, no_store=True)
+    return response
 
-def shop(request):
-    products = Product.objects.prefetch_related('images', 'sizes').all()
-    
-    # Get all unique brands for filter
-    all_brands = Product.objects.values_list('brand', flat=True).distinct().order_by('brand')
-    all_brands = [b for b in all_brands if b]  # Remove empty brands
-    
+async def product_availability(request, product_id):
+    """Per-size stock and price for product.js, versioned by the product's stock counter."""
+    from .availability import availability, current_version, etag
+
+    version = await sync_to_async(current_version)(product_id)
+    tag = etag(product_id, version)
+    if request.headers.get('If-None-Match') == tag:
+        response = HttpResponseNotModified()
+    else:
+        payload = await sync_to_async(availability)(product_id, version)
+        if payload is None:
+            raise Http404('No Product matches the given query.')
+        response = JsonResponse(payload)
+    response['ETag'] = tag
+    patch_cache_control(response, public=True, max_age=settings.AVAILABILITY_MAX_AGE)
+    return response
+
+async def shop(request):
     # Get all available sizes for filter
     all_sizes = ProductSize.SIZE_CHOICES
     
     # Get all categories for filter
     all_categories = Product.CATEGORY_CHOICES
     
-    # Get price range for filter (from ProductSize prices)
-    price_range = ProductSize.objects.aggregate(min_price=Min('price'), max_price=Max('price'))
+    category = request.GET.get('category')
+    selected_brands = request.GET.getlist('brand')
+    selected_sizes = request.GET.getlist('size')
+    min_price = request.GET.get('min_price')
+    max_price = request.GET.get('max_price')
+    search = request.GET.get('q')
+    sort = request.GET.get('sort', 'newest')
+    
+    found = None
+    if settings.CATALOGUE_INDEX_ENABLED:
+        # Filter, sort and count in memory (brt/catalogue.py); the database
+        # only loads the matching products
+        from .catalogue import catalogue
+        found = await sync_to_async(catalogue.search)(
+            category=category, brands=selected_brands, sizes=selected_sizes,
+            min_price=min_price, max_price=max_price, q=search, sort=sort,
+        )
+    if found is not None:
+        by_pk = await Product.objects.prefetch_related('images', 'sizes').ain_bulk(found.ids)
+        products = [by_pk[pk] for pk in found.ids if pk in by_pk]
+        all_brands = found.brands
+        price_range = found.price_range
+        brand_counts = found.facets['brand']
+    else:
+        products, all_brands, price_range = await _filter_products(
+            category, selected_brands, selected_sizes, min_price, max_price, search, sort,
+        )
+        brand_counts = {}
+    
+    context = {
+        'products': products,
+        'all_brands': all_brands,
+        'brand_options': [(brand, brand_counts.get(brand)) for brand in all_brands],
+        'all_sizes': all_sizes,
+        'all_categories': all_categories,
+        'selected_brands': selected_brands,
+        'selected_sizes': selected_sizes,
+        'selected_category': category or '',
+        'min_price': min_price or '',
+        'max_price': max_price or '',
+        'price_range': price_range,
+        'current_sort': sort,
+        'search_query': search or '',
+    }
+    
+    return render(request, 'shop.html', context)
+
+async def _filter_products(category, selected_brands, selected_sizes, min_price, max_price, search, sort):
+    """The shop's filters and sort as SQL; returns (products, brands, price range)."""
+    products = Product.objects.visible().prefetch_related('images', 'sizes')
+    
+    # Get all unique brands for filter
+    all_brands = Product.objects.visible().values_list('brand', flat=True).distinct().order_by('brand')
+    all_brands = [b async for b in all_brands if b]  # Remove empty brands
+    
+    # Get price range for filter (from the sizes of visible products)
+    price_range = await ProductSize.objects.filter(product__in=Product.objects.visible()).aaggregate(
+        min_price=Min('price'), max_price=Max('price'))
     
     # Filter by category (from landing page links)
-    category = request.GET.get('category')
     if category:
         if category == 'new':
             # New arrivals - products from last 30 days or marked as new
@@ -55,30 +152,24 @@ def shop(request):
             products = products.filter(category=category)
     
     # Filter by brand(s) if provided
-    selected_brands = request.GET.getlist('brand')
     if selected_brands:
         products = products.filter(brand__in=selected_brands)
     
     # Filter by size(s) if provided
-    selected_sizes = request.GET.getlist('size')
     if selected_sizes:
         products = products.filter(sizes__size__in=selected_sizes, sizes__stock__gt=0).distinct()
     
     # Filter by price range (checks if any size falls within range)
-    min_price = request.GET.get('min_price')
-    max_price = request.GET.get('max_price')
     if min_price:
         products = products.filter(sizes__price__gte=min_price).distinct()
     if max_price:
         products = products.filter(sizes__price__lte=max_price).distinct()
     
     # Filter by search query
-    search = request.GET.get('q')
     if search:
         products = products.filter(name__icontains=search)
     
     # Sort products
-    sort = request.GET.get('sort', 'newest')
     if sort == 'price_low':
         products = products.order_by('base_price')
     elif sort == 'price_high':
@@ -88,22 +179,7 @@ def shop(request):
     else:  # newest
         products = products.order_by('-created_at')
     
-    context = {
-        'products': products,
-        'all_brands': all_brands,
-        'all_sizes': all_sizes,
-        'all_categories': all_categories,
-        'selected_brands': selected_brands,
-        'selected_sizes': selected_sizes,
-        'selected_category': category or '',
-        'min_price': min_price or '',
-        'max_price': max_price or '',
-        'price_range': price_range,
-        'current_sort': sort,
-        'search_query': search or '',
-    }
-    
-    return render(request, 'shop.html', context)
+    return [product async for product in products], all_brands, price_range
 
 def checkout(request):
     """Handle checkout form submission"""
@@ -141,7 +217,7 @@ def checkout(request):
             quantity=1
         )
         
-        return redirect('order_confirmation', order_id=order.id)
+        return redirect('brt:order_confirmation', order_id=order.id)
     
     return render(request, 'checkout.html')
 
@@ -152,14 +228,178 @@ def order_confirmation(request, order_id):
     return render(request, 'order_confirmation.html', {'order': order})
 
 
-def track_order(request):
+async def track_order(request):
     """Track order by order ID"""
     order_id = request.GET.get('id')
     try:
-        order = Order.objects.get(order_id=order_id)
+        order = await Order.objects.aget(order_id=order_id)
         return render(request, 'track_order.html', {'order': order})
     except Order.DoesNotExist:
         return render(request, 'track_order.html', {'error': 'Order not found'})
 
+def _sse_response(stream):
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # don't let proxies buffer the stream
+    return response
+
+
+async def order_events(request, order_id):
+    """Server-sent event stream of status changes for a single order.
+
+    Under ASGI the connection stays open and polls the shared cache. Sync
+    (WSGI) workers can't afford to hold it, so they answer with the current
+    status once and let EventSource reconnect after the retry interval.
+    """
+    initial = await events.alatest(order_id)
+    if initial is None:
+        order = await Order.objects.filter(order_id=order_id).afirst()
+        if order is None:
+            raise Http404('Order not found')
+        initial = events.build_event(order)
+
+    if not isinstance(request, ASGIRequest):
+        return _sse_response([events.format_retry(), events.format_sse(initial)])
+    return _sse_response(events.order_stream(order_id, initial))
+
+
+async def order_events_feed(request):
+    """Server-sent event stream of every order status change (staff only)."""
+    is_staff = await sync_to_async(lambda: request.user.is_active and request.user.is_staff)()
+    if not is_staff:
+        raise PermissionDenied
+
+    try:
+        last_seq = int(request.headers.get('Last-Event-ID') or request.GET.get('last', 0))
+    except ValueError:
+        last_seq = 0
+
+    if not isinstance(request, ASGIRequest):
+        _, backlog = await events.aevents_since(last_seq) if last_seq else (0, [])
+        return _sse_response([events.format_retry()] + [events.format_sse(e) for e in backlog])
+    return _sse_response(events.feed_stream(last_seq))
+
+
+def healthz(request):
+    """Health check: 200 when the database answers, 503 otherwise."""
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except DatabaseError:
+        return JsonResponse({'status': 'unavailable'}, status=503)
+    return JsonResponse({'status': 'ok'})
+
+
+def metrics(request):
+    """Prometheus text exposition of this process's metrics registry."""
+    from django.utils.crypto import constant_time_compare
+    from .metrics import REGISTRY
+
+    token = settings.METRICS_TOKEN
+    if token:
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if not constant_time_compare(supplied, token):
+            raise PermissionDenied
+    elif not (settings.DEBUG or request.user.is_staff):
+        raise PermissionDenied
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _read_range(f, length, block_size=64 * 1024):
+    try:
+        while length > 0:
+            data = f.read(min(block_size, length))
+            if not data:
+                return
+            length -= len(data)
+            yield data
+    finally:
+        f.close()
+
+
+def media(request, path):
+    """Serve an uploaded file from MEDIA_ROOT when Cloudinary isn't in use.
+
+    Supports conditional requests and single byte ranges. Whole files and
+    open-ended ranges are returned as a seeked file object, so gunicorn can
+    hand them to sendfile() instead of copying through Python.
+    """
+    from django.utils._os import safe_join
+    from django.utils.http import http_date
+    from django.views.static import was_modified_since
+    from django.core.exceptions import SuspiciousFileOperation
+
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Not found')
+    if not os.path.isfile(fullpath):
+        raise Http404('Not found')
+
+    stat = os.stat(fullpath)
+    size = stat.st_size
+    etag = f'"{stat.st_mtime_ns:x}-{size:x}"'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Accept-Ranges': 'bytes',
+        # Upload names are never reused (the storage adds a suffix on clashes)
+        'Cache-Control': f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}',
+    }
+    if_none_match = request.headers.get('If-None-Match')
+    if (if_none_match and etag in if_none_match) or (
+        not if_none_match and not was_modified_since(request.headers.get('If-Modified-Since'), stat.st_mtime)
+    ):
+        return HttpResponseNotModified(headers=headers)
+
+    content_type = mimetypes.guess_type(fullpath)[0] or 'application/octet-stream'
+    match = RANGE_RE.match(request.headers.get('Range', ''))
+    if_range = request.headers.get('If-Range')
+    if not match or not any(match.groups()) or (if_range and if_range != etag):
+        return FileResponse(open(fullpath, 'rb'), content_type=content_type, headers=headers)
+
+    first, last = match.groups()
+    if first:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    else:
+        start, end = max(0, size - int(last)), size - 1  # suffix range: last N bytes
+    if start >= size or start > end:
+        return HttpResponse(status=416, headers={**headers, 'Content-Range': f'bytes */{size}'})
+
+    f = open(fullpath, 'rb')
+    f.seek(start)
+    length = end - start + 1
+    content = f if end == size - 1 else _read_range(f, length)
+    response = FileResponse(content, status=206, content_type=content_type, headers=headers)
+    response['Content-Length'] = length
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
+
+
+@csrf_exempt
+@require_POST
+def direct_upload(request):
+    """Local stand-in for the storage service's upload endpoint (brt/uploads.py).
+
+    Authorised by the signed form fields rather than a session, like the
+    real service; only used when DIRECT_UPLOAD_BACKEND is ``local``.
+    """
+    from .uploads import LocalUploads, UploadError, backend
+
+    if not isinstance(backend(), LocalUploads):
+        raise Http404('Not found')
+    upload = request.FILES.get('file')
+    if upload is None:
+        return JsonResponse({'error': 'No file'}, status=400)
+    try:
+        reply = LocalUploads().receive(request.POST.dict(), upload)
+    except (UploadError, ValueError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(reply, status=201)
+
+
 def privacy_policy(request):
     return render(request, 'privacy.html')
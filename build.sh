@@ -5,7 +5,8 @@ set -o errexit
 # Install dependencies
 pip install -r requirements.txt
 
-# Collect static files
+# Build critical CSS and minified bundles (static/dist), then collect and fingerprint
+python manage.py build_assets
 python manage.py collectstatic --no-input
 
 # Run migrations
@@ -0,0 +1,128 @@
+"""Gunicorn settings for production.
+
+Gunicorn picks this file up automatically when started from the project root
+(see start.sh). Everything can be overridden through environment variables:
+
+    GUNICORN_WORKER_CLASS   sync (default), gthread, or uvicorn (ASGI via sidestep.asgi)
+    WEB_CONCURRENCY         number of worker processes (default: derived from CPU and memory)
+    GUNICORN_THREADS        threads per worker in gthread mode (default 4)
+    GUNICORN_WORKER_MEMORY_MB  expected RSS per worker, used to cap the worker count (default 150)
+    GUNICORN_PRELOAD        load the app once in the master before forking (default true)
+    GUNICORN_TIMEOUT, GUNICORN_KEEPALIVE, GUNICORN_MAX_REQUESTS, GUNICORN_MAX_REQUESTS_JITTER
+"""
+import math
+import multiprocessing
+import os
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _cpu_count():
+    """CPUs actually available to this container (cgroup quota aware)."""
+    quota = _read('/sys/fs/cgroup/cpu.max')  # cgroup v2: "<quota> <period>" or "max <period>"
+    if quota and not quota.startswith('max'):
+        limit, period = quota.split()
+        return max(1, math.ceil(int(limit) / int(period)))
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+
+def _memory_mb():
+    """Memory available to this container in MB, or None if unknown."""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        value = _read(path)
+        if value and value.isdigit() and int(value) < 1 << 50:
+            return int(value) // (1024 * 1024)
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+mode = os.environ.get('GUNICORN_WORKER_CLASS', 'sync').lower()
+cpus = _cpu_count()
+
+if mode == 'uvicorn':
+    # One event loop per core handles many concurrent I/O-bound requests
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    wsgi_app = 'sidestep.asgi:application'
+    by_cpu = cpus
+elif mode == 'gthread':
+    worker_class = 'gthread'
+    wsgi_app = 'sidestep.wsgi:application'
+    threads = _env_int('GUNICORN_THREADS', 4)
+    by_cpu = cpus + 1
+else:
+    worker_class = 'sync'
+    wsgi_app = 'sidestep.wsgi:application'
+    by_cpu = cpus * 2 + 1
+
+# Leave ~20% headroom so a traffic spike doesn't push the container into OOM kills
+memory = _memory_mb()
+by_memory = max(1, int(memory * 0.8) // _env_int('GUNICORN_WORKER_MEMORY_MB', 150)) if memory else by_cpu
+workers = _env_int('WEB_CONCURRENCY', max(1, min(by_cpu, by_memory)))
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+# Import Django once in the master; workers fork with the app already loaded,
+# which cuts cold start and per-worker memory (copy-on-write)
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+# Recycle workers periodically to cap slow memory growth; jitter keeps them
+# from all restarting at the same moment
+max_requests = _env_int('GUNICORN_MAX_REQUESTS', 1000)
+max_requests_jitter = _env_int('GUNICORN_MAX_REQUESTS_JITTER', 100)
+
+timeout = _env_int('GUNICORN_TIMEOUT', 30)
+graceful_timeout = _env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+# Render's proxy reuses upstream connections; keep them open a little longer than the default 2s
+keepalive = _env_int('GUNICORN_KEEPALIVE', 5)
+
+# Worker heartbeat files on tmpfs avoid stalls when the disk is slow
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    # Never share a database connection opened in the master with the workers
+    if server.cfg.preload_app:
+        from django.db import connections
+        connections.close_all()
+
+
+def post_worker_init(worker):
+    # Send any social posts a previous worker left queued (brt/outbound.py)
+    from brt.outbound import scheduler
+    scheduler.wake()
+
+
+def worker_exit(server, worker):
+    # Let the running posting job finish; queued ones stay saved for the next worker
+    from brt.outbound import scheduler
+    scheduler.stop(timeout=server.cfg.graceful_timeout)
+
+
+def when_ready(server):
+    server.log.info(
+        'Serving %s with %d %s worker(s)%s, preload=%s',
+        wsgi_app, workers, worker_class,
+        f' x {threads} threads' if worker_class == 'gthread' else '', preload_app,
+    )
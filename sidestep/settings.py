@@ -1,10 +1,13 @@
 
 import os
+import sys
 # Facebook/Instagram Access Tokens and IDs (for auto-posting)
 FACEBOOK_PAGE_ACCESS_TOKEN = os.environ.get('FACEBOOK_PAGE_ACCESS_TOKEN')
 FACEBOOK_PAGE_ID = os.environ.get('FACEBOOK_PAGE_ID')
 INSTAGRAM_BUSINESS_ACCOUNT_ID = os.environ.get('INSTAGRAM_BUSINESS_ACCOUNT_ID')
 FACEBOOK_APP_SECRET = os.environ.get('FACEBOOK_APP_SECRET')
+# Graph API host; overridden in tests to point at a local stub server
+GRAPH_API_BASE_URL = os.environ.get('GRAPH_API_BASE_URL', 'https://graph.facebook.com')
 
 from pathlib import Path
 import dj_database_url
@@ -47,6 +50,9 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'brt.middleware.PerformanceMiddleware',
+    'brt.middleware.NPlusOneMiddleware',
+    'brt.routers.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -78,12 +84,151 @@ WSGI_APPLICATION = 'sidestep.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
+#
+# DB_POOL_MODE picks how connections are managed:
+#   persistent (default) - each worker keeps its own connection for CONN_MAX_AGE seconds
+#   pgbouncer            - DATABASE_URL points at a transaction-mode pooler (PgBouncer,
+#                          Neon's "-pooler" host). Connections are released after every
+#                          request and server-side cursors are disabled, since a
+#                          cursor can't outlive the transaction that owns its backend.
+# CONN_HEALTH_CHECKS re-validates a reused connection before each request, so a
+# connection the server dropped while idle (e.g. Neon suspending) is replaced
+# instead of failing the first request after a quiet period.
+
+DB_POOL_MODE = os.environ.get('DB_POOL_MODE', 'persistent').lower()
+DB_POOLED = DB_POOL_MODE == 'pgbouncer'
+
+_db_config = dict(
+    conn_max_age=int(os.environ.get('CONN_MAX_AGE', 0 if DB_POOLED else 600)),
+    conn_health_checks=os.environ.get('CONN_HEALTH_CHECKS', 'true').lower() == 'true',
+    ssl_require=(not DEBUG),
+)
+
 DATABASES = {
-    'default': dj_database_url.config(
-        default='sqlite:///' + str(BASE_DIR / 'db.sqlite3'),
-        conn_max_age=int(os.environ.get('CONN_MAX_AGE', 600)),
-        ssl_require=(not DEBUG),
-    )
+    'default': dj_database_url.config(default='sqlite:///' + str(BASE_DIR / 'db.sqlite3'), **_db_config)
+}
+
+# Optional read replica for catalogue reads (Product, ProductSize, ProductImage);
+# see brt/routers.py. Tests run it as a mirror of the default database.
+DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+if DATABASE_REPLICA_URL:
+    DATABASES['replica'] = dj_database_url.parse(DATABASE_REPLICA_URL, **_db_config)
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['brt.routers.CatalogueReplicaRouter']
+
+# After a write, the browser reads from the primary for this many seconds so
+# it never sees replica lag (read-your-writes)
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 10))
+
+# Postgres session limits, in milliseconds (0 disables). The statement timeout
+# is for serving requests: manage.py commands (migrate, rollup rebuilds,
+# exports, media migration, release_products) run without one
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 15000))
+_MANAGEMENT_COMMAND = os.path.basename(sys.argv[0]) == 'manage.py'
+if _MANAGEMENT_COMMAND:
+    DB_STATEMENT_TIMEOUT_MS = 0
+DB_IDLE_IN_TRANSACTION_TIMEOUT_MS = int(os.environ.get('DB_IDLE_IN_TRANSACTION_TIMEOUT_MS', 60000))
+
+for _db in DATABASES.values():
+    if _db['ENGINE'] != 'django.db.backends.postgresql':
+        continue
+    _db_options = _db.setdefault('OPTIONS', {})
+    _db_options.update({
+        'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', 5)),
+        # TCP keepalives notice a silently dropped connection in seconds, not minutes
+        'keepalives': 1,
+        'keepalives_idle': 30,
+        'keepalives_interval': 10,
+        'keepalives_count': 3,
+    })
+    if DB_POOLED:
+        _db['DISABLE_SERVER_SIDE_CURSORS'] = True
+    else:
+        # Transaction poolers reject startup parameters and don't keep session
+        # state, so with pgbouncer set these on the role instead, e.g.
+        #   ALTER ROLE <user> SET statement_timeout = '15s';
+        _session = []
+        # Commands send 0 explicitly, which also overrides a timeout set on the role
+        if DB_STATEMENT_TIMEOUT_MS or _MANAGEMENT_COMMAND:
+            _session.append(f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}')
+        if DB_IDLE_IN_TRANSACTION_TIMEOUT_MS:
+            _session.append(f'-c idle_in_transaction_session_timeout={DB_IDLE_IN_TRANSACTION_TIMEOUT_MS}')
+        if _session:
+            _db_options['options'] = ' '.join(_session)
+
+
+# Cache
+# Set REDIS_URL so every worker shares one cache (order status events,
+# product announcement debouncing). Without it each process gets its own memory cache.
+
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+
+# Order status server-sent events (see brt/events.py)
+ORDER_EVENTS_POLL_INTERVAL = float(os.environ.get('ORDER_EVENTS_POLL_INTERVAL', 1.0))
+ORDER_EVENTS_STREAM_TIMEOUT = int(os.environ.get('ORDER_EVENTS_STREAM_TIMEOUT', 300))
+
+# Request instrumentation (brt/middleware.py): fraction of requests sampled
+# (0 turns the middleware off entirely) and whether to expose Server-Timing
+PERF_SAMPLE_RATE = float(os.environ.get('PERF_SAMPLE_RATE', 0))
+PERF_SERVER_TIMING = os.environ.get('PERF_SERVER_TIMING', str(DEBUG)).lower() == 'true'
+
+# Report requests that repeat one query shape NPLUSONE_THRESHOLD+ times
+# (brt/nplusone.py); meant for local development
+NPLUSONE_ENABLED = os.environ.get('NPLUSONE_ENABLED', 'false').lower() == 'true'
+NPLUSONE_THRESHOLD = int(os.environ.get('NPLUSONE_THRESHOLD', 3))
+NPLUSONE_RAISE = os.environ.get('NPLUSONE_RAISE', 'false').lower() == 'true'
+
+# Bearer token for /metrics. Without one, only staff (or DEBUG) can read it
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Outbound Graph API rate limiting (brt/outbound.py): calls per second and
+# burst size per bucket (app, page, Instagram account), and how long to back
+# off after a rate-limit error when Facebook doesn't say
+GRAPH_RATE_PER_SECOND = float(os.environ.get('GRAPH_RATE_PER_SECOND', 2.0))
+GRAPH_BURST = int(os.environ.get('GRAPH_BURST', 20))
+GRAPH_THROTTLE_PAUSE = int(os.environ.get('GRAPH_THROTTLE_PAUSE', 60))
+# Seconds a worker holds a posting job; if it dies mid-job the job runs again after this
+GRAPH_JOB_LEASE = int(os.environ.get('GRAPH_JOB_LEASE', 15 * 60))
+
+# Image URL checks before posting are cached in the shared cache: successes
+# for IMAGE_VERIFY_TTL seconds (then revalidated with ETag/Last-Modified),
+# failures for IMAGE_VERIFY_FAILURE_TTL. A product's images are checked
+# IMAGE_VERIFY_CONCURRENCY at a time.
+IMAGE_VERIFY_TTL = int(os.environ.get('IMAGE_VERIFY_TTL', 3600))
+IMAGE_VERIFY_FAILURE_TTL = int(os.environ.get('IMAGE_VERIFY_FAILURE_TTL', 60))
+IMAGE_VERIFY_CONCURRENCY = int(os.environ.get('IMAGE_VERIFY_CONCURRENCY', 8))
+
+# Image saves for one product are coalesced into a single social post, made
+# this many seconds after the last save (brt/debounce.py)
+ANNOUNCE_QUIET_SECONDS = float(os.environ.get('ANNOUNCE_QUIET_SECONDS', 10))
+
+# Logging: the brt app (social posting pipeline) logs JSON lines to stdout
+# through a background queue listener (brt/log.py). API response bodies are
+# logged for errors and for LOG_PAYLOAD_SAMPLE_RATE of successful calls.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_PAYLOAD_SAMPLE_RATE = float(os.environ.get('LOG_PAYLOAD_SAMPLE_RATE', 0.1))
+LOG_PAYLOAD_MAX_CHARS = int(os.environ.get('LOG_PAYLOAD_MAX_CHARS', 2000))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'brt.log.JsonFormatter'},
+    },
+    'handlers': {
+        'queue': {'()': 'brt.log.QueueHandler', 'formatter': 'json'},
+    },
+    'loggers': {
+        'brt': {'handlers': ['queue'], 'level': LOG_LEVEL, 'propagate': False},
+    },
 }
 
 
@@ -125,12 +270,25 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
-# WhiteNoise for serving static files in production
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# WhiteNoise for serving static files in production. The storage losslessly
+# recompresses PNG/JPEG before hashing; WhiteNoise writes .gz and .br copies
+# of text assets and serves hashed names with immutable, far-future headers.
+STATICFILES_STORAGE = 'brt.storage.OptimizedStaticFilesStorage'
 
 # Media files (user uploads)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Answer shop filters, sorting and brand counts from an in-process index
+# (brt/catalogue.py) instead of SQL joins; needs the shared cache (REDIS_URL)
+# with more than one worker process so every index sees changes
+CATALOGUE_INDEX_ENABLED = os.environ.get('CATALOGUE_INDEX_ENABLED', 'false').lower() == 'true'
+
+# Browser/CDN cache lifetimes for product pages and their live stock JSON
+# (brt/availability.py); product.js refreshes stock on the cached page
+PRODUCT_PAGE_MAX_AGE = int(os.environ.get('PRODUCT_PAGE_MAX_AGE', 600))
+AVAILABILITY_MAX_AGE = int(os.environ.get('AVAILABILITY_MAX_AGE', 5))
+# Browser cache lifetime for media served from MEDIA_ROOT (brt.views.media)
+MEDIA_CACHE_MAX_AGE = int(os.environ.get('MEDIA_CACHE_MAX_AGE', 60 * 60 * 24 * 30))
 
 # Cloudinary configuration
 CLOUDINARY_STORAGE = {
@@ -139,10 +297,19 @@ CLOUDINARY_STORAGE = {
     'API_SECRET': os.environ.get('CLOUDINARY_API_SECRET', 'your-api-secret'),
 }
 
-# Use Cloudinary for media storage in production
-if not DEBUG:
+# Use Cloudinary for media storage in production when it's configured;
+# otherwise media is stored in MEDIA_ROOT and served by the app
+USE_CLOUDINARY = not DEBUG and bool(os.environ.get('CLOUDINARY_CLOUD_NAME'))
+if USE_CLOUDINARY:
     DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
 
+# Admin image uploads go from the browser straight to storage (brt/uploads.py):
+# cloudinary, or local (the app's own stand-in endpoint). Defaults to match USE_CLOUDINARY
+DIRECT_UPLOAD_BACKEND = os.environ.get('DIRECT_UPLOAD_BACKEND') or ('cloudinary' if USE_CLOUDINARY else 'local')
+DIRECT_UPLOAD_MAX_BYTES = int(os.environ.get('DIRECT_UPLOAD_MAX_BYTES', 20 * 1024 * 1024))
+# Lifetime of a signed upload form, in seconds
+DIRECT_UPLOAD_EXPIRES = int(os.environ.get('DIRECT_UPLOAD_EXPIRES', 900))
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -0,0 +1,17 @@
+#!/usr/bin/env bash
+# Start the web server (settings in gunicorn.conf.py).
+# Migrations and collectstatic already run in build.sh, so they are skipped
+# here unless RUN_MIGRATIONS_ON_START=true (e.g. hosts without a build step).
+set -o errexit
+
+if [ "${RUN_MIGRATIONS_ON_START:-false}" = "true" ]; then
+  python manage.py migrate --noinput
+fi
+
+# createsuperuser reads DJANGO_SUPERUSER_USERNAME/_EMAIL/_PASSWORD; it fails
+# once the user exists, which must not stop the server from starting
+if [ -n "${DJANGO_SUPERUSER_USERNAME:-}" ]; then
+  python manage.py createsuperuser --noinput || echo "Superuser not created (it may already exist)"
+fi
+
+exec gunicorn --config gunicorn.conf.py
@@ -0,0 +1,64 @@
+// Product admin: upload images straight to storage (brt/uploads.py).
+// For each file: ask the app for a signed form, post the file to storage,
+// then register the storage's reply with the app.
+(function () {
+  function csrfToken() {
+    var input = document.querySelector('input[name=csrfmiddlewaretoken]');
+    return input ? input.value : '';
+  }
+
+  function postJson(url, body) {
+    return fetch(url, {
+      method: 'POST',
+      credentials: 'same-origin',
+      headers: {'Content-Type': 'application/json', 'X-CSRFToken': csrfToken()},
+      body: JSON.stringify(body)
+    }).then(function (response) {
+      return response.json().then(function (data) {
+        if (!response.ok) throw new Error(data.error || response.statusText);
+        return data;
+      });
+    });
+  }
+
+  function upload(box, file, status) {
+    return postJson(box.dataset.signUrl, {filename: file.name, content_type: file.type, size: file.size})
+      .then(function (signed) {
+        var form = new FormData();
+        Object.keys(signed.fields).forEach(function (name) { form.append(name, signed.fields[name]); });
+        form.append('file', file);
+        status.textContent = file.name + ': uploading…';
+        return fetch(signed.url, {method: 'POST', body: form}).then(function (response) {
+          return response.json().then(function (reply) {
+            if (!response.ok) throw new Error((reply.error && (reply.error.message || reply.error)) || response.statusText);
+            return postJson(box.dataset.registerUrl, {token: signed.token, reply: reply});
+          });
+        });
+      })
+      .then(function () { status.textContent = file.name + ': done'; })
+      .catch(function (error) { status.textContent = file.name + ': ' + error.message; throw error; });
+  }
+
+  document.addEventListener('DOMContentLoaded', function () {
+    var box = document.getElementById('direct-upload');
+    if (!box) return;
+    var input = box.querySelector('input[type=file]');
+    var list = box.querySelector('.direct-upload-status');
+    input.addEventListener('change', function () {
+      var files = Array.prototype.slice.call(input.files);
+      var failed = false;
+      // One at a time, in the order picked, so the images keep that order
+      files.reduce(function (previous, file) {
+        var status = document.createElement('li');
+        status.textContent = file.name + ': waiting';
+        list.appendChild(status);
+        return previous.then(function () {
+          return upload(box, file, status).catch(function () { failed = true; });
+        });
+      }, Promise.resolve()).then(function () {
+        input.value = '';
+        if (!failed) window.location.reload();
+      });
+    });
+  });
+})();
@@ -1,16 +1,68 @@
-sizeOptions = document.querySelectorAll(".sizeTable > button");
+// Live size availability. The page itself may be served from cache, so the
+// stock and prices baked into the size buttons are refreshed from the
+// product's availability endpoint (brt/availability.py): on load, when the
+// tab becomes visible again, and every 30 seconds while it is visible.
+// Unchanged stock costs a 304 with no body.
 
-sizeOptions.forEach(item => { 
-  item.addEventListener('click', (event) => {
-    const wasSelected = item.classList.contains('selectedSize');
-    sizeOptions.forEach(item => {
-      item.classList.remove('selectedSize');
-      document.body.classList.remove('sizeSelected'); 
+(function () {
+  const grid = document.querySelector('.size_grid[data-availability-url]');
+  if (!grid) return;
+  const REFRESH_MS = 30000;
+
+  function renderStatus(inStock) {
+    const status = document.querySelector('.in_stock, .out_of_stock_text');
+    if (!status) return;
+    status.className = inStock ? 'in_stock' : 'out_of_stock_text';
+    status.innerHTML = inStock
+      ? '<i class="fas fa-check-circle"></i> In Stock'
+      : '<i class="fas fa-times-circle"></i> Out of Stock';
+  }
+
+  function render(data) {
+    data.sizes.forEach(size => {
+      const btn = grid.querySelector(`.size_btn[data-size="${size.size}"]`);
+      if (!btn) return;
+      const soldOut = size.stock <= 0;
+      btn.dataset.price = size.price;
+      btn.dataset.stock = size.stock;
+      btn.disabled = soldOut;
+      btn.classList.toggle('out_of_stock', soldOut);
+      let mark = btn.querySelector('.x_mark');
+      if (soldOut && !mark) {
+        mark = document.createElement('span');
+        mark.className = 'x_mark';
+        mark.textContent = '✕';
+        btn.appendChild(mark);
+      } else if (!soldOut && mark) {
+        mark.remove();
+      }
+      if (btn.classList.contains('selected')) {
+        const selectedPrice = document.getElementById('selected_price');
+        if (soldOut) {
+          // The selected size just sold out
+          btn.classList.remove('selected');
+          document.getElementById('selected_size').textContent = '-';
+          selectedPrice.textContent = data.price_range;
+          document.querySelector('.add_to_cart').disabled = true;
+        } else {
+          selectedPrice.textContent = '₱' + parseFloat(size.price).toLocaleString();
+        }
+      }
     });
-    if (!wasSelected) {
-      item.classList.add('selectedSize');
-      document.body.classList.add('sizeSelected');
-      // console.log('Size ' + item.textContent + ' was selected');
-    }
-  });
-});
\ No newline at end of file
+    const price = document.querySelector('.price_display .price');
+    if (price) price.textContent = data.price_range;
+    renderStatus(data.in_stock);
+  }
+
+  function refresh() {
+    if (document.hidden) return;
+    fetch(grid.dataset.availabilityUrl, {cache: 'no-cache'})
+      .then(response => (response.ok ? response.json() : null))
+      .then(data => { if (data) render(data); })
+      .catch(() => {});
+  }
+
+  refresh();
+  setInterval(refresh, REFRESH_MS);
+  document.addEventListener('visibilitychange', refresh);
+})();
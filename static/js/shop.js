@@ -2,12 +2,39 @@
 
 const slideAreas = document.querySelectorAll('div.slides');
 
-//loop over each image container and select all images in each container
+// Only the primary image is in the page; the others are listed in the
+// container's data-slides (src, width, height) and added on first hover or
+// click. They follow the primary in DOM order, so clicks still step through
+// them in order, and sit underneath it: the primary gets the starting z-index.
+
+function loadSlides(slideArea) {
+	const pending = slideArea.dataset.slides;
+	if (!pending) {
+		return;
+	}
+	delete slideArea.dataset.slides;
+	const primary = slideArea.querySelector('.sneaker_img');
+	primary.style.zIndex = 1;
+	JSON.parse(pending).forEach(slide => {
+		const image = document.createElement('img');
+		image.src = slide.src;
+		if (slide.width && slide.height) {
+			image.width = slide.width;
+			image.height = slide.height;
+		}
+		image.loading = 'lazy';
+		image.decoding = 'async';
+		image.alt = primary.alt;
+		image.className = 'sneaker_img product_img';
+		slideArea.appendChild(image);
+	});
+}
+
+//loop over each image container
 
 slideAreas.forEach(slideArea => {
-	const images = slideArea.querySelectorAll('.sneaker_img');
 
-// keep track of slides 
+// keep track of slides
 
 let currentSlide = 0;
 let z = 1;
@@ -15,6 +42,8 @@ let z = 1;
 // when slide area is clicked change based on z-index
 
 slideArea.addEventListener('click', function() {
+		loadSlides(slideArea);
+		const images = slideArea.querySelectorAll('.sneaker_img');
 		currentSlide = currentSlide + 1;
 		if(currentSlide > images.length - 1) {
 			 	currentSlide = 0;
@@ -32,10 +61,11 @@ slideArea.addEventListener('click', function() {
 // When mouse over slide area, put all images in random place
 
 slideArea.addEventListener('mouseover', function() {
-	images.forEach(image => {
+	loadSlides(slideArea);
+	slideArea.querySelectorAll('.sneaker_img').forEach(image => {
 		const x = 10 * (Math.floor(Math.random() * 4)) - 15;
 		const y = 10 * (Math.floor(Math.random() * 4)) - 15;
-		
+
 		image.style.transform = `translate(${x}px, ${y}px)`;
 	})
 });
@@ -43,9 +73,9 @@ slideArea.addEventListener('mouseover', function() {
 // When mouse away, put images back
 
 slideArea.addEventListener('mouseout', function() {
-	images.forEach(image => {
+	slideArea.querySelectorAll('.sneaker_img').forEach(image => {
 		image.style.transform = '';
 	})
 });
-	
-});
\ No newline at end of file
+
+});